@@ -1,6 +1,20 @@
 const API_URL = "http://localhost:5000";
 
 
+// As datas chegam da API em ISO 8601; a formatação para exibição fica no front
+function formatarData(iso, formato = 'completa') {
+    if (!iso) return "-";
+    const d = new Date(iso);
+    if (isNaN(d)) return iso;
+    const p = (n) => String(n).padStart(2, '0');
+    const dia = `${p(d.getDate())}/${p(d.getMonth() + 1)}`;
+    const hora = `${p(d.getHours())}:${p(d.getMinutes())}`;
+    if (formato === 'dia') return dia;
+    if (formato === 'curta') return `${dia} ${hora}`;
+    return `${dia}/${d.getFullYear()} às ${hora}`;
+}
+
+
 function getUsuario() {
     const u = localStorage.getItem('usuario');
     return u ? JSON.parse(u) : null;
@@ -17,7 +17,7 @@ document.addEventListener("DOMContentLoaded", async () => {
         return tratado;
     }
 
-    function addMessage(text, sender = "user") {
+    function addMessage(text, sender = "user", antesDe = null) {
         const msgContainer = document.createElement("div");
         msgContainer.style.display = "flex";
         msgContainer.style.flexDirection = "column";
@@ -80,6 +80,15 @@ document.addEventListener("DOMContentLoaded", async () => {
             msgContainer.appendChild(btnWrapper);
         }
 
+        if (antesDe) {
+            // Página antiga entrando no topo: mantém a rolagem onde o usuário estava
+            messagesContainer.insertBefore(msgContainer, antesDe);
+            if (sender === "bot" && window.MathJax) {
+                window.MathJax.typesetPromise([msg]).catch((err) => console.log('Erro MathJax:', err));
+            }
+            return msgContainer;
+        }
+
         messagesContainer.appendChild(msgContainer);
 
         if (sender === "bot" && window.MathJax) {
@@ -89,40 +98,33 @@ document.addEventListener("DOMContentLoaded", async () => {
         } else {
             messagesContainer.scrollTop = messagesContainer.scrollHeight;
         }
+        return msgContainer;
     }
 
     async function enviarParaBackend(texto) {
         showLoading();
 
-        function getTruncatedHistory(conv, maxItems = 12, maxChars = 1500) {
-            const recent = conv.slice(-maxItems);
-            return recent.map(msg => ({
-                role: msg.role,
-                content: (typeof msg.content === 'string') ? msg.content.slice(0, maxChars) : ''
-            }));
-        }
-
         try {
-            const truncated = getTruncatedHistory(conversation, 12, 1500);
-            
+            // O contexto da conversa é montado no servidor a partir da sessão ativa
             const payload = {
                 usuario_id: user.id, 
-                message: texto,                     
-                history: truncated
+                message: texto
             };
 
-            const response = await fetch("http://localhost:5000/api/chat", {
+            const response = await fetch("http://localhost:5000/api/chat/stream", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
                 body: JSON.stringify(payload) 
             });
 
-            const data = await response.json();
-            removeLoading();
-
-            if (!response.ok) throw new Error(data.error || "Erro no servidor");
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.error || "Erro no servidor");
+            }
 
-            const botReply = data.reply || "Erro ao processar resposta.";
+            const botReply = await lerRespostaStream(response) || "Erro ao processar resposta.";
+            removeLoading();
+            removerBolhaParcial();
             
             addMessage(botReply, "bot");
             conversation.push({ role: "assistant", content: botReply });
@@ -133,11 +135,65 @@ document.addEventListener("DOMContentLoaded", async () => {
 
         } catch (error) {
             removeLoading();
+            removerBolhaParcial();
             console.error(error);
             addMessage("Desculpe, tive um erro ao conectar. Tente recarregar a página.", "bot");
         }
     }
 
+    async function lerRespostaStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let parcial = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            const eventos = buffer.split("\n\n");
+            buffer = eventos.pop();
+
+            for (const bloco of eventos) {
+                let tipo = "message";
+                let dados = "";
+                bloco.split("\n").forEach(linha => {
+                    if (linha.startsWith("event:")) tipo = linha.slice(6).trim();
+                    else if (linha.startsWith("data:")) dados += linha.slice(5).trim();
+                });
+                if (!dados) continue;
+
+                const evento = JSON.parse(dados);
+                if (tipo === "erro") throw new Error(evento.error || "Erro no servidor");
+                if (tipo === "fim") return evento.reply;
+
+                parcial += evento.delta || "";
+                mostrarBolhaParcial(parcial);
+            }
+        }
+        return parcial;
+    }
+
+    function mostrarBolhaParcial(texto) {
+        removeLoading();
+        let bolha = document.getElementById("partial-bubble");
+        if (!bolha) {
+            bolha = document.createElement("div");
+            bolha.id = "partial-bubble";
+            bolha.classList.add("message", "bot");
+            bolha.style.whiteSpace = 'pre-wrap';
+            messagesContainer.appendChild(bolha);
+        }
+        bolha.textContent = texto;
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+
+    function removerBolhaParcial() {
+        const bolha = document.getElementById("partial-bubble");
+        if (bolha) bolha.remove();
+    }
+
     async function sendMessage() {
         const text = input.value.trim();
         if (!text) return;
@@ -150,17 +206,25 @@ document.addEventListener("DOMContentLoaded", async () => {
         await enviarParaBackend(text);
     }
 
-    async function carregarListaSessoes() {
+    let cursorSessoes = null;
+
+    async function carregarListaSessoes(maisAntigas = false) {
         const lista = document.getElementById('lista-sessoes');
         if (!lista) return;
 
         try {
-            const res = await fetch(`http://localhost:5000/api/chat/sessoes/${user.id}`);
+            let url = `http://localhost:5000/api/chat/sessoes/${user.id}?limit=30`;
+            if (maisAntigas && cursorSessoes) url += `&before=${encodeURIComponent(cursorSessoes)}`;
+
+            const res = await fetch(url);
             if (res.ok) {
-                const sessoes = await res.json();
-                lista.innerHTML = "";
+                const dados = await res.json();
+                if (!maisAntigas) lista.innerHTML = "";
 
-                sessoes.forEach(sessao => {
+                const antigoBtn = document.getElementById('mais-sessoes');
+                if (antigoBtn) antigoBtn.remove();
+
+                dados.itens.forEach(sessao => {
                     const div = document.createElement('div');
                     div.className = 'session-item';
                     if (sessao.id === currentSessionId) div.classList.add('active');
@@ -173,22 +237,40 @@ document.addEventListener("DOMContentLoaded", async () => {
                     };
                     lista.appendChild(div);
                 });
+
+                cursorSessoes = dados.proximo;
+                if (cursorSessoes) {
+                    const mais = document.createElement('div');
+                    mais.id = 'mais-sessoes';
+                    mais.className = 'session-item';
+                    mais.innerHTML = `<i class="fas fa-ellipsis-h"></i> Conversas anteriores`;
+                    mais.onclick = () => carregarListaSessoes(true);
+                    lista.appendChild(mais);
+                }
             }
         } catch (e) {
             console.error("Erro sidebar:", e);
         }
     }
 
+    const PAGINA_MENSAGENS = 30;
+    let idMaisAntigo = null;
+    let carregandoAntigas = false;
+
+    function urlHistorico(sessionId, extra) {
+        let url = `http://localhost:5000/api/chat/historico/${user.id}?compacto=1&limit=${PAGINA_MENSAGENS}`;
+        if (sessionId) url += `&sessao_id=${sessionId}`;
+        return url + extra;
+    }
+
     async function loadChatHistory(sessionId) {
         currentSessionId = sessionId;
         messagesContainer.innerHTML = '';
         conversation = [];
+        idMaisAntigo = null;
 
         try {
-            let url = `http://localhost:5000/api/chat/historico/${user.id}`;
-            if (sessionId) url += `?sessao_id=${sessionId}`;
-
-            const res = await fetch(url);
+            const res = await fetch(urlHistorico(sessionId, ''));
             
             if (res.ok) {
                 const history = await res.json();
@@ -203,6 +285,7 @@ document.addEventListener("DOMContentLoaded", async () => {
                         addMessage(textContent, senderClass);
                         conversation.push({ role: item.role, content: textContent });
                     });
+                    if (history.length === PAGINA_MENSAGENS) idMaisAntigo = history[0].id;
                 }
             }
         } catch (error) {
@@ -210,6 +293,33 @@ document.addEventListener("DOMContentLoaded", async () => {
         }
     }
 
+    async function carregarMensagensAntigas() {
+        if (!idMaisAntigo || carregandoAntigas) return;
+        carregandoAntigas = true;
+        const sessaoPedida = currentSessionId;
+
+        try {
+            const res = await fetch(urlHistorico(sessaoPedida, `&before_id=${idMaisAntigo}`));
+            if (!res.ok || sessaoPedida !== currentSessionId) return;
+
+            const antigas = await res.json();
+            const alturaAntes = messagesContainer.scrollHeight;
+            const primeiro = messagesContainer.firstChild;
+
+            antigas.forEach(item => {
+                addMessage(item.content || "", item.role === 'user' ? 'user' : 'bot', primeiro);
+            });
+            conversation = antigas.map(item => ({ role: item.role, content: item.content || "" })).concat(conversation);
+
+            messagesContainer.scrollTop += messagesContainer.scrollHeight - alturaAntes;
+            idMaisAntigo = antigas.length === PAGINA_MENSAGENS ? antigas[0].id : null;
+        } catch (error) {
+            console.error("Erro chat:", error);
+        } finally {
+            carregandoAntigas = false;
+        }
+    }
+
     window.criarNovoChat = async function() {
         if(!confirm("Deseja iniciar uma nova conversa?")) return;
         try {
@@ -245,6 +355,9 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
 
     sendBtn.addEventListener("click", sendMessage);
+    messagesContainer.addEventListener("scroll", () => {
+        if (messagesContainer.scrollTop < 50) carregarMensagensAntigas();
+    });
     input.addEventListener('input', autoResize);
     input.addEventListener("keydown", (e) => {
         if (e.key === "Enter" && !e.shiftKey && !e.ctrlKey) {
@@ -40,7 +40,7 @@ async function carregarGraficoEvolucao(userId) {
         new Chart(ctx, {
             type: 'line',
             data: {
-                labels: dados.labels,
+                labels: dados.labels.map(d => formatarData(d, 'dia')),
                 datasets: [{
                     label: 'Nota Total',
                     data: dados.notas,
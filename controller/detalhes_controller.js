@@ -16,7 +16,7 @@ document.addEventListener("DOMContentLoaded", async () => {
         const dados = await res.json();
 
         if (dataDisplay) {
-            dataDisplay.innerText = dados.data || "Data desconhecida";
+            dataDisplay.innerText = dados.data ? formatarData(dados.data) : "Data desconhecida";
         }
 
         const questoes = dados.questoes || [];
@@ -15,7 +15,7 @@ document.addEventListener("DOMContentLoaded", async () => {
             const data = await res.json();
 
             document.getElementById('tema-titulo').innerText = data.tema;
-            document.getElementById('data-envio').innerText = "Enviado em: " + data.data;
+            document.getElementById('data-envio').innerText = "Enviado em: " + formatarData(data.data);
             
             document.getElementById('texto-completo').innerText = data.texto;
 
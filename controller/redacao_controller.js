@@ -44,13 +44,6 @@ function gerarNovoTema() {
     carregarTemas();
 }
 
-const toBase64 = file => new Promise((resolve, reject) => {
-    const reader = new FileReader();
-    reader.readAsDataURL(file);
-    reader.onload = () => resolve(reader.result);
-    reader.onerror = error => reject(error);
-});
-
 async function enviarParaCorrecao() {
     const user = JSON.parse(localStorage.getItem('usuario'));
     const texto = document.getElementById('texto-redacao').value;
@@ -67,30 +60,30 @@ async function enviarParaCorrecao() {
     btn.disabled = true;
 
     try {
-        let imagemBase64 = null;
-        
+        // Multipart: a foto vai como arquivo e é reduzida no servidor antes da correção
+        const formData = new FormData();
+        formData.append('usuario_id', user.id);
+        formData.append('tema_id', temaAtualId);
+        formData.append('texto', texto);
+        formData.append('assincrono', 'true');
+
         if (fileInput.files.length > 0) {
-            imagemBase64 = await toBase64(fileInput.files[0]);
+            formData.append('imagem', fileInput.files[0]);
         }
 
-        const payload = {
-            usuario_id: user.id,
-            tema_id: temaAtualId, 
-            texto: texto,
-            imagem: imagemBase64
-        };
-
         const res = await fetch('http://localhost:5000/redacao/enviar', {
             method: 'POST',
-            headers: { 
-                'Content-Type': 'application/json' 
-            },
-            body: JSON.stringify(payload)
+            body: formData
         });
 
-        const resultado = await res.json();
+        let resultado = await res.json();
 
-        if (res.ok) {
+        if (res.status === 202) {
+            btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Na fila de correção...';
+            resultado = await acompanharCorrecao(resultado, btn);
+        }
+
+        if (res.ok && !resultado.error) {
             exibirResultado(resultado);
         } else {
             console.error("Erro Back:", resultado);
@@ -107,6 +100,37 @@ async function enviarParaCorrecao() {
 }
 
 
+function acompanharCorrecao(job, btn) {
+    return new Promise((resolve) => {
+        const fonte = new EventSource(`http://localhost:5000${job.stream_url}`);
+
+        fonte.addEventListener('processando', () => {
+            btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Corrigindo...';
+        });
+
+        fonte.addEventListener('concluido', (evento) => {
+            fonte.close();
+            resolve(JSON.parse(evento.data).resultado);
+        });
+
+        fonte.addEventListener('erro', (evento) => {
+            fonte.close();
+            const dados = evento.data ? JSON.parse(evento.data) : {};
+            resolve({ error: dados.erro || dados.error || "Falha na correção." });
+        });
+
+        fonte.onerror = () => {
+            // Conexão caiu: consulta o status uma última vez
+            fonte.close();
+            fetch(`http://localhost:5000${job.status_url}`)
+                .then(r => r.json())
+                .then(dados => resolve(dados.status === 'concluido' ? dados.resultado : { error: dados.erro || "Correção ainda em andamento. Confira o histórico em instantes." }))
+                .catch(() => resolve({ error: "Erro de conexão com o servidor." }));
+        };
+    });
+}
+
+
 function exibirResultado(data) {
    
     const secaoResultado = document.getElementById('resultado-correcao');
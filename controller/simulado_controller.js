@@ -1,5 +1,6 @@
 let questoesCache = [];
 let exameAtualId = null;
+let respostasPendentes = {};
 
 async function iniciarProva() {
     const user = JSON.parse(localStorage.getItem('usuario'));
@@ -111,19 +112,11 @@ async function carregarQuestoesDoBanco() {
     }
 }
 
-async function salvarResposta(questaoId, resposta) {
+function salvarResposta(questaoId, resposta) {
     if (!exameAtualId) return;
 
-
-    await fetch('http://localhost:5000/simulado/responder', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({
-            exame_id: exameAtualId,
-            questao_id: questaoId,
-            resposta: resposta
-        })
-    });
+    // As respostas são enviadas todas de uma vez ao finalizar (/simulado/responder/lote)
+    respostasPendentes[questaoId] = resposta;
 }
 
 async function concluirProva() {
@@ -135,15 +128,21 @@ async function concluirProva() {
 
     try {
         
-        const res = await fetch('http://localhost:5000/simulado/finalizar', {
+        const respostas = Object.entries(respostasPendentes).map(([questaoId, resposta]) => ({
+            questao_id: Number(questaoId),
+            resposta: resposta
+        }));
+
+        const res = await fetch('http://localhost:5000/simulado/responder/lote', {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({ exame_id: exameAtualId })
+            body: JSON.stringify({ exame_id: exameAtualId, respostas: respostas, finalizar: true })
         });
 
         const resultado = await res.json();
 
         if (res.ok) {
+            respostasPendentes = {};
             alert(`Simulado Finalizado!\n\nNota: ${resultado.nota}\nAcertos: ${resultado.acertos}\nErros: ${resultado.erros}`);
             window.location.href = "desempenho.html";
         } else {
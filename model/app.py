@@ -1,14 +1,36 @@
 import os
 import logging
 import json
-from flask import Flask, request, jsonify
+import random
+import threading
+import time
+import click
+import uuid
+import base64
+import binascii
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from collections import OrderedDict
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 from urllib.parse import quote_plus
 from openai import OpenAI
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:
+    Image = None
 from sqlalchemy import text 
+from cache import CacheLRU
+from triagem import triar_redacao
+from llm import GatewayLLM
+from metricas import RegistroMetricas, instrumentar, registrar_log_json
+from respostas import configurar_respostas
+from migracoes import aplicar_migracoes, situacao_migracoes
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +45,27 @@ else:
     print("❌ ERRO CRÍTICO: O Python NÃO achou a chave no .env!")
     client = None
 
+# Timeout (s) e chamadas simultâneas por rota; todas as chamadas à OpenAI passam pelo gateway
+ROTAS_LLM = {
+    'tema': {'timeout': float(os.getenv('LLM_TIMEOUT_TEMA', 30)), 'concorrencia': int(os.getenv('LLM_CONCORRENCIA_TEMA', 4))},
+    'redacao': {'timeout': float(os.getenv('LLM_TIMEOUT_REDACAO', 120)), 'concorrencia': int(os.getenv('LLM_CONCORRENCIA_REDACAO', 8))},
+    'chat': {'timeout': float(os.getenv('LLM_TIMEOUT_CHAT', 60)), 'concorrencia': int(os.getenv('LLM_CONCORRENCIA_CHAT', 16))},
+    'resumo': {'timeout': float(os.getenv('LLM_TIMEOUT_RESUMO', 30)), 'concorrencia': int(os.getenv('LLM_CONCORRENCIA_RESUMO', 2))},
+    'recomendacao': {'timeout': float(os.getenv('LLM_TIMEOUT_RECOMENDACAO', 15)), 'concorrencia': int(os.getenv('LLM_CONCORRENCIA_RECOMENDACAO', 4))},
+}
+
+CONFIG_LLM = {
+    'tentativas': int(os.getenv('LLM_TENTATIVAS', 3)),
+    'falhas_para_abrir': int(os.getenv('LLM_CIRCUITO_FALHAS', 5)),
+    'tempo_aberto': int(os.getenv('LLM_CIRCUITO_ESPERA', 30))
+}
+
+# Latência por rota, SQL por requisição e uso da OpenAI; exportado em /metrics
+metricas = RegistroMetricas()
+
+llm = GatewayLLM(client, rotas=ROTAS_LLM, max_concorrencia=int(os.getenv('LLM_MAX_CONCORRENCIA', 32)),
+                 observador=metricas.observar_llm, **CONFIG_LLM) if client else None
+
 
 
 def get_database_uri():
@@ -52,9 +95,23 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 
 app.config['SQLALCHEMY_DATABASE_URI'] = get_database_uri()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', 20)) * 1024 * 1024
 
 db = SQLAlchemy(app)
 
+# Uma linha JSON por requisição (rota, status, tempo, SQL e OpenAI) no logger preparai.requisicoes
+LOG_REQUISICOES_JSON = os.getenv('LOG_REQUISICOES_JSON', '1').lower() in ('1', 'true', 'sim')
+instrumentar(app, metricas, log_json=LOG_REQUISICOES_JSON)
+
+# JSON pelo orjson quando instalado (datas saem em ISO 8601) e gzip/brotli nas respostas acima do limite
+configurar_respostas(
+    app,
+    json_rapido=os.getenv('JSON_RAPIDO', '1').lower() in ('1', 'true', 'sim'),
+    compressao_min_bytes=int(os.getenv('COMPRESSAO_MIN_BYTES', 1024)),
+    nivel_gzip=int(os.getenv('COMPRESSAO_NIVEL_GZIP', 6)),
+    qualidade_br=int(os.getenv('COMPRESSAO_QUALIDADE_BR', 4))
+)
+
 
 class Usuario(db.Model):
     __tablename__ = 'usuarios'
@@ -67,6 +124,41 @@ class Usuario(db.Model):
         return {'id': self.id, 'nome': self.nome, 'email': self.email}
 
 
+class DashboardResumo(db.Model):
+    __tablename__ = 'dashboard_resumo'
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    simulados = db.Column(db.Integer, nullable=False, default=0)
+    redacoes = db.Column(db.Integer, nullable=False, default=0)
+    soma_notas = db.Column(db.Numeric(14, 1), nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+
+class RedacaoJob(db.Model):
+    __tablename__ = 'redacoes_jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente')
+    resultado = db.Column(db.Text)
+    erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    atualizado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+
+class DesempenhoMateria(db.Model):
+    __tablename__ = 'desempenho_materias'
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    materia_id = db.Column(db.Integer, primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    acertos = db.Column(db.Integer, nullable=False, default=0)
+
+class CorrecaoEmAndamento(db.Model):
+    __tablename__ = 'redacoes_em_correcao'
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    hash_conteudo = db.Column(db.String(64), primary_key=True)
+    iniciado_em = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    job_id = db.Column(db.String(32))
+
+
 @app.route('/')
 def index():
     return jsonify({'message': 'API PreparAI Online 🚀'}), 200
@@ -74,11 +166,23 @@ def index():
 @app.route('/create_tables', methods=['POST'])
 def create_tables():
     try:
+        aplicadas = aplicar_migracoes(db.engine)
         db.create_all()
-        return jsonify({'status': 'tabelas verificadas'}), 200
+        return jsonify({'status': 'tabelas verificadas', 'migracoes_aplicadas': [versao for versao, _ in aplicadas]}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@app.cli.command('migrar')
+@click.option('--status', 'so_status', is_flag=True, help='Só lista as migrações e se já foram aplicadas.')
+def migrar_command(so_status):
+    if not so_status:
+        aplicadas = aplicar_migracoes(db.engine)
+        print(f"{len(aplicadas)} migrações aplicadas.")
+    for versao, nome, feita in situacao_migracoes(db.engine):
+        print(f"{versao:04d} {nome}: {'aplicada' if feita else 'pendente'}")
+
+
 @app.route('/add_user', methods=['POST'])
 def add_user():
     data = request.get_json() or {}
@@ -115,20 +219,56 @@ def login():
         return jsonify({'error': str(e)}), 500
 
 
+DASHBOARD_RESUMO_TTL = int(os.getenv('DASHBOARD_RESUMO_TTL', 24 * 3600))
+
+
+SQL_RECALCULO_DASHBOARD = text("""
+    WITH sim AS (
+        SELECT COUNT(*) AS total, COALESCE(SUM(nota_total), 0) AS soma
+        FROM exames WHERE usuario_id = :uid AND nota_total IS NOT NULL
+    )
+    INSERT INTO dashboard_resumo (usuario_id, simulados, redacoes, soma_notas, atualizado_em)
+    SELECT :uid, sim.total, (SELECT COUNT(*) FROM redacoes WHERE usuario_id = :uid), sim.soma, NOW()
+    FROM sim
+    ON CONFLICT (usuario_id) DO UPDATE
+    SET simulados = EXCLUDED.simulados, redacoes = EXCLUDED.redacoes,
+        soma_notas = EXCLUDED.soma_notas, atualizado_em = EXCLUDED.atualizado_em
+    RETURNING simulados, redacoes, soma_notas
+""")
+
+
+def recalcular_dashboard_resumo(usuario_id):
+    return db.session.execute(SQL_RECALCULO_DASHBOARD, {'uid': usuario_id}).fetchone()
+
+
+def atualizar_dashboard_resumo(usuario_id, simulados=0, redacoes=0, soma_notas=0):
+    # Chamado dentro da transação de quem gerou o evento; se o resumo ainda não existe, a próxima leitura recalcula
+    db.session.execute(text("""
+        UPDATE dashboard_resumo
+        SET simulados = simulados + :ds, redacoes = redacoes + :dr, soma_notas = soma_notas + :dn
+        WHERE usuario_id = :uid
+    """), {'uid': usuario_id, 'ds': simulados, 'dr': redacoes, 'dn': soma_notas})
+
+
 @app.route('/dashboard/resumo/<int:usuario_id>', methods=['GET'])
 def get_dashboard_resumo(usuario_id):
     try:
-    
-        sql_simulados = text("SELECT COUNT(*) FROM exames WHERE usuario_id = :uid AND nota_total IS NOT NULL")
-        total_simulados = db.session.execute(sql_simulados, {'uid': usuario_id}).scalar() or 0
+        resumo = None
+        if request.args.get('recalcular', '').lower() not in ('1', 'true', 'sim'):
+            sql = text("""
+                SELECT simulados, redacoes, soma_notas
+                FROM dashboard_resumo
+                WHERE usuario_id = :uid AND atualizado_em > NOW() - make_interval(secs => :ttl)
+            """)
+            resumo = db.session.execute(sql, {'uid': usuario_id, 'ttl': DASHBOARD_RESUMO_TTL}).fetchone()
 
-    
-        sql_redacoes = text("SELECT COUNT(*) FROM redacoes WHERE usuario_id = :uid")
-        total_redacoes = db.session.execute(sql_redacoes, {'uid': usuario_id}).scalar() or 0
+        if not resumo:
+            resumo = recalcular_dashboard_resumo(usuario_id)
+            db.session.commit()
 
-    
-        sql_media = text("SELECT AVG(nota_total) FROM exames WHERE usuario_id = :uid AND nota_total IS NOT NULL")
-        media_geral = db.session.execute(sql_media, {'uid': usuario_id}).scalar() or 0
+        total_simulados = resumo.simulados or 0
+        total_redacoes = resumo.redacoes or 0
+        media_geral = float(resumo.soma_notas) / total_simulados if total_simulados else 0
 
         msg = "Vamos praticar!"
         if total_simulados > 0:
@@ -142,19 +282,54 @@ def get_dashboard_resumo(usuario_id):
         }), 200
 
     except Exception as e:
+        db.session.rollback()
         print(f"Erro no Dashboard: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Mensagem e cor de cada matéria vêm da view dashboard_feedback_materias (migração 0007), sobre os contadores
+SQL_DESEMPENHO_MATERIAS = text("""
+    SELECT materia_nome AS materia, total_questoes, acertos, percentual_acertos, mensagem, cor_hex
+    FROM dashboard_feedback_materias
+    WHERE usuario_id = :uid
+    ORDER BY materia_nome
+""")
+
+
+SQL_RECALCULO_DESEMPENHO = text("""
+    INSERT INTO desempenho_materias (usuario_id, materia_id, total, acertos)
+    SELECT e.usuario_id, q.materia_id, COUNT(*), COUNT(*) FILTER (WHERE eq.correta)
+    FROM exames_questoes eq
+    JOIN exames e ON eq.exame_id = e.id
+    JOIN questoes q ON eq.questao_id = q.id
+    WHERE CAST(:uid AS integer) IS NULL OR e.usuario_id = :uid
+    GROUP BY e.usuario_id, q.materia_id
+""")
+
+
+def recalcular_desempenho_materias(usuario_id=None):
+    params = {'uid': usuario_id}
+    db.session.execute(text("DELETE FROM desempenho_materias WHERE CAST(:uid AS integer) IS NULL OR usuario_id = :uid"), params)
+    result = db.session.execute(SQL_RECALCULO_DESEMPENHO, params)
+    db.session.commit()
+    return result.rowcount
+
+
+@app.cli.command('recalcular-desempenho')
+@click.option('--usuario-id', type=int, default=None)
+def recalcular_desempenho_command(usuario_id):
+    linhas = recalcular_desempenho_materias(usuario_id)
+    print(f"{linhas} linhas (usuário, matéria) recalculadas.")
+
+
 @app.route('/dashboard/materias/<int:usuario_id>', methods=['GET'])
 def get_dashboard_materias(usuario_id):
     try:
-    
-        results = db.session.execute(text("SELECT * FROM dashboard_feedback_materias WHERE usuario_id = :uid"), {'uid': usuario_id}).fetchall()
+        results = db.session.execute(SQL_DESEMPENHO_MATERIAS, {'uid': usuario_id}).fetchall()
         
         lista = []
         for row in results:
             lista.append({
-                "materia": row.materia_nome,
+                "materia": row.materia,
                 "percentual": float(row.percentual_acertos),
                 "mensagem": row.mensagem,
                 "cor": row.cor_hex
@@ -162,26 +337,27 @@ def get_dashboard_materias(usuario_id):
         return jsonify(lista), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    
+
+
+SQL_EVOLUCAO = text("""
+    SELECT criado_em, nota_total 
+    FROM exames 
+    WHERE usuario_id = :uid AND nota_total IS NOT NULL
+    ORDER BY criado_em ASC
+""")
+
+
 @app.route('/api/graficos/evolucao/<int:usuario_id>', methods=['GET'])
 def get_dados_grafico(usuario_id):
     try:
-        sql = text("""
-            SELECT criado_em, nota_total 
-            FROM exames 
-            WHERE usuario_id = :uid AND nota_total IS NOT NULL
-            ORDER BY criado_em ASC
-        """)
-        
-        resultados = db.session.execute(sql, {'uid': usuario_id}).fetchall()
+        resultados = db.session.execute(SQL_EVOLUCAO, {'uid': usuario_id}).fetchall()
         
         labels = []
         notas = []  
         
         for row in resultados:
             if row.criado_em:
-                dia = row.criado_em.strftime('%d/%m')
-                labels.append(dia)
+                labels.append(row.criado_em)
                 notas.append(float(row.nota_total))
             
         return jsonify({'labels': labels, 'notas': notas})
@@ -197,41 +373,188 @@ def iniciar_simulado():
     usuario_id = data.get('usuario_id')
     try:
     
-        sql = text("INSERT INTO exames (usuario_id, tipo) VALUES (:uid, 'SIMULADO') RETURNING id")
+        sql = text("INSERT INTO exames (usuario_id, tipo, acertos, erros) VALUES (:uid, 'SIMULADO', 0, 0) RETURNING id")
         result = db.session.execute(sql, {'uid': usuario_id})
         db.session.commit()
         return jsonify({'exame_id': result.fetchone()[0]}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/simulado/questoes', methods=['GET'])
-def buscar_questoes():
-    try:
-    
+QUESTOES_POR_SIMULADO = 25
+INDICE_QUESTOES_TTL = int(os.getenv('INDICE_QUESTOES_TTL', 300))
+
+# Cotas por materia_id, ex: SIMULADO_COTAS='{"1": 5, "2": 5, "3": 5, "4": 5, "5": 5}'
+try:
+    SIMULADO_COTAS = {int(k): int(v) for k, v in json.loads(os.getenv('SIMULADO_COTAS') or '{}').items()}
+except (ValueError, AttributeError):
+    print("AVISO: SIMULADO_COTAS inválido. Ignorando cotas.")
+    SIMULADO_COTAS = {}
+
+_indice_questoes = {'por_materia': {}, 'todas': (), 'assinatura': None, 'verificado_em': 0.0, 'versao': 0}
+_indice_questoes_lock = threading.Lock()
+
+
+def invalidar_indice_questoes():
+    # A versão local avança já, então o cache de questões deste worker cai mesmo antes da próxima leitura do banco
+    with _indice_questoes_lock:
+        _indice_questoes['verificado_em'] = 0.0
+        _indice_questoes['assinatura'] = None
+        _indice_questoes['versao'] += 1
+
+
+def obter_indice_questoes():
+    agora = time.monotonic()
+    if _indice_questoes['assinatura'] is not None and agora - _indice_questoes['verificado_em'] < INDICE_QUESTOES_TTL:
+        return _indice_questoes
+
+    with _indice_questoes_lock:
+        if _indice_questoes['assinatura'] is not None and agora - _indice_questoes['verificado_em'] < INDICE_QUESTOES_TTL:
+            return _indice_questoes
+
+        # Só recarrega os IDs se o banco de questões mudou desde a última verificação.
+        # questoes_versao é avançada por trigger em qualquer INSERT/UPDATE/DELETE (migração 0004)
+        assinatura = db.session.execute(text("SELECT versao FROM questoes_versao")).scalar()
+        if assinatura != _indice_questoes['assinatura']:
+            por_materia = {}
+            for row in db.session.execute(text("SELECT id, materia_id FROM questoes")):
+                por_materia.setdefault(row.materia_id, []).append(row.id)
+
+            _indice_questoes['por_materia'] = {mid: tuple(ids) for mid, ids in por_materia.items()}
+            _indice_questoes['todas'] = tuple(qid for ids in por_materia.values() for qid in ids)
+            _indice_questoes['assinatura'] = assinatura
+            _indice_questoes['versao'] += 1
+            registrar_log_json({'evento': 'indice_questoes', 'versao_banco': assinatura,
+                                'questoes': len(_indice_questoes['todas']), 'materias': len(por_materia)})
+
+        _indice_questoes['verificado_em'] = agora
+        return _indice_questoes
+
+
+def calcular_cotas(por_materia, total):
+    materias = sorted(por_materia)
+    if not materias:
+        return {}
+    base, resto = divmod(total, len(materias))
+    extras = set(random.sample(materias, resto))
+    return {mid: base + (1 if mid in extras else 0) for mid in materias}
+
+
+def sortear_questoes(total=QUESTOES_POR_SIMULADO, cotas=None):
+    indice = obter_indice_questoes()
+    por_materia, todas = indice['por_materia'], indice['todas']
+
+    if not cotas:
+        return random.sample(todas, min(total, len(todas)))
+
+    escolhidas = []
+    for mid, qtd in cotas.items():
+        ids = por_materia.get(mid, ())
+        escolhidas.extend(random.sample(ids, min(qtd, len(ids))))
+
+    # Completa com questões de qualquer matéria se alguma cota não pôde ser atendida
+    faltando = total - len(escolhidas)
+    if faltando > 0 and len(todas) > len(escolhidas):
+        ja_escolhidas = set(escolhidas)
+        restantes = [qid for qid in random.sample(todas, min(len(todas), faltando + len(ja_escolhidas))) if qid not in ja_escolhidas]
+        escolhidas.extend(restantes[:faltando])
+
+    random.shuffle(escolhidas)
+    return escolhidas[:total]
+
+
+CACHE_QUESTOES_MAX_BYTES = int(os.getenv('CACHE_QUESTOES_MAX_BYTES', 32 * 1024 * 1024))
+
+_cache_questoes = OrderedDict()
+_cache_questoes_estado = {'versao': None, 'bytes': 0}
+_cache_questoes_lock = threading.Lock()
+
+
+def _montar_entrada_questao(row):
+    opcoes = {
+        'A': row.alternativa_a,
+        'B': row.alternativa_b,
+        'C': row.alternativa_c,
+        'D': row.alternativa_d,
+        'E': row.alternativa_e
+    }
+    payload = json.dumps({
+        "id": row.id,
+        "texto": row.enunciado,
+        "materia": row.materia,
+        "opcoes": [{"letra": letra, "texto": texto} for letra, texto in opcoes.items()]
+    }, ensure_ascii=False)
+    return {
+        'id': row.id,
+        'enunciado': row.enunciado,
+        'materia': row.materia,
+        'materia_id': row.materia_id,
+        'opcoes': opcoes,
+        'resposta_correta': row.resposta_correta,
+        'payload': payload,
+        'tamanho': len(payload.encode('utf-8'))
+    }
+
+
+def obter_questoes_cache(ids):
+    versao = obter_indice_questoes()['versao']
+    encontradas = {}
+    faltando = []
+
+    with _cache_questoes_lock:
+        # Banco de questões mudou: descarta tudo que foi montado com a versão anterior
+        if _cache_questoes_estado['versao'] != versao:
+            _cache_questoes.clear()
+            _cache_questoes_estado['versao'] = versao
+            _cache_questoes_estado['bytes'] = 0
+
+        for qid in ids:
+            entrada = _cache_questoes.get(qid)
+            if entrada is None:
+                faltando.append(qid)
+            else:
+                _cache_questoes.move_to_end(qid)
+                encontradas[qid] = entrada
+
+    if faltando:
         sql = text("""
-            SELECT q.id, q.enunciado, q.alternativa_a, q.alternativa_b, 
-                   q.alternativa_c, q.alternativa_d, q.alternativa_e, m.nome as materia
+            SELECT q.id, q.materia_id, q.enunciado, q.alternativa_a, q.alternativa_b,
+                   q.alternativa_c, q.alternativa_d, q.alternativa_e, q.resposta_correta,
+                   m.nome as materia
             FROM questoes q
             JOIN materias m ON m.id = q.materia_id
-            ORDER BY RANDOM() LIMIT 25
+            WHERE q.id = ANY(:ids)
         """)
-        questoes = db.session.execute(sql).fetchall()
-        
-        response = []
-        for q in questoes:
-            response.append({
-                "id": q.id,
-                "texto": q.enunciado,
-                "materia": q.materia,
-                "opcoes": [
-                    {"letra": "A", "texto": q.alternativa_a},
-                    {"letra": "B", "texto": q.alternativa_b},
-                    {"letra": "C", "texto": q.alternativa_c},
-                    {"letra": "D", "texto": q.alternativa_d},
-                    {"letra": "E", "texto": q.alternativa_e}
-                ]
-            })
-        return jsonify(response), 200
+        novas = [_montar_entrada_questao(row) for row in db.session.execute(sql, {'ids': list(faltando)}).fetchall()]
+
+        with _cache_questoes_lock:
+            for entrada in novas:
+                encontradas[entrada['id']] = entrada
+                if _cache_questoes_estado['versao'] != versao or entrada['id'] in _cache_questoes:
+                    continue
+                _cache_questoes[entrada['id']] = entrada
+                _cache_questoes_estado['bytes'] += entrada['tamanho']
+
+            while _cache_questoes and _cache_questoes_estado['bytes'] > CACHE_QUESTOES_MAX_BYTES:
+                _, removida = _cache_questoes.popitem(last=False)
+                _cache_questoes_estado['bytes'] -= removida['tamanho']
+
+    return encontradas
+
+
+@app.route('/simulado/questoes', methods=['GET'])
+def buscar_questoes():
+    try:
+        cotas = SIMULADO_COTAS
+        if not cotas and request.args.get('balanceado', '').lower() in ('1', 'true', 'sim'):
+            cotas = calcular_cotas(obter_indice_questoes()['por_materia'], QUESTOES_POR_SIMULADO)
+
+        ids = sortear_questoes(QUESTOES_POR_SIMULADO, cotas)
+        if not ids:
+            return jsonify([]), 200
+
+        questoes = obter_questoes_cache(ids)
+        fragmentos = [questoes[qid]['payload'] for qid in ids if qid in questoes]
+        return Response('[' + ','.join(fragmentos) + ']', status=200, mimetype='application/json')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -240,137 +563,434 @@ def responder_questao():
     data = request.get_json()
     try:
         
-        sql_gabarito = text("SELECT resposta_correta FROM questoes WHERE id = :qid")
-        gabarito = db.session.execute(sql_gabarito, {'qid': data['questao_id']}).fetchone()[0]
+        questao = obter_questoes_cache([int(data['questao_id'])]).get(int(data['questao_id']))
+        if not questao:
+            return jsonify({'error': 'Questão não encontrada'}), 404
+        gabarito = questao['resposta_correta']
         acertou = str(data['resposta']).upper() == str(gabarito).upper()
 
         
+        # Grava a resposta e ajusta os contadores do exame e da matéria descontando a resposta anterior, se houver.
+        # Exame aberto antes dos contadores (acertos/erros NULL) é recontado; a subconsulta ainda vê a resposta anterior.
         sql = text("""
-            INSERT INTO exames_questoes (exame_id, questao_id, resposta_usuario, correta)
-            VALUES (:eid, :qid, :resp, :correta)
-            ON CONFLICT (exame_id, questao_id) DO UPDATE SET resposta_usuario = :resp, correta = :correta
+            WITH anterior AS (
+                SELECT correta FROM exames_questoes WHERE exame_id = :eid AND questao_id = :qid
+            ), gravada AS (
+                INSERT INTO exames_questoes (exame_id, questao_id, resposta_usuario, correta)
+                VALUES (:eid, :qid, :resp, :correta)
+                ON CONFLICT (exame_id, questao_id) DO UPDATE SET resposta_usuario = :resp, correta = :correta
+            ), contadores AS (
+                UPDATE exames SET
+                    acertos = COALESCE(acertos, (SELECT COUNT(*) FROM exames_questoes WHERE exame_id = :eid AND correta))
+                        + CAST(:correta AS integer) - COALESCE((SELECT CAST(correta AS integer) FROM anterior), 0),
+                    erros = COALESCE(erros, (SELECT COUNT(*) FROM exames_questoes WHERE exame_id = :eid AND NOT correta))
+                        + CAST(NOT :correta AS integer) - COALESCE((SELECT CAST(NOT correta AS integer) FROM anterior), 0)
+                WHERE id = :eid
+                RETURNING usuario_id
+            )
+            INSERT INTO desempenho_materias (usuario_id, materia_id, total, acertos)
+            SELECT usuario_id, :mid,
+                   1 - (SELECT COUNT(*) FROM anterior),
+                   CAST(:correta AS integer) - COALESCE((SELECT CAST(correta AS integer) FROM anterior), 0)
+            FROM contadores
+            ON CONFLICT (usuario_id, materia_id) DO UPDATE
+            SET total = desempenho_materias.total + EXCLUDED.total, acertos = desempenho_materias.acertos + EXCLUDED.acertos
         """)
-        db.session.execute(sql, {'eid': data['exame_id'], 'qid': data['questao_id'], 'resp': data['resposta'], 'correta': acertou})
+        # Trava o exame antes de ler a resposta anterior: duas respostas simultâneas à mesma questão
+        # passam em fila e a segunda já enxerga a primeira, sem contar duas vezes
+        db.session.execute(text("SELECT 1 FROM exames WHERE id = :eid FOR UPDATE"), {'eid': data['exame_id']})
+        db.session.execute(sql, {'eid': data['exame_id'], 'qid': data['questao_id'], 'mid': questao['materia_id'], 'resp': data['resposta'], 'correta': acertou})
         db.session.commit()
+        invalidar_detalhes('exame', data['exame_id'])
         return jsonify({'status': 'salvo'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+def finalizar_exame(exame_id):
+    # A regra da nota é fn_nota_exame (migração 0005) sobre os contadores que responder_questao mantém.
+    # A subconsulta trava a linha e devolve a nota anterior, que o resumo do dashboard precisa para refinalizações.
+    resultado = db.session.execute(text("""
+        UPDATE exames e SET nota_total = fn_nota_exame(e.acertos, e.erros)
+        FROM (SELECT nota_total FROM exames WHERE id = :eid FOR UPDATE) anterior
+        WHERE e.id = :eid
+        RETURNING e.usuario_id, anterior.nota_total AS nota_anterior, e.nota_total, e.acertos, e.erros
+    """), {'eid': exame_id}).fetchone()
+    if not resultado:
+        raise ValueError(f"Exame {exame_id} não encontrado")
+
+    nota = resultado.nota_total or 0
+    if resultado.nota_anterior is None:
+        atualizar_dashboard_resumo(resultado.usuario_id, simulados=1, soma_notas=nota)
+    else:
+        atualizar_dashboard_resumo(resultado.usuario_id, soma_notas=nota - resultado.nota_anterior)
+    return {'nota': float(resultado.nota_total) if resultado.nota_total else 0, 'acertos': resultado.acertos, 'erros': resultado.erros}
+
+
+def verificar_contadores_exames(exame_id=None, corrigir=False):
+    sql = text("""
+        SELECT e.id, e.acertos, e.erros,
+               COUNT(eq.questao_id) FILTER (WHERE eq.correta) AS acertos_reais,
+               COUNT(eq.questao_id) FILTER (WHERE NOT eq.correta) AS erros_reais
+        FROM exames e
+        LEFT JOIN exames_questoes eq ON eq.exame_id = e.id
+        WHERE CAST(:eid AS integer) IS NULL OR e.id = :eid
+        GROUP BY e.id, e.acertos, e.erros
+        HAVING COALESCE(e.acertos, -1) <> COUNT(eq.questao_id) FILTER (WHERE eq.correta)
+            OR COALESCE(e.erros, -1) <> COUNT(eq.questao_id) FILTER (WHERE NOT eq.correta)
+    """)
+    divergentes = db.session.execute(sql, {'eid': exame_id}).fetchall()
+
+    if corrigir and divergentes:
+        db.session.execute(
+            text("UPDATE exames SET acertos = :a, erros = :e WHERE id = :eid"),
+            [{'eid': row.id, 'a': row.acertos_reais, 'e': row.erros_reais} for row in divergentes]
+        )
+        db.session.commit()
+
+    return [{
+        'exame_id': row.id,
+        'acertos': row.acertos, 'erros': row.erros,
+        'acertos_reais': row.acertos_reais, 'erros_reais': row.erros_reais
+    } for row in divergentes]
+
+
+@app.cli.command('verificar-contadores')
+@click.option('--exame-id', type=int, default=None)
+@click.option('--corrigir', is_flag=True, help='Regrava acertos/erros com a recontagem.')
+def verificar_contadores_command(exame_id, corrigir):
+    divergentes = verificar_contadores_exames(exame_id, corrigir)
+    for item in divergentes:
+        print(f"Exame {item['exame_id']}: contadores {item['acertos']}/{item['erros']} x recontagem {item['acertos_reais']}/{item['erros_reais']}")
+    status = "corrigidos" if corrigir else "encontrados"
+    print(f"{len(divergentes)} exames divergentes {status}.")
+
+
 @app.route('/simulado/finalizar', methods=['POST'])
 def finalizar_simulado():
     data = request.get_json()
     exame_id = data.get('exame_id')
     try:
-    
-        sql_proc = text("SELECT fn_finalizar_exame(:eid)")
-        db.session.execute(sql_proc, {'eid': exame_id})
+        resultado = finalizar_exame(exame_id)
         db.session.commit()
-        
-    
-        sql_res = text("SELECT nota_total, acertos, erros FROM exames WHERE id = :eid")
-        resultado = db.session.execute(sql_res, {'eid': exame_id}).fetchone()
-        return jsonify({'nota': float(resultado.nota_total) if resultado.nota_total else 0, 'acertos': resultado.acertos, 'erros': resultado.erros}), 200
+        return jsonify(resultado), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/simulado/responder/lote', methods=['POST'])
+def responder_lote():
+    data = request.get_json() or {}
+    exame_id = data.get('exame_id')
+    respostas = data.get('respostas') or []
+
+    if not exame_id:
+        return jsonify({'error': 'exame_id não informado'}), 400
+
+    try:
+        # Se a mesma questão vier mais de uma vez, vale a última resposta
+        por_questao = {}
+        for item in respostas:
+            por_questao[int(item['questao_id'])] = str(item['resposta']).upper()
+
+        salvas = 0
+        if por_questao:
+            questoes = obter_questoes_cache(list(por_questao))
+            invalidas = [qid for qid in por_questao if qid not in questoes]
+            if invalidas:
+                return jsonify({'error': 'Questões não encontradas', 'questoes': invalidas}), 404
+
+            qids = list(por_questao)
+            resps = [por_questao[qid] for qid in qids]
+            corretas = [resp == str(questoes[qid]['resposta_correta']).upper() for qid, resp in zip(qids, resps)]
+
+            sql = text("""
+                WITH novas AS (
+                    SELECT * FROM unnest(CAST(:qids AS integer[]), CAST(:mids AS integer[]), CAST(:resps AS text[]), CAST(:corretas AS boolean[]))
+                         AS r(questao_id, materia_id, resposta, correta)
+                ), anteriores AS (
+                    SELECT eq.questao_id, eq.correta
+                    FROM exames_questoes eq
+                    JOIN novas n ON n.questao_id = eq.questao_id
+                    WHERE eq.exame_id = :eid
+                ), gravadas AS (
+                    INSERT INTO exames_questoes (exame_id, questao_id, resposta_usuario, correta)
+                    SELECT :eid, questao_id, resposta, correta FROM novas
+                    ON CONFLICT (exame_id, questao_id) DO UPDATE
+                    SET resposta_usuario = EXCLUDED.resposta_usuario, correta = EXCLUDED.correta
+                ), contadores AS (
+                    UPDATE exames SET
+                        acertos = COALESCE(acertos, (SELECT COUNT(*) FROM exames_questoes WHERE exame_id = :eid AND correta))
+                            + (SELECT COUNT(*) FROM novas WHERE correta)
+                            - (SELECT COUNT(*) FROM anteriores WHERE correta),
+                        erros = COALESCE(erros, (SELECT COUNT(*) FROM exames_questoes WHERE exame_id = :eid AND NOT correta))
+                            + (SELECT COUNT(*) FROM novas WHERE NOT correta)
+                            - (SELECT COUNT(*) FROM anteriores WHERE NOT correta)
+                    WHERE id = :eid
+                    RETURNING usuario_id
+                ), deltas AS (
+                    SELECT n.materia_id,
+                           COUNT(*) - COUNT(a.questao_id) AS total,
+                           COUNT(*) FILTER (WHERE n.correta) - COUNT(*) FILTER (WHERE a.correta) AS acertos
+                    FROM novas n
+                    LEFT JOIN anteriores a ON a.questao_id = n.questao_id
+                    GROUP BY n.materia_id
+                )
+                INSERT INTO desempenho_materias (usuario_id, materia_id, total, acertos)
+                SELECT c.usuario_id, d.materia_id, d.total, d.acertos
+                FROM contadores c CROSS JOIN deltas d
+                ON CONFLICT (usuario_id, materia_id) DO UPDATE
+                SET total = desempenho_materias.total + EXCLUDED.total, acertos = desempenho_materias.acertos + EXCLUDED.acertos
+            """)
+            mids = [questoes[qid]['materia_id'] for qid in qids]
+            # Mesma trava de responder_questao, antes de ler as respostas anteriores
+            db.session.execute(text("SELECT 1 FROM exames WHERE id = :eid FOR UPDATE"), {'eid': exame_id})
+            db.session.execute(sql, {'eid': exame_id, 'qids': qids, 'mids': mids, 'resps': resps, 'corretas': corretas})
+            salvas = len(qids)
+
+        resposta = {'status': 'salvo', 'salvas': salvas}
+        if data.get('finalizar'):
+            resposta.update(finalizar_exame(exame_id))
+
+        db.session.commit()
+        invalidar_detalhes('exame', exame_id)
+        return jsonify(resposta), 200
+    except (KeyError, TypeError, ValueError):
+        db.session.rollback()
+        return jsonify({'error': 'Formato inválido. Envie respostas como [{questao_id, resposta}]'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
     
 
+# Exame finalizado e redação corrigida quase não mudam: o JSON pronto fica em memória e o navegador
+# revalida com If-None-Match. Cada entrada guarda a versão da linha de origem (xmin do Postgres, que muda
+# a cada UPDATE); um worker que não viu a invalidação local confere a versão e remonta em vez de servir o antigo.
+DETALHES_CACHE_MAX = int(os.getenv('DETALHES_CACHE_MAX', 2000))
+DETALHES_CACHE_TTL = int(os.getenv('DETALHES_CACHE_TTL', 24 * 3600))
+DETALHES_MAX_AGE = int(os.getenv('DETALHES_MAX_AGE', 24 * 3600))
+
+cache_detalhes = CacheLRU(max_itens=DETALHES_CACHE_MAX, ttl=DETALHES_CACHE_TTL)
+
+
+def entrada_detalhes(payload):
+    corpo = app.json.dumps_bytes(payload)
+    return {'corpo': corpo, 'etag': hashlib.sha256(corpo).hexdigest()[:32]}
+
+
+def resposta_detalhes(entrada):
+    resposta = Response(entrada['corpo'], status=200, mimetype='application/json')
+    resposta.set_etag(entrada['etag'])
+    resposta.headers['Cache-Control'] = f'private, max-age={DETALHES_MAX_AGE}'
+    # Devolve 304 sem corpo quando o If-None-Match bate com o ETag
+    return resposta.make_conditional(request)
+
+
+def invalidar_detalhes(tipo, ident):
+    cache_detalhes.remover((tipo, int(ident)))
+
+
+# responder_questao, responder_lote e a finalização sempre atualizam exames; regravar a correção atualiza a avaliação final
+SQL_VERSAO_DETALHES = {
+    'exame': text("SELECT xmin::text FROM exames WHERE id = :id"),
+    'redacao': text("SELECT xmin::text FROM redacoes_avaliacao_final WHERE redacao_id = :id"),
+}
+
+
+def versao_linha_detalhes(tipo, ident):
+    """Versão atual da linha que origina o detalhe, ou None se ela não existe."""
+    return db.session.execute(SQL_VERSAO_DETALHES[tipo], {'id': ident}).scalar()
+
+
+def montar_detalhes_exame(exame_id):
+    """(payload, finalizado) do exame, ou None se ele não existe."""
+    sql_exame = text("SELECT criado_em, nota_total FROM exames WHERE id = :eid")
+    exame = db.session.execute(sql_exame, {'eid': exame_id}).fetchone()
+
+    if not exame:
+        return None
+
+    sql = text("SELECT questao_id, resposta_usuario FROM exames_questoes WHERE exame_id = :eid")
+    result = db.session.execute(sql, {'eid': exame_id}).fetchall()
+    questoes = obter_questoes_cache([row.questao_id for row in result])
+
+    detalhes = []
+    for row in result:
+        q = questoes.get(row.questao_id)
+        if not q:
+            continue
+        detalhes.append({
+            'enunciado': q['enunciado'],
+            'materia': q['materia'],
+            'marcada': row.resposta_usuario,
+            'gabarito': q['resposta_correta'],
+            'opcoes': q['opcoes']
+        })
+
+    return {'data': exame.criado_em, 'questoes': detalhes}, exame.nota_total is not None
+
+
 @app.route('/simulado/detalhes/<int:exame_id>', methods=['GET'])
 def get_detalhes_exame(exame_id):
     try:
+        # A versão do banco de questões entra na chave: questões recarregadas geram um novo ETag
+        versao = obter_indice_questoes()['versao']
+        linha = versao_linha_detalhes('exame', exame_id)
+        if linha is None:
+            return jsonify({'error': 'Exame não encontrado'}), 404
 
-        sql_exame = text("SELECT criado_em FROM exames WHERE id = :eid")
-        exame = db.session.execute(sql_exame, {'eid': exame_id}).fetchone()
-        
-        if not exame:
+        entrada = cache_detalhes.get(('exame', exame_id))
+        if entrada and entrada['versao'] == versao and entrada['linha'] == linha:
+            return resposta_detalhes(entrada)
+
+        montado = montar_detalhes_exame(exame_id)
+        if not montado:
             return jsonify({'error': 'Exame não encontrado'}), 404
-            
-        data_formatada = exame.criado_em.strftime('%d/%m/%Y às %H:%M') if exame.criado_em else "-"
-    
-        sql = text("""
-            SELECT 
-                q.enunciado, 
-                q.alternativa_a, q.alternativa_b, q.alternativa_c, q.alternativa_d, q.alternativa_e,
-                q.resposta_correta,
-                eq.resposta_usuario,
-                m.nome as materia
-            FROM exames_questoes eq
-            JOIN questoes q ON eq.questao_id = q.id
-            JOIN materias m ON q.materia_id = m.id
-            WHERE eq.exame_id = :eid
-        """)
-        
-        result = db.session.execute(sql, {'eid': exame_id}).fetchall()
-        
-        detalhes = []
-        for row in result:
-            detalhes.append({
-                'enunciado': row.enunciado,
-                'materia': row.materia,
-                'marcada': row.resposta_usuario, 
-                'gabarito': row.resposta_correta, 
-                'opcoes': {
-                    'A': row.alternativa_a,
-                    'B': row.alternativa_b,
-                    'C': row.alternativa_c,
-                    'D': row.alternativa_d,
-                    'E': row.alternativa_e
-                }
-            })
-            
-        return jsonify({
-            'data': data_formatada,
-            'questoes': detalhes}), 200
+
+        payload, finalizado = montado
+        if not finalizado:
+            # Exame em andamento ainda recebe respostas: sem cache
+            return jsonify(payload), 200
+
+        entrada = dict(entrada_detalhes(payload), versao=versao, linha=linha)
+        cache_detalhes.set(('exame', exame_id), entrada)
+        return resposta_detalhes(entrada)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+PROMPT_TEMA = """
+        Você é um especialista no ENEM. Crie um tema de redação completo, inédito e busque textos de apoios para esse tema igual como o enem faz e disponibilize 3 para o usuario.
+        Retorne APENAS um JSON válido neste formato (sem markdown):
+        {
+            "tema": "Título do Tema",
+            "texto_apoio": "Texto motivador 1... Texto motivador 2... Texto motivador 3..."
+        }
+        """
+
+TEMAS_POOL_MIN = int(os.getenv('TEMAS_POOL_MIN', 5))
+
+executor_temas = ThreadPoolExecutor(max_workers=1, thread_name_prefix='temas')
+_reposicao_temas = {'agendada': False}
+_reposicao_temas_lock = threading.Lock()
+
+
+def gerar_tema_openai():
+    return llm.completar_json(
+        'tema',
+        messages=[{"role": "user", "content": PROMPT_TEMA}],
+        temperature=0.8
+    )
+
+
+def reservar_tema_pool():
+    sql = text("""
+        UPDATE temas_redacao SET usado_em = NOW()
+        WHERE id = (
+            SELECT id FROM temas_redacao
+            WHERE gerado_por_ia AND usado_em IS NULL
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, tema, texto_de_apoio
+    """)
+    tema = db.session.execute(sql).fetchone()
+    db.session.commit()
+    return tema
+
+
+def repor_temas_pool():
+    if not client:
+        return 0
+
+    gerados = 0
+    disponiveis = db.session.execute(text("SELECT COUNT(*) FROM temas_redacao WHERE gerado_por_ia AND usado_em IS NULL")).scalar() or 0
+    while disponiveis + gerados < TEMAS_POOL_MIN:
+        dados_ia = gerar_tema_openai()
+        db.session.execute(text("INSERT INTO temas_redacao (tema, texto_de_apoio, gerado_por_ia, usado_em) VALUES (:tema, :apoio, TRUE, NULL)"),
+                           {'tema': dados_ia['tema'], 'apoio': dados_ia['texto_apoio']})
+        db.session.commit()
+        gerados += 1
+    return gerados
+
+
+def _executar_reposicao_temas():
+    try:
+        with app.app_context():
+            gerados = repor_temas_pool()
+            if gerados:
+                registrar_log_json({'evento': 'pool_temas', 'gerados': gerados})
+    except Exception as e:
+        registrar_log_json({'evento': 'pool_temas', 'erro': str(e)}, nivel=logging.WARNING)
+    finally:
+        with _reposicao_temas_lock:
+            _reposicao_temas['agendada'] = False
+
+
+def agendar_reposicao_temas():
+    if not client:
+        return
+    with _reposicao_temas_lock:
+        if _reposicao_temas['agendada']:
+            return
+        _reposicao_temas['agendada'] = True
+    executor_temas.submit(_executar_reposicao_temas)
+
+
+@app.cli.command('repor-temas')
+def repor_temas_command():
+    gerados = repor_temas_pool()
+    print(f"{gerados} temas gerados. Pool mínimo: {TEMAS_POOL_MIN}.")
+
+
+TEMAS_BACKUP = [
+    "Os desafios do combate à fome no Brasil",
+    "A importância da preservação da Amazônia",
+    "Impactos da inteligência artificial no mercado de trabalho",
+    "Caminhos para combater a intolerância religiosa no Brasil",
+    "A democratização do acesso ao cinema no Brasil",
+    "Desafios para a valorização de comunidades e povos tradicionais no Brasil",
+    "Estigmas associados às doenças mentais na sociedade brasileira"
+]
+
+
+def tema_backup(motivo):
+    print(f"⚠️ FALHA NA IA: {motivo}. Usando Backup.")
+    return {
+        'id': 1, 
+        'tema': random.choice(TEMAS_BACKUP), 
+        'texto_apoio': "Backup: IA indisponível."
+    }
+
+
 @app.route('/redacao/tema', methods=['GET'])
 def get_tema_redacao():
     print("--- INICIANDO GERAÇÃO DE TEMA ---")
    
     def usar_backup(motivo):
-        print(f"⚠️ FALHA NA IA: {motivo}. Usando Backup.")
-        temas = [
-        "Os desafios do combate à fome no Brasil",
-        "A importância da preservação da Amazônia",
-        "Impactos da inteligência artificial no mercado de trabalho",
-        "Caminhos para combater a intolerância religiosa no Brasil",
-        "A democratização do acesso ao cinema no Brasil",
-        "Desafios para a valorização de comunidades e povos tradicionais no Brasil",
-        "Estigmas associados às doenças mentais na sociedade brasileira"
-    ]
-        import random
-        return jsonify({
-            'id': 1, 
-            'tema': random.choice(temas), 
-            'texto_apoio': "Backup: IA indisponível."
-        }), 200
+        return jsonify(tema_backup(motivo)), 200
+
+    try:
+        tema = reservar_tema_pool()
+        agendar_reposicao_temas()
+        if tema:
+            return jsonify({'id': tema.id, 'tema': tema.tema, 'texto_apoio': tema.texto_de_apoio}), 200
+    except Exception as e:
+        db.session.rollback()
+        registrar_log_json({'evento': 'pool_temas', 'erro': str(e)}, nivel=logging.WARNING)
     
     if not client:
         return usar_backup("Sem API Key configurada")
     
     try:
-        prompt_sistema = """
-        Você é um especialista no ENEM. Crie um tema de redação completo, inédito e busque textos de apoios para esse tema igual como o enem faz e disponibilize 3 para o usuario.
-        Retorne APENAS um JSON válido neste formato (sem markdown):
-        {
-            "tema": "Título do Tema",
-            "texto_apoio": "Texto motivador 1... Texto motivador 2... Texto motivador 3..."
-        }
-        """
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", 
-            messages=[{"role": "user", "content": prompt_sistema}],
-            temperature=0.8
-        )
-        content = response.choices[0].message.content.replace("```json", "").replace("```", "").strip()
-        dados_ia = json.loads(content)
+        # Pool vazio: gera na hora enquanto o repositor trabalha em segundo plano
+        dados_ia = gerar_tema_openai()
 
         try:
-            sql_save = text("INSERT INTO temas_redacao (tema, texto_de_apoio, gerado_por_ia) VALUES (:tema, :apoio, TRUE) RETURNING id")
+            sql_save = text("INSERT INTO temas_redacao (tema, texto_de_apoio, gerado_por_ia, usado_em) VALUES (:tema, :apoio, TRUE, NOW()) RETURNING id")
             result = db.session.execute(sql_save, {'tema': dados_ia['tema'], 'apoio': dados_ia['texto_apoio']})
             novo_id = result.fetchone()[0]
             db.session.commit()
@@ -391,16 +1011,354 @@ def gerar_tema_ia():
     return get_tema_redacao()
 
 
+REDACAO_LINHAS_MINIMAS = int(os.getenv('REDACAO_LINHAS_MINIMAS', 7))
+REDACAO_CARACTERES_POR_LINHA = int(os.getenv('REDACAO_CARACTERES_POR_LINHA', 70))
+
+
+def triagem_local(final_tema_id, titulo_tema, texto_usuario):
+    apoio = db.session.execute(text("SELECT texto_de_apoio FROM temas_redacao WHERE id = :tid"), {'tid': final_tema_id}).scalar()
+    return triar_redacao(texto_usuario, (titulo_tema, apoio), linhas_min=REDACAO_LINHAS_MINIMAS,
+                         caracteres_por_linha=REDACAO_CARACTERES_POR_LINHA)
+
+
+def resultado_triagem(triagem, texto_usuario):
+    codigo, motivo = triagem
+    print(f"🚨 TRIAGEM LOCAL: {codigo}. Zerando sem chamar a IA.")
+    notas = {f'c{i}': 0 for i in range(1, 6)}
+    resultado_ia = {
+        'situacao_tema': codigo,
+        'texto_transcrito': texto_usuario or '',
+        'notas': notas,
+        'comentario_geral': f"REDAÇÃO ZERADA. {motivo}",
+        'detalhes_competencias': {f'c{i}': motivo for i in range(1, 6)},
+        'triagem_local': True
+    }
+    return texto_usuario or ' ', notas, resultado_ia
+
+
+def mensagens_correcao(titulo_tema, texto_usuario, imagem_base64):
+    prompt_sistema = """
+    Atue como um corretor oficial do ENEM. Seja rigoroso e analise as 5 competências.
+
+    O TEMA DA REDAÇÃO É: "{titulo_tema}"
+
+    Sua análise deve seguir ESTRITAMENTE esta ordem lógica (não pule etapas):
+
+   ETAPA 1: CLASSIFICAÇÃO
+    - "FUGA": Texto fala de assunto totalmente diferente.
+    - "TANGENTE": Texto fala do assunto geral, mas ignora o recorte específico.
+    - "OK": Texto aborda o tema corretamente.
+
+    ETAPA 2: NOTAS
+    - Se "FUGA": Todas as notas 0.
+    - Se "TANGENTE": C2, C3 e C5 máximo 40.
+    - Se "OK": Avalie 0-200.
+    
+    SE RECEBER UMA IMAGEM: 
+    1. Transcreva o texto manuscrito fielmente para o campo "texto_transcrito".
+    2. Corrija baseando-se na transcrição.
+    
+    SE RECEBER APENAS TEXTO:
+    1. Copie o texto recebido para o campo "texto_transcrito".
+    2. Corrija o texto.
+
+    SAÍDA OBRIGATÓRIA (JSON cru, sem markdown):
+    {{
+        "situacao_tema": "FUGA" ou "TANGENTE" ou "OK",
+        "texto_transcrito": "Texto completo...",
+        "notas": {{ "c1": 0, "c2": 0, "c3": 0, "c4": 0, "c5": 0 }},
+        "comentario_geral": "Se houver fuga ao tema, escreva APENAS: 'Redação zerada por fuga ao tema'. Caso contrário, faça um resumo de 3 linhas.",
+        "detalhes_competencias": {{
+            "c1": "...", "c2": "...", "c3": "...", "c4": "...", "c5": "..."
+        }}
+    }}
+    """
+
+    
+    mensagens_api = [{"role": "system", "content": prompt_sistema}]
+
+    if imagem_base64:
+        
+        mensagens_api.append({
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"O tema da redação é: '{titulo_tema}'. Por favor, transcreva e corrija esta imagem."},
+                {"type": "image_url", "image_url": {"url": imagem_base64}}
+            ]
+        })
+        model_to_use = "gpt-4o-mini"  
+    else:
+        mensagens_api.append({"role": "user", "content": f"Tema: '{titulo_tema}'.\nRedação:\n{texto_usuario}"})
+        model_to_use = "gpt-4o-mini"
+
+    return model_to_use, mensagens_api
+
+
+def aplicar_situacao_tema(resultado_ia, titulo_tema, texto_usuario):
+    situacao = resultado_ia.get('situacao_tema', 'OK').upper()
+    texto_final = resultado_ia.get('texto_transcrito')
+    if not texto_final: texto_final = texto_usuario if texto_usuario else " [Texto Imagem] "
+
+    notas = resultado_ia.get('notas', {})
+    if situacao == 'FUGA':
+        print("🚨 FUGA DETECTADA: Zerando tudo.")
+        notas = { 'c1': 0, 'c2': 0, 'c3': 0, 'c4': 0, 'c5': 0 }
+        resultado_ia['comentario_geral'] = f"REDAÇÃO ZERADA. Fuga ao tema '{titulo_tema}'."
+    
+    elif situacao == 'TANGENTE':
+        print("⚠️ TANGENCIAMENTO: Aplicando teto de 40 pontos.")
+
+        notas['c2'] = min(notas.get('c2', 0), 40)
+        notas['c3'] = min(notas.get('c3', 0), 40)
+        notas['c5'] = min(notas.get('c5', 0), 40)
+        resultado_ia['comentario_geral'] = f"NOTA REBAIXADA. Você tangenciou o tema '{titulo_tema}'."
+
+    return texto_final, notas, resultado_ia
+
+
+def corrigir_redacao(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo=None, chave_idempotencia=None):
+    if not imagem_base64:
+        # Casos de nota zero automática não precisam da IA
+        triagem = triagem_local(final_tema_id, titulo_tema, texto_usuario)
+        if triagem:
+            texto_final, notas, resultado_ia = resultado_triagem(triagem, texto_usuario)
+            return salvar_correcao(usuario_id, final_tema_id, titulo_tema, texto_final, notas, resultado_ia, hash_conteudo, chave_idempotencia)
+
+    model_to_use, mensagens_api = mensagens_correcao(titulo_tema, texto_usuario, imagem_base64)
+    resultado_ia = llm.completar_json('redacao', model=model_to_use, messages=mensagens_api, temperature=0.4, max_tokens=4096)
+    texto_final, notas, resultado_ia = aplicar_situacao_tema(resultado_ia, titulo_tema, texto_usuario)
+
+    return salvar_correcao(usuario_id, final_tema_id, titulo_tema, texto_final, notas, resultado_ia, hash_conteudo, chave_idempotencia)
+
+
+def salvar_correcao(usuario_id, final_tema_id, titulo_tema, texto_final, notas, resultado_ia, hash_conteudo=None, chave_idempotencia=None):
+    soma_total = sum(int(notas.get(f'c{i}', 0)) for i in range(1, 6))
+
+    sql_insert = text("""
+        INSERT INTO redacoes (usuario_id, tema_id, texto, enviado_em, hash_conteudo, chave_idempotencia) 
+        VALUES (:uid, :tid, :txt, NOW(), :hash, :chave) RETURNING id
+    """)
+
+    rid = db.session.execute(sql_insert, {
+        'uid': int(usuario_id), 
+        'tid': final_tema_id, 
+        'txt': texto_final,
+        'hash': hash_conteudo,
+        'chave': chave_idempotencia
+    }).fetchone()[0]
+
+    for i in range(1, 6):
+        db.session.execute(text("INSERT INTO redacoes_competencias (redacao_id, competencia, nota) VALUES (:rid, :comp, :n)"), 
+                           {'rid': rid, 'comp': i, 'n': int(notas.get(f'c{i}', 0))})
+
+    json_str = json.dumps(resultado_ia)
+    atualizar_dashboard_resumo(int(usuario_id), redacoes=1)
+    
+    db.session.execute(text("""
+        INSERT INTO redacoes_avaliacao_final (redacao_id, nota_total, observacoes, detalhamento_ia) 
+        VALUES (:rid, :nt, :obs, :det)
+        ON CONFLICT (redacao_id) 
+        DO UPDATE SET observacoes = :obs, detalhamento_ia = :det, nota_total = :nt
+    """), {'rid': rid, 'nt': soma_total, 'obs': resultado_ia.get('comentario_geral'), 'det': json_str})
+
+    db.session.commit()
+    invalidar_detalhes('redacao', rid)
+
+    return {
+        'message': 'Sucesso',
+        'id': rid,
+        'tema_usado': titulo_tema,
+        'tema_id_usado': final_tema_id,
+        'nota_total': soma_total,
+        'notas_por_competencia': notas,
+        'comentario_geral': resultado_ia.get('comentario_geral'),
+        'detalhes_erros': resultado_ia.get('detalhes_competencias', {})
+    }
+
+
+REDACAO_IMAGEM_MAX_LADO = int(os.getenv('REDACAO_IMAGEM_MAX_LADO', 1600))
+REDACAO_IMAGEM_QUALIDADE = int(os.getenv('REDACAO_IMAGEM_QUALIDADE', 80))
+# Uma foto de celular de 48 MP cabe; acima disso a imagem é recusada antes de ser decodificada
+REDACAO_IMAGEM_MAX_PIXELS = int(os.getenv('REDACAO_IMAGEM_MAX_PIXELS', 50_000_000))
+
+ERROS_IMAGEM = (binascii.Error, ValueError, OSError)
+if Image is not None:
+    Image.MAX_IMAGE_PIXELS = REDACAO_IMAGEM_MAX_PIXELS
+    ERROS_IMAGEM += (UnidentifiedImageError, Image.DecompressionBombError)
+
+
+def preparar_imagem_redacao(arquivo, mimetype='image/jpeg'):
+    # Reduz e recomprime a foto antes de mandar para o modelo de visão (menos bytes e menos tokens)
+    if Image is None:
+        conteudo = arquivo.read()
+        return f"data:{mimetype};base64,{base64.b64encode(conteudo).decode('ascii')}"
+
+    with Image.open(arquivo) as img:
+        # O Pillow só levanta DecompressionBombError acima do dobro do limite; entre 1x e 2x ele apenas avisa
+        if img.width * img.height > REDACAO_IMAGEM_MAX_PIXELS:
+            raise Image.DecompressionBombError(f"Imagem com {img.width}x{img.height} pixels passa do limite de {REDACAO_IMAGEM_MAX_PIXELS}")
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((REDACAO_IMAGEM_MAX_LADO, REDACAO_IMAGEM_MAX_LADO))
+
+        saida = io.BytesIO()
+        img.save(saida, format='JPEG', quality=REDACAO_IMAGEM_QUALIDADE, optimize=True)
+
+    return f"data:image/jpeg;base64,{base64.b64encode(saida.getvalue()).decode('ascii')}"
+
+
+REDACAO_ESPERA_DUPLICADA = int(os.getenv('REDACAO_ESPERA_DUPLICADA', 120))
+REDACAO_ESPERA_INTERVALO = float(os.getenv('REDACAO_ESPERA_INTERVALO', 1))
+# Mesmo texto reenviado depois disso é uma nova tentativa do aluno e ganha correção nova; a chave de idempotência não expira
+REDACAO_JANELA_DUPLICADA = int(os.getenv('REDACAO_JANELA_DUPLICADA', 600))
+
+
+def calcular_hash_redacao(tema_id, texto_usuario, imagem_base64):
+    h = hashlib.sha256(f"{tema_id}|".encode('utf-8'))
+    if imagem_base64:
+        # Hash dos bytes da imagem, não do data URL, para ignorar diferenças de cabeçalho
+        conteudo = imagem_base64.split(',', 1)[-1]
+        try:
+            h.update(b'img|' + base64.b64decode(conteudo, validate=False))
+        except (binascii.Error, ValueError):
+            h.update(b'img|' + conteudo.encode('utf-8'))
+    else:
+        h.update(b'txt|' + ' '.join((texto_usuario or '').split()).encode('utf-8'))
+    return h.hexdigest()
+
+
+def buscar_correcao_existente(usuario_id, hash_conteudo, chave_idempotencia=None):
+    sql = text("""
+        SELECT r.id, r.tema_id, t.tema, raf.nota_total, raf.observacoes, raf.detalhamento_ia
+        FROM redacoes r
+        JOIN redacoes_avaliacao_final raf ON raf.redacao_id = r.id
+        LEFT JOIN temas_redacao t ON t.id = r.tema_id
+        WHERE r.usuario_id = :uid
+          AND ((r.hash_conteudo = :hash AND r.enviado_em > NOW() - make_interval(secs => :janela))
+               OR (CAST(:chave AS varchar) IS NOT NULL AND r.chave_idempotencia = :chave))
+          AND raf.detalhamento_ia IS NOT NULL
+        ORDER BY r.id DESC
+        LIMIT 1
+    """)
+    row = db.session.execute(sql, {'uid': int(usuario_id), 'hash': hash_conteudo, 'chave': chave_idempotencia,
+                                   'janela': REDACAO_JANELA_DUPLICADA}).fetchone()
+    if not row:
+        return None
+
+    comps = db.session.execute(text("SELECT competencia, nota FROM redacoes_competencias WHERE redacao_id = :rid ORDER BY competencia"),
+                               {'rid': row.id}).fetchall()
+    dados_ia = row.detalhamento_ia if isinstance(row.detalhamento_ia, dict) else json.loads(row.detalhamento_ia)
+
+    return {
+        'message': 'Sucesso',
+        'id': row.id,
+        'tema_usado': row.tema if row.tema else "Tema Livre / Não informado",
+        'tema_id_usado': row.tema_id,
+        'nota_total': int(row.nota_total),
+        'notas_por_competencia': {f"c{c.competencia}": c.nota for c in comps},
+        'comentario_geral': row.observacoes,
+        'detalhes_erros': dados_ia.get('detalhes_competencias', {}),
+        'reaproveitada': True
+    }
+
+
+def reservar_correcao(usuario_id, hash_conteudo, job_id=None):
+    """True se esta requisição ficou com a correção do envio; False se outra (em qualquer worker) já está corrigindo."""
+    # Reserva parada há mais que a espera máxima é de um worker que caiu no meio: pode ser retomada
+    row = db.session.execute(text("""
+        INSERT INTO redacoes_em_correcao (usuario_id, hash_conteudo, job_id)
+        VALUES (:uid, :hash, :jid)
+        ON CONFLICT (usuario_id, hash_conteudo) DO UPDATE SET iniciado_em = NOW(), job_id = EXCLUDED.job_id
+        WHERE redacoes_em_correcao.iniciado_em < NOW() - make_interval(secs => :espera)
+        RETURNING 1
+    """), {'uid': int(usuario_id), 'hash': hash_conteudo, 'jid': job_id, 'espera': REDACAO_ESPERA_DUPLICADA}).fetchone()
+    db.session.commit()
+    return row is not None
+
+
+def job_da_correcao_em_andamento(usuario_id, hash_conteudo):
+    return db.session.execute(text("""
+        SELECT job_id FROM redacoes_em_correcao
+        WHERE usuario_id = :uid AND hash_conteudo = :hash
+          AND iniciado_em >= NOW() - make_interval(secs => :espera)
+    """), {'uid': int(usuario_id), 'hash': hash_conteudo, 'espera': REDACAO_ESPERA_DUPLICADA}).scalar()
+
+
+def liberar_correcao(usuario_id, hash_conteudo):
+    db.session.rollback()
+    db.session.execute(text("DELETE FROM redacoes_em_correcao WHERE usuario_id = :uid AND hash_conteudo = :hash"),
+                       {'uid': int(usuario_id), 'hash': hash_conteudo})
+    db.session.commit()
+
+
+def corrigir_redacao_reservada(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia=None):
+    # Para quem já está com a reserva do envio: corrige e libera, com sucesso ou não
+    try:
+        return corrigir_redacao(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia)
+    finally:
+        try:
+            liberar_correcao(usuario_id, hash_conteudo)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Aviso: reserva da correção não liberada (expira em {REDACAO_ESPERA_DUPLICADA}s): {e}")
+
+
+def corrigir_redacao_deduplicada(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia=None, job_id=None):
+    existente = buscar_correcao_existente(usuario_id, hash_conteudo, chave_idempotencia)
+    if existente:
+        return existente
+
+    # Roda nos jobs, então a espera ocupa uma thread do executor e não a da requisição.
+    # Envio idêntico já em correção: espera o resultado dele em vez de chamar a IA de novo.
+    # Se o dono falhar, a reserva some e quem estava esperando assume; passado o prazo, corrige mesmo assim.
+    dono = reservar_correcao(usuario_id, hash_conteudo, job_id)
+    prazo = time.monotonic() + REDACAO_ESPERA_DUPLICADA
+    while not dono and time.monotonic() < prazo:
+        time.sleep(REDACAO_ESPERA_INTERVALO)
+        existente = buscar_correcao_existente(usuario_id, hash_conteudo, chave_idempotencia)
+        if existente:
+            return existente
+        dono = reservar_correcao(usuario_id, hash_conteudo, job_id)
+
+    if not dono:
+        return corrigir_redacao(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia)
+    return corrigir_redacao_reservada(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia)
+
+
+def resposta_job_redacao(job_id):
+    return jsonify({
+        'job_id': job_id,
+        'status': 'pendente',
+        'status_url': f'/redacao/jobs/{job_id}',
+        'stream_url': f'/redacao/jobs/{job_id}/stream'
+    }), 202
+
+
 @app.route('/redacao/enviar', methods=['POST'])
 def enviar_redacao():
     if not client: 
         return jsonify({'error': 'Sem API KEY configurada'}), 500
 
-    data = request.get_json()
+    try:
+        if request.mimetype == 'multipart/form-data':
+            # O Werkzeug grava uploads grandes em arquivo temporário em vez de mantê-los na memória
+            data = request.form
+            arquivo = request.files.get('imagem')
+            imagem_base64 = preparar_imagem_redacao(arquivo.stream, arquivo.mimetype) if arquivo and arquivo.filename else None
+        else:
+            data = request.get_json()
+            imagem_base64 = data.get('imagem')
+            if imagem_base64:
+                conteudo = base64.b64decode(imagem_base64.split(',', 1)[-1])
+                imagem_base64 = preparar_imagem_redacao(io.BytesIO(conteudo))
+    except ERROS_IMAGEM as e:
+        print(f"ERRO: imagem inválida: {e}")
+        return jsonify({'error': 'Imagem inválida. Envie uma foto em JPG ou PNG.'}), 400
+
     usuario_id = data.get('usuario_id')
     tema_id_raw = data.get('tema_id')
     texto_usuario = data.get('texto') 
-    imagem_base64 = data.get('imagem')
 
     print(f"DEBUG: Recebido usuario_id={usuario_id}, tema_id={tema_id_raw}")
 
@@ -424,286 +1382,312 @@ def enviar_redacao():
     else:
         print("AVISO: tema_id veio vazio ou nulo. Usando Backup (1).")
 
-    try:    
-        prompt_sistema = """
-        Atue como um corretor oficial do ENEM. Seja rigoroso e analise as 5 competências.
+    if not imagem_base64 and not texto_usuario:
+        return jsonify({'error': 'Nenhum texto ou imagem fornecido.'}), 400
 
-        O TEMA DA REDAÇÃO É: "{titulo_tema}"
+    hash_conteudo = calcular_hash_redacao(final_tema_id, texto_usuario, imagem_base64)
+    chave_idempotencia = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '')[:100] or None
+    argumentos = (usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia)
 
-        Sua análise deve seguir ESTRITAMENTE esta ordem lógica (não pule etapas):
+    try:
+        existente = buscar_correcao_existente(usuario_id, hash_conteudo, chave_idempotencia)
+        if existente:
+            return jsonify(existente), 200
+    except Exception as e:
+        db.session.rollback()
+        print(f"Aviso: erro ao buscar correção existente: {e}")
 
-       ETAPA 1: CLASSIFICAÇÃO
-        - "FUGA": Texto fala de assunto totalmente diferente.
-        - "TANGENTE": Texto fala do assunto geral, mas ignora o recorte específico.
-        - "OK": Texto aborda o tema corretamente.
+    assincrono = str(data.get('assincrono')).lower() in ('1', 'true', 'sim') or request.args.get('modo') == 'job'
 
-        ETAPA 2: NOTAS
-        - Se "FUGA": Todas as notas 0.
-        - Se "TANGENTE": C2, C3 e C5 máximo 40.
-        - Se "OK": Avalie 0-200.
-        
-        SE RECEBER UMA IMAGEM: 
-        1. Transcreva o texto manuscrito fielmente para o campo "texto_transcrito".
-        2. Corrija baseando-se na transcrição.
-        
-        SE RECEBER APENAS TEXTO:
-        1. Copie o texto recebido para o campo "texto_transcrito".
-        2. Corrija o texto.
-
-        SAÍDA OBRIGATÓRIA (JSON cru, sem markdown):
-        {{
-            "situacao_tema": "FUGA" ou "TANGENTE" ou "OK",
-            "texto_transcrito": "Texto completo...",
-            "notas": {{ "c1": 0, "c2": 0, "c3": 0, "c4": 0, "c5": 0 }},
-            "comentario_geral": "Se houver fuga ao tema, escreva APENAS: 'Redação zerada por fuga ao tema'. Caso contrário, faça um resumo de 3 linhas.",
-            "detalhes_competencias": {{
-                "c1": "...", "c2": "...", "c3": "...", "c4": "...", "c5": "..."
-            }}
-        }}
-        """
+    try:
+        if not assincrono and reservar_correcao(usuario_id, hash_conteudo):
+            return jsonify(corrigir_redacao_reservada(*argumentos)), 201
+
+        # Envio idêntico já em correção: em vez de segurar esta requisição esperando, devolve o job dele
+        # (ou um job novo que espera pelo resultado, se o original veio pelo modo síncrono)
+        job_id = job_da_correcao_em_andamento(usuario_id, hash_conteudo) or enfileirar_correcao(int(usuario_id), argumentos)
+        if not job_id:
+            return jsonify({'error': 'Muitas correções em andamento. Tente novamente em instantes.'}), 503
+        return resposta_job_redacao(job_id)
+    except Exception as e:
+        db.session.rollback()
+        print(f"ERRO: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        
-        mensagens_api = [{"role": "system", "content": prompt_sistema}]
 
-        if imagem_base64:
-            
-            mensagens_api.append({
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": f"O tema da redação é: '{titulo_tema}'. Por favor, transcreva e corrija esta imagem."},
-                    {"type": "image_url", "image_url": {"url": imagem_base64}}
-                ]
-            })
-            model_to_use = "gpt-4o-mini"  
-        else:
-            if not texto_usuario:
-                 return jsonify({'error': 'Nenhum texto ou imagem fornecido.'}), 400
-            mensagens_api.append({"role": "user", "content": f"Tema: '{titulo_tema}'.\nRedação:\n{texto_usuario}"})
-            model_to_use = "gpt-4o-mini"
+REDACAO_WORKERS = int(os.getenv('REDACAO_WORKERS', 4))
+REDACAO_FILA_MAX = int(os.getenv('REDACAO_FILA_MAX', 50))
+REDACAO_STREAM_TIMEOUT = int(os.getenv('REDACAO_STREAM_TIMEOUT', 300))
 
+executor_redacoes = ThreadPoolExecutor(max_workers=REDACAO_WORKERS, thread_name_prefix='redacao')
+_vagas_fila_redacoes = threading.BoundedSemaphore(REDACAO_FILA_MAX)
 
-        response = client.chat.completions.create(model=model_to_use, messages=mensagens_api, temperature=0.4, max_tokens=4096)
 
-        conteudo_ia = response.choices[0].message.content
-        resultado_ia = json.loads(conteudo_ia.replace("```json", "").replace("```", "").strip())
-        situacao = resultado_ia.get('situacao_tema', 'OK').upper()
-        texto_final = resultado_ia.get('texto_transcrito')
-        if not texto_final: texto_final = texto_usuario if texto_usuario else " [Texto Imagem] "
-    
-        notas = resultado_ia.get('notas', {})
-        if situacao == 'FUGA':
-            print("🚨 FUGA DETECTADA: Zerando tudo.")
-            notas = { 'c1': 0, 'c2': 0, 'c3': 0, 'c4': 0, 'c5': 0 }
-            resultado_ia['comentario_geral'] = f"REDAÇÃO ZERADA. Fuga ao tema '{titulo_tema}'."
-        
-        elif situacao == 'TANGENTE':
-            print("⚠️ TANGENCIAMENTO: Aplicando teto de 40 pontos.")
+def _atualizar_job_redacao(job_id, status, resultado=None, erro=None):
+    db.session.execute(text("""
+        UPDATE redacoes_jobs
+        SET status = :status, resultado = :resultado, erro = :erro, atualizado_em = NOW()
+        WHERE id = :jid
+    """), {'jid': job_id, 'status': status, 'resultado': resultado, 'erro': erro})
+    db.session.commit()
 
-            notas['c2'] = min(notas.get('c2', 0), 40)
-            notas['c3'] = min(notas.get('c3', 0), 40)
-            notas['c5'] = min(notas.get('c5', 0), 40)
-            resultado_ia['comentario_geral'] = f"NOTA REBAIXADA. Você tangenciou o tema '{titulo_tema}'."
 
-        soma_total = sum(int(notas.get(f'c{i}', 0)) for i in range(1, 6))
-
-        sql_insert = text("""
-            INSERT INTO redacoes (usuario_id, tema_id, texto, enviado_em) 
-            VALUES (:uid, :tid, :txt, NOW()) RETURNING id
-        """)
-    
-        rid = db.session.execute(sql_insert, {
-            'uid': int(usuario_id), 
-            'tid': final_tema_id, 
-            'txt': texto_final
-        }).fetchone()[0]
+def _executar_job_redacao(job_id, argumentos):
+    try:
+        with app.app_context():
+            try:
+                _atualizar_job_redacao(job_id, 'processando')
+                resultado = corrigir_redacao_deduplicada(*argumentos, job_id=job_id)
+                _atualizar_job_redacao(job_id, 'concluido', resultado=json.dumps(resultado))
+            except Exception as e:
+                db.session.rollback()
+                registrar_log_json({'evento': 'job_redacao', 'job_id': job_id, 'erro': str(e)}, nivel=logging.ERROR)
+                _atualizar_job_redacao(job_id, 'erro', erro=str(e))
+    finally:
+        _vagas_fila_redacoes.release()
+
+
+def enfileirar_correcao(usuario_id, argumentos):
+    if not _vagas_fila_redacoes.acquire(blocking=False):
+        return None
 
-        for i in range(1, 6):
-            db.session.execute(text("INSERT INTO redacoes_competencias (redacao_id, competencia, nota) VALUES (:rid, :comp, :n)"), 
-                               {'rid': rid, 'comp': i, 'n': int(notas.get(f'c{i}', 0))})
+    try:
+        job_id = uuid.uuid4().hex
+        db.session.execute(text("INSERT INTO redacoes_jobs (id, usuario_id, status) VALUES (:jid, :uid, 'pendente')"),
+                           {'jid': job_id, 'uid': usuario_id})
+        db.session.commit()
+        executor_redacoes.submit(_executar_job_redacao, job_id, argumentos)
+        return job_id
+    except Exception:
+        db.session.rollback()
+        _vagas_fila_redacoes.release()
+        raise
 
-        json_str = json.dumps(resultado_ia)
-        
-        db.session.execute(text("""
-            INSERT INTO redacoes_avaliacao_final (redacao_id, nota_total, observacoes, detalhamento_ia) 
-            VALUES (:rid, :nt, :obs, :det)
-            ON CONFLICT (redacao_id) 
-            DO UPDATE SET observacoes = :obs, detalhamento_ia = :det, nota_total = :nt
-        """), {'rid': rid, 'nt': soma_total, 'obs': resultado_ia.get('comentario_geral'), 'det': json_str})
 
-        db.session.commit()
+def _consultar_job_redacao(job_id):
+    row = db.session.execute(text("SELECT id, status, resultado, erro FROM redacoes_jobs WHERE id = :jid"), {'jid': job_id}).fetchone()
+    if not row:
+        return None
+    job = {'job_id': row.id, 'status': row.status}
+    if row.resultado:
+        job['resultado'] = json.loads(row.resultado)
+    if row.erro:
+        job['erro'] = row.erro
+    return job
 
-        return jsonify({
-            'message': 'Sucesso',
-            'id': rid,
-            'tema_usado': titulo_tema,
-            'tema_id_usado': final_tema_id,
-            'nota_total': soma_total,
-            'notas_por_competencia': notas,
-            'comentario_geral': resultado_ia.get('comentario_geral'),
-            'detalhes_erros': resultado_ia.get('detalhes_competencias', {})
-        }), 201
 
+@app.route('/redacao/jobs/<job_id>', methods=['GET'])
+def get_job_redacao(job_id):
+    try:
+        job = _consultar_job_redacao(job_id)
+        if not job:
+            return jsonify({'error': 'Job não encontrado'}), 404
+        return jsonify(job), 200
     except Exception as e:
-        db.session.rollback()
-        print(f"ERRO: {e}")
         return jsonify({'error': str(e)}), 500
-    
+
+
+@app.route('/redacao/jobs/<job_id>/stream', methods=['GET'])
+def stream_job_redacao(job_id):
+    def eventos():
+        ultimo_status = None
+        limite = time.monotonic() + REDACAO_STREAM_TIMEOUT
+        while time.monotonic() < limite:
+            job = _consultar_job_redacao(job_id)
+            # Devolve a conexão ao pool entre uma consulta e outra
+            db.session.close()
+
+            if not job:
+                yield f"event: erro\ndata: {json.dumps({'error': 'Job não encontrado'})}\n\n"
+                return
+
+            if job['status'] != ultimo_status:
+                ultimo_status = job['status']
+                yield f"event: {job['status']}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                if job['status'] in ('concluido', 'erro'):
+                    return
+            else:
+                yield ": aguardando\n\n"
+
+            time.sleep(1)
+
+        yield f"event: erro\ndata: {json.dumps({'error': 'Tempo de espera esgotado'})}\n\n"
+
+    return Response(stream_with_context(eventos()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+HISTORICO_LIMITE_PADRAO = int(os.getenv('HISTORICO_LIMITE_PADRAO', 20))
+HISTORICO_LIMITE_MAX = int(os.getenv('HISTORICO_LIMITE_MAX', 100))
+
+# Ordem da listagem: data desc, simulados antes de redações no mesmo instante, id desc.
+# Cada ramo já vem ordenado e limitado pelo seu índice; o UNION ALL só junta as duas páginas.
+SQL_HISTORICO = """
+    SELECT * FROM (
+        (SELECT 'SIMULADO' AS categoria, 1 AS ordem, e.id, e.criado_em AS data,
+                e.nota_total AS nota, e.acertos, e.erros, NULL AS tema
+         FROM exames e
+         WHERE e.usuario_id = :uid AND e.nota_total IS NOT NULL AND e.criado_em IS NOT NULL
+           {filtro_sim}
+         ORDER BY e.criado_em DESC, e.id DESC
+         LIMIT :lim)
+        UNION ALL
+        (SELECT 'REDACAO' AS categoria, 0 AS ordem, r.id, r.enviado_em AS data,
+                raf.nota_total AS nota, NULL AS acertos, NULL AS erros, t.tema
+         FROM redacoes r
+         JOIN redacoes_avaliacao_final raf ON r.id = raf.redacao_id
+         LEFT JOIN temas_redacao t ON r.tema_id = t.id
+         WHERE r.usuario_id = :uid AND r.enviado_em IS NOT NULL
+           {filtro_red}
+         ORDER BY r.enviado_em DESC, r.id DESC
+         LIMIT :lim)
+    ) h
+    ORDER BY data DESC, ordem DESC, id DESC
+    LIMIT :lim
+"""
+
+FILTRO_HISTORICO_SIMULADO = "AND e.criado_em <= :c_data AND (e.criado_em, 1, e.id) < (:c_data, :c_ordem, :c_id)"
+FILTRO_HISTORICO_REDACAO = "AND r.enviado_em <= :c_data AND (r.enviado_em, 0, r.id) < (:c_data, :c_ordem, :c_id)"
+
+
+def ler_cursor_historico(cursor):
+    # Formato "<data iso>,<id>[,<categoria>]", o mesmo devolvido em 'proximo'
+    partes = cursor.split(',')
+    if len(partes) not in (2, 3):
+        raise ValueError('Cursor inválido')
+    data = datetime.fromisoformat(partes[0].strip())
+    ordem = 1
+    if len(partes) == 3:
+        ordem = 1 if partes[2].strip().upper() == 'SIMULADO' else 0
+    return data, ordem, int(partes[1])
+
+
+def montar_cursor_historico(row):
+    return f"{row.data.isoformat()},{row.id},{row.categoria}"
+
+
 @app.route('/historico/<int:usuario_id>', methods=['GET'])
 def get_historico(usuario_id):
-    historico_geral = []
-    
+    paginado = 'before' in request.args or 'limit' in request.args
+
     def limpar_fuso(dt):
         if dt and hasattr(dt, 'replace'):
             return dt.replace(tzinfo=None)
         return dt
 
     try:
+        limite = min(max(int(request.args.get('limit', HISTORICO_LIMITE_PADRAO)), 1), HISTORICO_LIMITE_MAX)
+        params = {'uid': usuario_id, 'lim': limite + 1}
+        filtro_sim = filtro_red = ''
+        if request.args.get('before'):
+            params['c_data'], params['c_ordem'], params['c_id'] = ler_cursor_historico(request.args['before'])
+            filtro_sim, filtro_red = FILTRO_HISTORICO_SIMULADO, FILTRO_HISTORICO_REDACAO
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
 
-        try:
-            sql_simulados = text("""
-                SELECT id, criado_em, tipo, nota_total, acertos, erros 
-                FROM exames 
-                WHERE usuario_id = :uid AND nota_total IS NOT NULL 
-            """)
-            res_sim = db.session.execute(sql_simulados, {'uid': usuario_id}).fetchall()
-
-            for row in res_sim:
-
-                data_banco = limpar_fuso(row.criado_em)
-                
-                historico_geral.append({
-                    'categoria': 'SIMULADO',
-                    'id': row.id,
-                    'data_raw': data_banco,
-                    'data': data_banco.strftime('%d/%m/%Y às %H:%M') if data_banco else 'Data n/a',
-                    'titulo': 'Simulado ENEM',
-                    'nota': float(row.nota_total) if row.nota_total else 0,
-                    'info_extra': {'acertos': row.acertos, 'erros': row.erros}
-                })
-        except Exception as e_sim:
-            print(f"⚠️ Erro ao buscar Simulados: {e_sim}")
-
-        try:
-            sql_redacoes = text("""
-                SELECT 
-                    r.id, 
-                    raf.nota_total, 
-                    r.enviado_em, 
-                    t.tema 
-                FROM redacoes r
-                JOIN redacoes_avaliacao_final raf ON r.id = raf.redacao_id
-                LEFT JOIN temas_redacao t ON r.tema_id = t.id
-                WHERE r.usuario_id = :uid
-            """)
-            
-            res_red = db.session.execute(sql_redacoes, {'uid': usuario_id}).fetchall()
-
-            for row in res_red:
-                tema_nome = row.tema if row.tema else "Tema Livre"
-                
-                data_obj = limpar_fuso(row.enviado_em)
-                
-                data_formatada = data_obj.strftime('%d/%m/%Y às %H:%M') if data_obj else "Data desc."
-
-                historico_geral.append({
-                    'categoria': 'REDACAO',
-                    'id': row.id,
-                    'data_raw': data_obj, 
-                    'data': data_formatada,
-                    'titulo': f'Redação: {tema_nome}',
-                    'nota': float(row.nota_total) if row.nota_total else 0,
-                    'info_extra': {}
-                })
-        except Exception as e_red:
-            print(f"⚠️ Erro ao buscar Redações: {e_red}")
-
-        itens_validos = [x for x in historico_geral if x.get('data_raw')]
-        
-        itens_validos.sort(key=lambda x: x['data_raw'], reverse=True)
+    try:
+        if not paginado:
+            # Clientes antigos recebem a lista completa, mas já ordenada pelo banco
+            params['lim'] = None
+
+        sql = text(SQL_HISTORICO.format(filtro_sim=filtro_sim, filtro_red=filtro_red))
+        rows = db.session.execute(sql, params).fetchall()
+
+        proximo = None
+        if paginado and len(rows) > limite:
+            rows = rows[:limite]
+            proximo = montar_cursor_historico(rows[-1])
+
+        itens = []
+        for row in rows:
+            item = {
+                'categoria': row.categoria,
+                'id': row.id,
+                'data': limpar_fuso(row.data),
+                'nota': float(row.nota) if row.nota else 0,
+            }
+            if row.categoria == 'SIMULADO':
+                item['titulo'] = 'Simulado ENEM'
+                item['info_extra'] = {'acertos': row.acertos, 'erros': row.erros}
+            else:
+                item['titulo'] = f"Redação: {row.tema if row.tema else 'Tema Livre'}"
+                item['info_extra'] = {}
+            itens.append(item)
 
-        for item in itens_validos:
-            del item['data_raw']
-            
-        return jsonify(itens_validos), 200
+        if not paginado:
+            return jsonify(itens), 200
+        return jsonify({'itens': itens, 'proximo': proximo}), 200
 
     except Exception as e:
         print(f"🔥 ERRO FATAL GERAL: {e}")
         return jsonify({'error': str(e)}), 500
-    
+
+
+def montar_detalhes_redacao(redacao_id):
+    sql_geral = text("""
+        SELECT 
+            r.texto, 
+            t.tema, 
+            raf.nota_total, 
+            raf.observacoes as feedback_geral,
+            raf.detalhamento_ia,
+            r.enviado_em
+        FROM redacoes r
+        JOIN redacoes_avaliacao_final raf ON r.id = raf.redacao_id
+        LEFT JOIN temas_redacao t ON r.tema_id = t.id
+        WHERE r.id = :rid
+    """)
+    geral = db.session.execute(sql_geral, {'rid': redacao_id}).fetchone()
+
+    if not geral:
+        return None
+
+    sql_comp = text("SELECT competencia, nota FROM redacoes_competencias WHERE redacao_id = :rid ORDER BY competencia")
+    comps = db.session.execute(sql_comp, {'rid': redacao_id}).fetchall()
+    notas_comp = {f"c{c.competencia}": c.nota for c in comps}
+
+    detalhes_texto = {}
+    if geral.detalhamento_ia:
+        dados_ia = geral.detalhamento_ia if isinstance(geral.detalhamento_ia, dict) else json.loads(geral.detalhamento_ia)
+        detalhes_texto = dados_ia.get('detalhes_competencias', {})
+
+    return {
+        'tema': geral.tema if geral.tema else "Tema Livre",
+        'texto': geral.texto,
+        'nota_total': float(geral.nota_total),
+        'feedback_geral': geral.feedback_geral,
+        'data': geral.enviado_em,
+        'competencias': notas_comp,
+        'competencias_texto': detalhes_texto
+    }
+
+
 @app.route('/redacao/detalhes/<int:redacao_id>', methods=['GET'])
 def get_detalhes_redacao(redacao_id):
     try:
-
-        sql_geral = text("""
-            SELECT 
-                r.texto, 
-                t.tema, 
-                raf.nota_total, 
-                raf.observacoes as feedback_geral,
-                raf.detalhamento_ia,
-                r.enviado_em
-            FROM redacoes r
-            JOIN redacoes_avaliacao_final raf ON r.id = raf.redacao_id
-            LEFT JOIN temas_redacao t ON r.tema_id = t.id
-            WHERE r.id = :rid
-        """)
-        geral = db.session.execute(sql_geral, {'rid': redacao_id}).fetchone()
-
-        if not geral:
+        # Só existe detalhe depois da correção: sem avaliação final, a redação não foi encontrada
+        linha = versao_linha_detalhes('redacao', redacao_id)
+        if linha is None:
             return jsonify({'error': 'Redação não encontrada'}), 404
 
-        sql_comp = text("SELECT competencia, nota FROM redacoes_competencias WHERE redacao_id = :rid ORDER BY competencia")
-        comps = db.session.execute(sql_comp, {'rid': redacao_id}).fetchall()
-        notas_comp = {f"c{c.competencia}": c.nota for c in comps}
+        entrada = cache_detalhes.get(('redacao', redacao_id))
+        if entrada and entrada['linha'] == linha:
+            return resposta_detalhes(entrada)
 
-        detalhes_texto = {}
-        if geral.detalhamento_ia:
-            import json
-            dados_ia = geral.detalhamento_ia if isinstance(geral.detalhamento_ia, dict) else json.loads(geral.detalhamento_ia)
-            detalhes_texto = dados_ia.get('detalhes_competencias', {})
+        payload = montar_detalhes_redacao(redacao_id)
+        if not payload:
+            return jsonify({'error': 'Redação não encontrada'}), 404
 
-        return jsonify({
-            'tema': geral.tema if geral.tema else "Tema Livre",
-            'texto': geral.texto,
-            'nota_total': float(geral.nota_total),
-            'feedback_geral': geral.feedback_geral,
-            'data': geral.enviado_em.strftime('%d/%m/%Y às %H:%M') if geral.enviado_em else '-',
-            'competencias': notas_comp,
-            'competencias_texto': detalhes_texto
-        }), 200
+        entrada = dict(entrada_detalhes(payload), linha=linha)
+        cache_detalhes.set(('redacao', redacao_id), entrada)
+        return resposta_detalhes(entrada)
 
     except Exception as e:
         print(f"Erro detalhes redação: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    if not client: return jsonify({'error': 'Sem API KEY'}), 500
-    
-    data = request.get_json()
-    usuario_id = data.get('usuario_id') 
-    msg_usuario = data.get('message')
-    historico = data.get('history', [])
-    
-    try:
-        sessao_id = None
-
-        if usuario_id:
-
-            res = db.session.execute(text("SELECT id FROM chat_sessoes WHERE usuario_id=:uid AND finalizado_em IS NULL LIMIT 1"), {'uid': usuario_id}).fetchone()
-            if res:
-                sessao_id = res[0]
-            else:
-                new_s = db.session.execute(text("INSERT INTO chat_sessoes (usuario_id) VALUES (:uid) RETURNING id"), {'uid': usuario_id})
-                sessao_id = new_s.fetchone()[0]
-                db.session.commit()
-
-            db.session.execute(text("INSERT INTO chat_mensagens (sessao_id, usuario_id, remetente, mensagem) VALUES (:sid, :uid, 'user', :msg)"), 
-                               {'sid': sessao_id, 'uid': usuario_id, 'msg': msg_usuario})
-            db.session.commit()
-
-        prompt_sistema = """
+PROMPT_CHAT = """
         VOCÊ É O PREPARAI, UM TUTOR ESPECIALIZADO NO ENEM E ENSINO MÉDIO.
         Sua missão é auxiliar estudantes com explicações didáticas, resolução de questões e contextualização de matérias..
 
@@ -749,51 +1733,308 @@ def chat():
         Exemplo Bloco: $$ x = \\frac{-b \\pm \\sqrt{\\Delta}}{2a} $$
         """
 
-        messages_payload = [{"role": "system", "content": prompt_sistema}] + historico + [{"role": "user", "content": msg_usuario}]
+
+def titulo_sessao(mensagem):
+    titulo = (mensagem or '').strip() or "Nova Conversa"
+    if len(titulo) > 30: titulo = titulo[:27] + "..."
+    return titulo
+
+
+def registrar_mensagem_usuario(usuario_id, msg_usuario):
+    res = db.session.execute(text("SELECT id FROM chat_sessoes WHERE usuario_id=:uid AND finalizado_em IS NULL LIMIT 1"), {'uid': usuario_id}).fetchone()
+    if res:
+        sessao_id = res[0]
+    else:
+        new_s = db.session.execute(text("INSERT INTO chat_sessoes (usuario_id) VALUES (:uid) RETURNING id"), {'uid': usuario_id})
+        sessao_id = new_s.fetchone()[0]
+        db.session.commit()
+
+    mensagem_id = db.session.execute(text("INSERT INTO chat_mensagens (sessao_id, usuario_id, remetente, mensagem) VALUES (:sid, :uid, 'user', :msg) RETURNING id"), 
+                                     {'sid': sessao_id, 'uid': usuario_id, 'msg': msg_usuario}).fetchone()[0]
+    # A primeira mensagem vira o título da sessão na barra lateral
+    db.session.execute(text("UPDATE chat_sessoes SET titulo = :titulo WHERE id = :sid AND titulo IS NULL"),
+                       {'sid': sessao_id, 'titulo': titulo_sessao(msg_usuario)})
+    db.session.commit()
+    return sessao_id, mensagem_id
+
+
+def registrar_resposta_bot(sessao_id, usuario_id, ai_reply):
+    db.session.execute(text("INSERT INTO chat_mensagens (sessao_id, usuario_id, remetente, mensagem) VALUES (:sid, :uid, 'bot', :msg)"), 
+                       {'sid': sessao_id, 'uid': usuario_id, 'msg': ai_reply})
+    db.session.commit()
+
+
+CHAT_CONTEXTO_TOKENS = int(os.getenv('CHAT_CONTEXTO_TOKENS', 2000))
+CHAT_CONTEXTO_MAX_MENSAGENS = int(os.getenv('CHAT_CONTEXTO_MAX_MENSAGENS', 40))
+CHAT_RESUMO_LOTE = int(os.getenv('CHAT_RESUMO_LOTE', 40))
+CHAT_RESUMO_MAX_TOKENS = int(os.getenv('CHAT_RESUMO_MAX_TOKENS', 300))
+
+executor_resumos = ThreadPoolExecutor(max_workers=int(os.getenv('CHAT_RESUMO_WORKERS', 2)), thread_name_prefix='resumo-chat')
+_resumos_em_andamento = set()
+_resumos_lock = threading.Lock()
+
+
+def estimar_tokens(texto):
+    # Aproximação de ~4 caracteres por token, suficiente para controlar o orçamento
+    return len(texto or '') // 4 + 4
+
+
+def _resumir_sessao_chat(sessao_id, limite_id):
+    try:
+        with app.app_context():
+            sessao = db.session.execute(text("SELECT resumo, COALESCE(resumo_ate_id, 0) AS ate_id FROM chat_sessoes WHERE id = :sid"),
+                                        {'sid': sessao_id}).fetchone()
+            if not sessao:
+                return
+
+            # Só resume o que já saiu da janela de contexto (mensagens anteriores a limite_id)
+            mensagens = db.session.execute(text("""
+                SELECT id, remetente, mensagem FROM chat_mensagens
+                WHERE sessao_id = :sid AND id > :desde AND id < :limite
+                ORDER BY id ASC
+                LIMIT :lote
+            """), {'sid': sessao_id, 'desde': sessao.ate_id, 'limite': limite_id, 'lote': CHAT_RESUMO_LOTE}).fetchall()
+            if not mensagens:
+                return
+
+            transcricao = "\n".join(
+                f"{'Aluno' if m.remetente == 'user' else 'PreparAI'}: {m.mensagem[:2000]}" for m in mensagens
+            )
+            prompt = f"""
+            Atualize o resumo de uma conversa de estudos para o ENEM entre um aluno e o tutor PreparAI.
+            Mantenha os assuntos estudados, dúvidas do aluno, explicações já dadas e combinados pendentes.
+            Responda apenas com o novo resumo, em no máximo 10 frases.
+
+            RESUMO ATUAL:
+            {sessao.resumo or "(vazio)"}
+
+            NOVAS MENSAGENS:
+            {transcricao}
+            """
+            novo_resumo = llm.completar(
+                'resumo',
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                max_tokens=CHAT_RESUMO_MAX_TOKENS
+            )
+
+            db.session.execute(text("""
+                UPDATE chat_sessoes SET resumo = :resumo, resumo_ate_id = :ate
+                WHERE id = :sid AND COALESCE(resumo_ate_id, 0) = :desde
+            """), {'sid': sessao_id, 'resumo': novo_resumo, 'ate': mensagens[-1].id, 'desde': sessao.ate_id})
+            db.session.commit()
+    except Exception as e:
+        print(f"ERRO RESUMO CHAT {sessao_id}: {e}")
+    finally:
+        with _resumos_lock:
+            _resumos_em_andamento.discard(sessao_id)
+
+
+def agendar_resumo_chat(sessao_id, limite_id):
+    if not client:
+        return
+    with _resumos_lock:
+        if sessao_id in _resumos_em_andamento:
+            return
+        _resumos_em_andamento.add(sessao_id)
+    executor_resumos.submit(_resumir_sessao_chat, sessao_id, limite_id)
+
+
+def _cortar_por_orcamento(mensagens, orcamento):
+    # mensagens da mais recente para a mais antiga; devolve as que cabem, em ordem cronológica
+    selecionadas = []
+    for msg in mensagens:
+        custo = estimar_tokens(msg['content'])
+        if custo > orcamento:
+            break
+        orcamento -= custo
+        selecionadas.append(msg)
+    selecionadas.reverse()
+    return selecionadas, len(selecionadas) < len(mensagens)
+
+
+PAPEIS_CHAT_CLIENTE = ('user', 'assistant')
+
+
+def contexto_chat_anonimo(historico, msg_usuario):
+    # Sem sessão (usuário anônimo) só resta o histórico enviado pelo cliente, também limitado ao orçamento.
+    # Só entram falas de usuário e assistente: um 'system' vindo do cliente trocaria as instruções do tutor
+    orcamento = CHAT_CONTEXTO_TOKENS - estimar_tokens(msg_usuario)
+    recentes = [m for m in reversed(historico or [])
+                if isinstance(m, dict) and m.get('role') in PAPEIS_CHAT_CLIENTE and isinstance(m.get('content'), str)]
+    contexto, _ = _cortar_por_orcamento([{'role': m['role'], 'content': m['content']} for m in recentes], orcamento)
+    return [{"role": "system", "content": PROMPT_CHAT}] + contexto + [{"role": "user", "content": msg_usuario}]
+
+
+def montar_mensagens_chat(historico, msg_usuario, sessao_id=None, mensagem_id=None):
+    if not sessao_id:
+        return contexto_chat_anonimo(historico, msg_usuario)
+
+    sessao = db.session.execute(text("SELECT resumo, COALESCE(resumo_ate_id, 0) AS ate_id FROM chat_sessoes WHERE id = :sid"),
+                                {'sid': sessao_id}).fetchone()
+    linhas = db.session.execute(text("""
+        SELECT id, remetente, mensagem FROM chat_mensagens
+        WHERE sessao_id = :sid AND id > :desde AND id < :atual
+        ORDER BY id DESC
+        LIMIT :lim
+    """), {'sid': sessao_id, 'desde': sessao.ate_id if sessao else 0, 'atual': mensagem_id, 'lim': CHAT_CONTEXTO_MAX_MENSAGENS}).fetchall()
+
+    return compor_contexto_chat(msg_usuario, sessao.resumo if sessao else None, [tuple(row) for row in linhas], sessao_id, mensagem_id)
+
+
+def compor_contexto_chat(msg_usuario, resumo, linhas, sessao_id, mensagem_id):
+    # linhas: (id, remetente, mensagem) da mais recente para a mais antiga
+    mensagens = [{"role": "system", "content": PROMPT_CHAT}]
+    orcamento = CHAT_CONTEXTO_TOKENS - estimar_tokens(msg_usuario)
+
+    if resumo:
+        mensagens.append({"role": "system", "content": f"Resumo da conversa até aqui: {resumo}"})
+        orcamento -= estimar_tokens(resumo)
+
+    recentes = [{'role': 'user' if remetente == 'user' else 'assistant', 'content': mensagem} for _, remetente, mensagem in linhas]
+    contexto, sobrou = _cortar_por_orcamento(recentes, orcamento)
+
+    if sobrou or len(linhas) >= CHAT_CONTEXTO_MAX_MENSAGENS:
+        # Tudo que ficou de fora do contexto entra no resumo da próxima rodada
+        limite_id = linhas[len(contexto) - 1][0] if contexto else mensagem_id
+        agendar_resumo_chat(sessao_id, limite_id)
+
+    return mensagens + contexto + [{"role": "user", "content": msg_usuario}]
+
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    if not client: return jsonify({'error': 'Sem API KEY'}), 500
+    
+    data = request.get_json()
+    usuario_id = data.get('usuario_id') 
+    msg_usuario = data.get('message')
+    historico = data.get('history', [])
+    
+    try:
+        sessao_id = None
+
+        mensagem_id = None
+
+        if usuario_id:
+            sessao_id, mensagem_id = registrar_mensagem_usuario(usuario_id, msg_usuario)
+
+        messages_payload = montar_mensagens_chat(historico, msg_usuario, sessao_id, mensagem_id)
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages_payload,
-            temperature=0.5 
-        )
-        ai_reply = response.choices[0].message.content
+        ai_reply = llm.completar('chat', messages=messages_payload, temperature=0.5)
 
         if sessao_id:
-            db.session.execute(text("INSERT INTO chat_mensagens (sessao_id, usuario_id, remetente, mensagem) VALUES (:sid, :uid, 'bot', :msg)"), 
-                               {'sid': sessao_id, 'uid': usuario_id, 'msg': ai_reply})
-            db.session.commit()
+            registrar_resposta_bot(sessao_id, usuario_id, ai_reply)
 
         return jsonify({'reply': ai_reply})
     
     except Exception as e:
         print(f"ERRO CHAT: {e}") 
         return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    if not client: return jsonify({'error': 'Sem API KEY'}), 500
+
+    data = request.get_json()
+    usuario_id = data.get('usuario_id') 
+    msg_usuario = data.get('message')
+    historico = data.get('history', [])
+
+    try:
+        sessao_id, mensagem_id = registrar_mensagem_usuario(usuario_id, msg_usuario) if usuario_id else (None, None)
+
+        stream = llm.stream(
+            'chat',
+            messages=montar_mensagens_chat(historico, msg_usuario, sessao_id, mensagem_id),
+            temperature=0.5
+        )
+    except Exception as e:
+        print(f"ERRO CHAT: {e}") 
+        return jsonify({'error': str(e)}), 500
+
+    def eventos():
+        partes = []
+        concluido = False
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    partes.append(delta)
+                    yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+            concluido = True
+        except Exception as e:
+            print(f"ERRO CHAT: {e}")
+            yield f"event: erro\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        finally:
+            # Se o cliente desconectou no meio, fecha a conexão com a OpenAI para cancelar a geração
+            if not concluido:
+                stream.close()
+
+        ai_reply = ''.join(partes)
+        if sessao_id:
+            registrar_resposta_bot(sessao_id, usuario_id, ai_reply)
+
+        yield f"event: fim\ndata: {json.dumps({'reply': ai_reply}, ensure_ascii=False)}\n\n"
+
+    resposta = Response(stream_with_context(eventos()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Garante que a vaga no gateway volta mesmo se o cliente cair antes do primeiro evento
+    resposta.call_on_close(stream.close)
+    return resposta
     
+CHAT_SESSOES_LIMITE_PADRAO = int(os.getenv('CHAT_SESSOES_LIMITE_PADRAO', 30))
+CHAT_SESSOES_LIMITE_MAX = int(os.getenv('CHAT_SESSOES_LIMITE_MAX', 100))
+
+SQL_CHAT_SESSOES = """
+    SELECT s.id, s.iniciado_em, s.titulo
+    FROM chat_sessoes s
+    WHERE s.usuario_id = :uid {filtro}
+    ORDER BY s.iniciado_em DESC, s.id DESC
+    LIMIT :lim
+"""
+# Cursor "<iniciado_em iso>,<id>", o mesmo devolvido em 'proximo'
+FILTRO_CHAT_SESSOES = "AND (s.iniciado_em, s.id) < (:c_data, :c_id)"
+
+
 @app.route('/api/chat/sessoes/<int:usuario_id>', methods=['GET'])
 def get_usuario_sessoes(usuario_id):
+    paginado = 'before' in request.args or 'limit' in request.args
     try:
-        sql = text("""
-            SELECT s.id, s.iniciado_em, 
-                   (SELECT mensagem FROM chat_mensagens WHERE sessao_id = s.id ORDER BY id ASC LIMIT 1) as resumo
-            FROM chat_sessoes s
-            WHERE s.usuario_id = :uid
-            ORDER BY s.iniciado_em DESC
-        """)
-        
-        result = db.session.execute(sql, {'uid': usuario_id}).fetchall()
+        limite = min(max(int(request.args.get('limit', CHAT_SESSOES_LIMITE_PADRAO)), 1), CHAT_SESSOES_LIMITE_MAX)
+        params = {'uid': usuario_id, 'lim': limite + 1 if paginado else None}
+        filtro = ''
+        if request.args.get('before'):
+            data_cursor, id_cursor = request.args['before'].split(',')
+            params['c_data'] = datetime.fromisoformat(data_cursor.strip())
+            params['c_id'] = int(id_cursor)
+            filtro = FILTRO_CHAT_SESSOES
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
+
+    try:
+        result = db.session.execute(text(SQL_CHAT_SESSOES.format(filtro=filtro)), params).fetchall()
+
+        proximo = None
+        if paginado and len(result) > limite:
+            result = result[:limite]
+            proximo = f"{result[-1].iniciado_em.isoformat()},{result[-1].id}"
         
         sessoes = []
         for row in result:
-            titulo = row.resumo if row.resumo else "Nova Conversa"
-            if len(titulo) > 30: titulo = titulo[:27] + "..."
-            
             sessoes.append({
                 'id': row.id,
-                'data': row.iniciado_em.strftime('%d/%m %H:%M'),
-                'titulo': titulo
+                'data': row.iniciado_em,
+                'titulo': row.titulo or "Nova Conversa"
             })
             
-        return jsonify(sessoes), 200
+        if not paginado:
+            return jsonify(sessoes), 200
+        return jsonify({'itens': sessoes, 'proximo': proximo}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
@@ -815,40 +2056,61 @@ def novo_chat_sessao():
         return jsonify({'error': str(e)}), 500    
 
 
+CHAT_HISTORICO_LIMITE_MAX = int(os.getenv('CHAT_HISTORICO_LIMITE_MAX', 200))
+
+SQL_CHAT_HISTORICO = """
+    SELECT id, remetente, mensagem, enviado_em
+    FROM chat_mensagens
+    WHERE sessao_id = :sid AND usuario_id = :uid{filtros}
+    ORDER BY id {ordem}
+    LIMIT :lim
+"""
+
+
 @app.route('/api/chat/historico/<int:usuario_id>', methods=['GET'])
 def get_chat_historico(usuario_id):
     sessao_id = request.args.get('sessao_id')
+    compacto = request.args.get('compacto', '').lower() in ('1', 'true', 'sim')
 
     try:
-        if sessao_id:
-            sql = text("""
-                SELECT remetente, mensagem, enviado_em 
-                FROM chat_mensagens 
-                WHERE sessao_id = :sid AND usuario_id = :uid
-                ORDER BY enviado_em ASC
-            """)
-        
-            params = {'sid': sessao_id, 'uid': usuario_id}
-        else:
-            sql = text("""
-                SELECT m.remetente, m.mensagem, m.enviado_em 
-                FROM chat_mensagens m
-                JOIN chat_sessoes s ON m.sessao_id = s.id
-                WHERE s.usuario_id = :uid AND s.finalizado_em IS NULL
-                ORDER BY m.enviado_em ASC
-            """)
-            params = {'uid': usuario_id}
-        
+        after_id = request.args.get('after_id', type=int)
+        before_id = request.args.get('before_id', type=int)
+        limite = request.args.get('limit')
+        limite = min(max(int(limite), 1), CHAT_HISTORICO_LIMITE_MAX) if limite else None
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
+
+    try:
+        if not sessao_id:
+            ativa = db.session.execute(text("SELECT id FROM chat_sessoes WHERE usuario_id = :uid AND finalizado_em IS NULL LIMIT 1"),
+                                       {'uid': usuario_id}).fetchone()
+            if not ativa:
+                return jsonify([]), 200
+            sessao_id = ativa.id
+
+        params = {'sid': sessao_id, 'uid': usuario_id, 'lim': limite}
+        filtros = ''
+        if after_id is not None:
+            filtros += ' AND id > :after_id'
+            params['after_id'] = after_id
+        if before_id is not None:
+            filtros += ' AND id < :before_id'
+            params['before_id'] = before_id
+
+        # Com limite e sem after_id a página é a das mensagens mais recentes; busca de trás pra frente e inverte
+        decrescente = limite is not None and after_id is None
+        sql = text(SQL_CHAT_HISTORICO.format(filtros=filtros, ordem='DESC' if decrescente else 'ASC'))
         result = db.session.execute(sql, params).fetchall()
+        if decrescente:
+            result.reverse()
         
         historico = []
         for row in result:
             role_openai = 'user' if row.remetente == 'user' else 'assistant'
-            historico.append({
-                'role': role_openai,
-                'content': row.mensagem,
-                'data': row.enviado_em.strftime('%d/%m %H:%M') if row.enviado_em else ''
-            })
+            item = {'id': row.id, 'role': role_openai, 'content': row.mensagem}
+            if not compacto:
+                item['data'] = row.enviado_em
+            historico.append(item)
             
         return jsonify(historico), 200
 
@@ -856,25 +2118,18 @@ def get_chat_historico(usuario_id):
         print(f"Erro ao buscar histórico do chat: {e}")
         return jsonify({'error': str(e)}), 500
 
+RECOMENDACAO_FAIXA = int(os.getenv('RECOMENDACAO_FAIXA', 10))
+
+# Conselhos compartilhados por (pior matéria, faixa de aproveitamento) e conselho fixado por usuário
+# até que ele responda novas questões
+cache_recomendacoes = CacheLRU(max_itens=int(os.getenv('RECOMENDACAO_CACHE_MAX', 500)), ttl=int(os.getenv('RECOMENDACAO_CACHE_TTL', 6 * 3600)))
+recomendacoes_fixadas = CacheLRU(max_itens=int(os.getenv('RECOMENDACAO_FIXADAS_MAX', 10000)), ttl=int(os.getenv('RECOMENDACAO_FIXADAS_TTL', 24 * 3600)))
+
+
 @app.route('/dashboard/recomendacao/<int:usuario_id>', methods=['GET'])
 def get_recomendacao_estudos(usuario_id):
-    if not client: return jsonify({'error': 'Sem IA'}), 500
-
     try:
-        sql = text("""
-            SELECT 
-                m.nome as materia,
-                COUNT(*) as total_questoes,
-                SUM(CASE WHEN eq.correta = TRUE THEN 1 ELSE 0 END) as acertos
-            FROM exames_questoes eq
-            JOIN exames e ON eq.exame_id = e.id
-            JOIN questoes q ON eq.questao_id = q.id
-            JOIN materias m ON q.materia_id = m.id
-            WHERE e.usuario_id = :uid
-            GROUP BY m.nome
-        """)
-        
-        resultados = db.session.execute(sql, {'uid': usuario_id}).fetchall()
+        resultados = db.session.execute(SQL_DESEMPENHO_MATERIAS, {'uid': usuario_id}).fetchall()
         
         if not resultados:
             return jsonify({
@@ -882,6 +2137,11 @@ def get_recomendacao_estudos(usuario_id):
                 'texto': 'Ainda não tenho dados suficientes. Faça seu primeiro simulado para eu analisar seus pontos fortes e fracos!'
             })
 
+        assinatura = (sum(row.total_questoes for row in resultados), sum(row.acertos for row in resultados))
+        fixada = recomendacoes_fixadas.get(usuario_id)
+        if fixada and fixada['assinatura'] == assinatura:
+            return jsonify(fixada['resposta'])
+
         pior_materia = None
         menor_taxa = 101.0
         
@@ -898,39 +2158,60 @@ def get_recomendacao_estudos(usuario_id):
                 'titulo': 'Continue Assim!',
                 'texto': 'Seus dados iniciais estão ótimos. Continue fazendo simulados para refinarmos a análise.'
             })
-        
-        prompt = f"""
-        Aja como um mentor pedagógico experiente do ENEM.
-        O aluno está com dificuldade crítica em: {pior_materia} (Aproveitamento de apenas {menor_taxa:.1f}%).
-        
-        Gere um conselho curto e direto (máximo 3 frases) sugerindo um tópico chave dessa matéria que costuma cair muito no ENEM e como estudar ele.
-        Não use saudações. Vá direto ao ponto. Ex: "Em Matemática, foque em Regra de Três..."
-        """
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=100
-        )
-        
-        conselho_ia = response.choices[0].message.content
 
-        return jsonify({
+        faixa = min(int(menor_taxa // RECOMENDACAO_FAIXA), 100 // RECOMENDACAO_FAIXA)
+        chave = (pior_materia, faixa)
+        conselho_ia = cache_recomendacoes.get(chave)
+
+        if conselho_ia is None:
+            if not client: return jsonify({'error': 'Sem IA'}), 500
+
+            taxa_faixa = min(faixa * RECOMENDACAO_FAIXA + RECOMENDACAO_FAIXA / 2, 100)
+            prompt = f"""
+            Aja como um mentor pedagógico experiente do ENEM.
+            O aluno está com dificuldade crítica em: {pior_materia} (Aproveitamento de apenas cerca de {taxa_faixa:.0f}%).
+            
+            Gere um conselho curto e direto (máximo 3 frases) sugerindo um tópico chave dessa matéria que costuma cair muito no ENEM e como estudar ele.
+            Não use saudações. Vá direto ao ponto. Ex: "Em Matemática, foque em Regra de Três..."
+            """
+            
+            conselho_ia = llm.completar(
+                'recomendacao',
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=100
+            )
+            cache_recomendacoes.set(chave, conselho_ia)
+
+        resposta = {
             'titulo': f'Foco em {pior_materia} 🎯',
             'texto': conselho_ia
-        })
+        }
+        recomendacoes_fixadas.set(usuario_id, {'assinatura': assinatura, 'resposta': resposta})
+        return jsonify(resposta)
 
     except Exception as e:
         print(f"Erro recomendação: {e}")
         return jsonify({'texto': 'Não foi possível gerar a recomendação agora.'}), 500
 
 
-    except Exception as e:
-        print("\n\n🔥 ERRO FATAL NA OPENAI🔥")
-        print(f"TIPO DO ERRO: {type(e)}")
-        print(f"MENSAGEM: {e}")
-        return jsonify({'error': str(e)}), 500
+@app.route('/dashboard/recomendacao/cache', methods=['GET'])
+def get_recomendacao_cache_stats():
+    return jsonify({
+        'recomendacoes': cache_recomendacoes.estatisticas(),
+        'fixadas': recomendacoes_fixadas.estatisticas()
+    }), 200
+
+
+@app.route('/llm/estatisticas', methods=['GET'])
+def get_llm_estatisticas():
+    if not llm: return jsonify({'error': 'Sem API KEY'}), 500
+    return jsonify(llm.estatisticas()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metricas.prometheus(), status=200, content_type='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
     port = int(os.getenv('APP_PORT', 5000))
@@ -0,0 +1,419 @@
+"""Modo assíncrono do backend.
+
+As rotas que passam a maior parte do tempo esperando a OpenAI (chat, tema e correção de redação)
+rodam aqui sobre Quart + AsyncOpenAI + asyncpg, então centenas de chamadas em andamento cabem em
+um processo. Todas as outras rotas continuam sendo atendidas pelo app Flask de app.py.
+
+    uvicorn app_async:aplicacao --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import base64
+import io
+import json
+import os
+import time
+
+import asyncpg
+from asgiref.wsgi import WsgiToAsgi
+from openai import AsyncOpenAI
+from quart import Quart, Response, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+import app as base
+from llm import GatewayLLMAsync
+from metricas import registrar_log_json
+from triagem import triar_redacao
+
+ASYNC_DB_POOL_MIN = int(os.getenv('ASYNC_DB_POOL_MIN', 2))
+ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', 20))
+ASYNC_LLM_MAX_CONCORRENCIA = int(os.getenv('ASYNC_LLM_MAX_CONCORRENCIA', 256))
+# Sem thread presa por chamada, cada rota aguenta bem mais chamadas simultâneas que no modo síncrono
+ASYNC_LLM_FATOR = int(os.getenv('ASYNC_LLM_FATOR', 8))
+
+app_async = Quart(__name__)
+app_async.config['MAX_CONTENT_LENGTH'] = base.app.config['MAX_CONTENT_LENGTH']
+
+llm = GatewayLLMAsync(
+    AsyncOpenAI(api_key=base.api_key),
+    rotas={nome: dict(cfg, concorrencia=cfg['concorrencia'] * ASYNC_LLM_FATOR) for nome, cfg in base.ROTAS_LLM.items()},
+    max_concorrencia=ASYNC_LLM_MAX_CONCORRENCIA,
+    circuito=base.llm.circuito,
+    observador=base.metricas.observar_llm,
+    **base.CONFIG_LLM
+) if base.client else None
+
+pool = None
+
+
+def dsn_asyncpg(uri):
+    # O asyncpg entende a URI do Postgres, só não o sufixo do driver do SQLAlchemy
+    return uri.replace('postgresql+psycopg2://', 'postgresql://', 1).replace('postgres://', 'postgresql://', 1)
+
+
+@app_async.before_serving
+async def abrir_pool():
+    global pool
+    pool = await asyncpg.create_pool(dsn_asyncpg(base.get_database_uri()), min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX)
+
+
+@app_async.after_serving
+async def fechar_pool():
+    await pool.close()
+
+
+@app_async.before_request
+async def iniciar_metricas():
+    g.inicio_requisicao = time.perf_counter()
+
+
+@app_async.after_request
+async def registrar_metricas(resposta):
+    # Mesmo registro do Flask, então /metrics mostra os dois modos juntos; o SQL do asyncpg não é contado
+    inicio = getattr(g, 'inicio_requisicao', None)
+    if inicio is None:
+        return resposta
+    duracao = time.perf_counter() - inicio
+    rota = request.url_rule.rule if request.url_rule is not None else '<desconhecida>'
+    base.metricas.observar_requisicao(request.method, rota, resposta.status_code, duracao)
+    if base.LOG_REQUISICOES_JSON:
+        registrar_log_json({
+            'evento': 'requisicao',
+            'modo': 'async',
+            'metodo': request.method,
+            'rota': rota,
+            'caminho': request.path,
+            'status': resposta.status_code,
+            'duracao_ms': round(duracao * 1000, 1)
+        })
+    return resposta
+
+
+@app_async.after_request
+async def liberar_cors(resposta):
+    # Mesma política do CORS(app) do Flask; os preflights OPTIONS seguem para o Flask
+    resposta.headers['Access-Control-Allow-Origin'] = '*'
+    return resposta
+
+
+def _no_contexto_flask(funcao, *args):
+    with base.app.app_context():
+        try:
+            return funcao(*args)
+        except Exception:
+            base.db.session.rollback()
+            raise
+
+
+async def no_banco_sync(funcao, *args):
+    """Roda um helper de app.py que usa o SQLAlchemy, numa thread e só pelo tempo da transação."""
+    return await asyncio.to_thread(_no_contexto_flask, funcao, *args)
+
+
+# --- Chat ---
+
+async def registrar_mensagem_usuario(usuario_id, msg_usuario):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            sessao_id = await conn.fetchval("SELECT id FROM chat_sessoes WHERE usuario_id = $1 AND finalizado_em IS NULL LIMIT 1", usuario_id)
+            if not sessao_id:
+                sessao_id = await conn.fetchval("INSERT INTO chat_sessoes (usuario_id) VALUES ($1) RETURNING id", usuario_id)
+            mensagem_id = await conn.fetchval(
+                "INSERT INTO chat_mensagens (sessao_id, usuario_id, remetente, mensagem) VALUES ($1, $2, 'user', $3) RETURNING id",
+                sessao_id, usuario_id, msg_usuario)
+            await conn.execute("UPDATE chat_sessoes SET titulo = $2 WHERE id = $1 AND titulo IS NULL",
+                               sessao_id, base.titulo_sessao(msg_usuario))
+    return sessao_id, mensagem_id
+
+
+async def registrar_resposta_bot(sessao_id, usuario_id, ai_reply):
+    await pool.execute("INSERT INTO chat_mensagens (sessao_id, usuario_id, remetente, mensagem) VALUES ($1, $2, 'bot', $3)",
+                       sessao_id, usuario_id, ai_reply)
+
+
+async def montar_mensagens_chat(historico, msg_usuario, sessao_id=None, mensagem_id=None):
+    if not sessao_id:
+        return base.contexto_chat_anonimo(historico, msg_usuario)
+
+    async with pool.acquire() as conn:
+        sessao = await conn.fetchrow("SELECT resumo, COALESCE(resumo_ate_id, 0) AS ate_id FROM chat_sessoes WHERE id = $1", sessao_id)
+        linhas = await conn.fetch("""
+            SELECT id, remetente, mensagem FROM chat_mensagens
+            WHERE sessao_id = $1 AND id > $2 AND id < $3
+            ORDER BY id DESC
+            LIMIT $4
+        """, sessao_id, sessao['ate_id'] if sessao else 0, mensagem_id, base.CHAT_CONTEXTO_MAX_MENSAGENS)
+
+    return base.compor_contexto_chat(msg_usuario, sessao['resumo'] if sessao else None,
+                                     [tuple(row) for row in linhas], sessao_id, mensagem_id)
+
+
+@app_async.route('/api/chat', methods=['POST'])
+async def chat():
+    if not llm: return jsonify({'error': 'Sem API KEY'}), 500
+
+    data = await request.get_json()
+    usuario_id = data.get('usuario_id')
+    msg_usuario = data.get('message')
+    historico = data.get('history', [])
+
+    try:
+        sessao_id, mensagem_id = await registrar_mensagem_usuario(int(usuario_id), msg_usuario) if usuario_id else (None, None)
+        messages_payload = await montar_mensagens_chat(historico, msg_usuario, sessao_id, mensagem_id)
+
+        ai_reply = await llm.completar('chat', messages=messages_payload, temperature=0.5)
+
+        if sessao_id:
+            await registrar_resposta_bot(sessao_id, int(usuario_id), ai_reply)
+
+        return jsonify({'reply': ai_reply})
+
+    except Exception as e:
+        print(f"ERRO CHAT: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app_async.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    if not llm: return jsonify({'error': 'Sem API KEY'}), 500
+
+    data = await request.get_json()
+    usuario_id = data.get('usuario_id')
+    msg_usuario = data.get('message')
+    historico = data.get('history', [])
+
+    try:
+        sessao_id, mensagem_id = await registrar_mensagem_usuario(int(usuario_id), msg_usuario) if usuario_id else (None, None)
+
+        stream = await llm.stream(
+            'chat',
+            messages=await montar_mensagens_chat(historico, msg_usuario, sessao_id, mensagem_id),
+            temperature=0.5
+        )
+    except Exception as e:
+        print(f"ERRO CHAT: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    async def eventos():
+        partes = []
+        concluido = False
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    partes.append(delta)
+                    yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+            concluido = True
+        except Exception as e:
+            print(f"ERRO CHAT: {e}")
+            yield f"event: erro\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        finally:
+            # Cliente desconectado (CancelledError) ou erro: fecha a conexão com a OpenAI e devolve a vaga
+            if not concluido:
+                await stream.close()
+
+        ai_reply = ''.join(partes)
+        if sessao_id:
+            await registrar_resposta_bot(sessao_id, int(usuario_id), ai_reply)
+
+        yield f"event: fim\ndata: {json.dumps({'reply': ai_reply}, ensure_ascii=False)}\n\n"
+
+    resposta = Response(eventos(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    resposta.timeout = None
+    return resposta
+
+
+# --- Tema de redação ---
+
+async def reservar_tema_pool():
+    return await pool.fetchrow("""
+        UPDATE temas_redacao SET usado_em = NOW()
+        WHERE id = (
+            SELECT id FROM temas_redacao
+            WHERE gerado_por_ia AND usado_em IS NULL
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, tema, texto_de_apoio
+    """)
+
+
+@app_async.route('/redacao/tema', methods=['GET'])
+async def get_tema_redacao():
+    print("--- INICIANDO GERAÇÃO DE TEMA ---")
+
+    try:
+        tema = await reservar_tema_pool()
+        base.agendar_reposicao_temas()
+        if tema:
+            return jsonify({'id': tema['id'], 'tema': tema['tema'], 'texto_apoio': tema['texto_de_apoio']}), 200
+    except Exception as e:
+        print(f"Aviso: erro ao buscar tema no pool: {e}")
+
+    if not llm:
+        return jsonify(base.tema_backup("Sem API Key configurada")), 200
+
+    try:
+        # Pool vazio: gera na hora enquanto o repositor trabalha em segundo plano
+        dados_ia = await llm.completar_json('tema', messages=[{"role": "user", "content": base.PROMPT_TEMA}], temperature=0.8)
+
+        novo_id = None
+        try:
+            novo_id = await pool.fetchval(
+                "INSERT INTO temas_redacao (tema, texto_de_apoio, gerado_por_ia, usado_em) VALUES ($1, $2, TRUE, NOW()) RETURNING id",
+                dados_ia['tema'], dados_ia['texto_apoio'])
+            print(f"✅ TEMA CRIADO COM SUCESSO: ID {novo_id}")
+        except Exception as e:
+            print(f"Aviso: erro ao salvar tema no histórico: {e}")
+
+        return jsonify({'id': novo_id, 'tema': dados_ia['tema'], 'texto_apoio': dados_ia['texto_apoio']}), 200
+
+    except Exception as e:
+        return jsonify(base.tema_backup(f"Erro na API OpenAI: {str(e)}")), 200
+
+
+@app_async.route('/redacao/gerar-tema', methods=['POST'])
+async def gerar_tema_ia():
+    return await get_tema_redacao()
+
+
+# --- Correção de redação ---
+
+async def corrigir_redacao(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo=None, chave_idempotencia=None):
+    if not imagem_base64:
+        apoio = await pool.fetchval("SELECT texto_de_apoio FROM temas_redacao WHERE id = $1", final_tema_id)
+        triagem = triar_redacao(texto_usuario, (titulo_tema, apoio), linhas_min=base.REDACAO_LINHAS_MINIMAS,
+                                caracteres_por_linha=base.REDACAO_CARACTERES_POR_LINHA)
+        if triagem:
+            texto_final, notas, resultado_ia = base.resultado_triagem(triagem, texto_usuario)
+            return await no_banco_sync(base.salvar_correcao, usuario_id, final_tema_id, titulo_tema, texto_final, notas,
+                                       resultado_ia, hash_conteudo, chave_idempotencia)
+
+    model_to_use, mensagens_api = base.mensagens_correcao(titulo_tema, texto_usuario, imagem_base64)
+    resultado_ia = await llm.completar_json('redacao', model=model_to_use, messages=mensagens_api, temperature=0.4, max_tokens=4096)
+    texto_final, notas, resultado_ia = base.aplicar_situacao_tema(resultado_ia, titulo_tema, texto_usuario)
+
+    # A gravação reaproveita o salvar_correcao (competências, dashboard, avaliação final) numa transação curta
+    return await no_banco_sync(base.salvar_correcao, usuario_id, final_tema_id, titulo_tema, texto_final, notas,
+                               resultado_ia, hash_conteudo, chave_idempotencia)
+
+
+async def corrigir_redacao_reservada(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia=None):
+    # Mesma reserva no banco do modo síncrono: vale entre processos e entre os dois modos
+    try:
+        return await corrigir_redacao(usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia)
+    finally:
+        try:
+            await no_banco_sync(base.liberar_correcao, usuario_id, hash_conteudo)
+        except Exception as e:
+            print(f"Aviso: reserva da correção não liberada (expira em {base.REDACAO_ESPERA_DUPLICADA}s): {e}")
+
+
+@app_async.route('/redacao/enviar', methods=['POST'])
+async def enviar_redacao():
+    if not llm:
+        return jsonify({'error': 'Sem API KEY configurada'}), 500
+
+    try:
+        if request.mimetype == 'multipart/form-data':
+            data = await request.form
+            arquivo = (await request.files).get('imagem')
+            imagem_base64 = await asyncio.to_thread(base.preparar_imagem_redacao, arquivo.stream, arquivo.mimetype) if arquivo and arquivo.filename else None
+        else:
+            data = await request.get_json()
+            imagem_base64 = data.get('imagem')
+            if imagem_base64:
+                conteudo = base64.b64decode(imagem_base64.split(',', 1)[-1])
+                imagem_base64 = await asyncio.to_thread(base.preparar_imagem_redacao, io.BytesIO(conteudo))
+    except base.ERROS_IMAGEM as e:
+        print(f"ERRO: imagem inválida: {e}")
+        return jsonify({'error': 'Imagem inválida. Envie uma foto em JPG ou PNG.'}), 400
+
+    usuario_id = data.get('usuario_id')
+    tema_id_raw = data.get('tema_id')
+    texto_usuario = data.get('texto')
+
+    if not usuario_id:
+        return jsonify({'error': 'Usuário não identificado. Faça login novamente.'}), 400
+
+    final_tema_id = 1
+    titulo_tema = "Tema Livre / Não informado"
+
+    if tema_id_raw:
+        try:
+            final_tema_id = int(tema_id_raw)
+            tema = await pool.fetchval("SELECT tema FROM temas_redacao WHERE id = $1", final_tema_id)
+            if tema: titulo_tema = tema
+            else:
+                print(f"AVISO: ID {final_tema_id} não encontrado no banco. Usando ID mas sem título específico.")
+        except ValueError:
+            print("ERRO: tema_id não é um número válido. Usando Backup (1).")
+            final_tema_id = 1
+
+    if not imagem_base64 and not texto_usuario:
+        return jsonify({'error': 'Nenhum texto ou imagem fornecido.'}), 400
+
+    hash_conteudo = base.calcular_hash_redacao(final_tema_id, texto_usuario, imagem_base64)
+    chave_idempotencia = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '')[:100] or None
+    argumentos = (usuario_id, final_tema_id, titulo_tema, texto_usuario, imagem_base64, hash_conteudo, chave_idempotencia)
+
+    try:
+        existente = await no_banco_sync(base.buscar_correcao_existente, usuario_id, hash_conteudo, chave_idempotencia)
+        if existente:
+            return jsonify(existente), 200
+    except Exception as e:
+        print(f"Aviso: erro ao buscar correção existente: {e}")
+
+    assincrono = str(data.get('assincrono')).lower() in ('1', 'true', 'sim') or request.args.get('modo') == 'job'
+
+    try:
+        if not assincrono and await no_banco_sync(base.reservar_correcao, usuario_id, hash_conteudo):
+            return jsonify(await corrigir_redacao_reservada(*argumentos)), 201
+
+        # Envio idêntico já em correção: devolve o job dele (ou um que espera pelo resultado), como no Flask
+        job_id = (await no_banco_sync(base.job_da_correcao_em_andamento, usuario_id, hash_conteudo)
+                  or await no_banco_sync(base.enfileirar_correcao, int(usuario_id), argumentos))
+        if not job_id:
+            return jsonify({'error': 'Muitas correções em andamento. Tente novamente em instantes.'}), 503
+        return jsonify({
+            'job_id': job_id,
+            'status': 'pendente',
+            'status_url': f'/redacao/jobs/{job_id}',
+            'stream_url': f'/redacao/jobs/{job_id}/stream'
+        }), 202
+    except Exception as e:
+        print(f"ERRO: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app_async.route('/llm/estatisticas/async', methods=['GET'])
+async def get_llm_estatisticas_async():
+    if not llm: return jsonify({'error': 'Sem API KEY'}), 500
+    return jsonify(llm.estatisticas()), 200
+
+
+# --- Entrada ASGI ---
+
+app_flask = WsgiToAsgi(base.app)
+_rotas_async = app_async.url_map.bind('')
+
+
+def _rota_async(scope):
+    if scope['method'] == 'OPTIONS':
+        return False
+    try:
+        _rotas_async.match(scope['path'], method=scope['method'])
+        return True
+    except HTTPException:
+        return False
+
+
+async def aplicacao(scope, receive, send):
+    # Rotas presas à OpenAI ficam no Quart (que também cuida do ciclo de vida); o resto segue para o Flask numa thread
+    if scope['type'] == 'http' and not _rota_async(scope):
+        return await app_flask(scope, receive, send)
+    return await app_async(scope, receive, send)
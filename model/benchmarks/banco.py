@@ -0,0 +1,242 @@
+"""Mede o caminho de banco das rotas de leitura e guarda o histórico para enxergar regressões.
+
+Chama as rotas dentro do próprio processo (app.test_client, sem rede nem OpenAI) para usuários
+sorteados do banco, limpando os caches em memória antes de cada chamada para que o tempo medido
+seja o das consultas. Cada execução vira uma linha em --historico e é comparada com a última
+execução de mesmo --rotulo; sai com código 1 se alguma rota piorou além da tolerância.
+
+    python benchmarks/dados_sinteticos.py --dsn postgresql://postgres@localhost/preparai_bench
+    python benchmarks/banco.py --dsn postgresql://postgres@localhost/preparai_bench --rotulo 1k-usuarios
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+from carga import percentil
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+HISTORICO_PADRAO = os.path.join(PASTA, 'resultados_banco.jsonl')
+
+
+def casos():
+    """(nome, caminho a partir da amostra) de cada rota de leitura medida."""
+    return [
+        ('GET /dashboard/resumo/<id>', lambda a: f"/dashboard/resumo/{a['usuario']}"),
+        ('GET /dashboard/resumo/<id>?recalcular=1', lambda a: f"/dashboard/resumo/{a['usuario']}?recalcular=1"),
+        ('GET /dashboard/materias/<id>', lambda a: f"/dashboard/materias/{a['usuario']}"),
+        ('GET /dashboard/recomendacao/<id>', lambda a: f"/dashboard/recomendacao/{a['usuario']}"),
+        ('GET /api/graficos/evolucao/<id>', lambda a: f"/api/graficos/evolucao/{a['usuario']}"),
+        ('GET /historico/<id>?limit=20', lambda a: f"/historico/{a['usuario']}?limit=20"),
+        ('GET /historico/<id>?before=', lambda a: f"/historico/{a['usuario']}?limit=20&before={quote(a['cursor_historico'])}"
+         if a['cursor_historico'] else None),
+        ('GET /historico/<id> (completo)', lambda a: f"/historico/{a['usuario']}"),
+        ('GET /simulado/questoes', lambda a: "/simulado/questoes"),
+        ('GET /simulado/detalhes/<id>', lambda a: f"/simulado/detalhes/{a['exame']}" if a['exame'] else None),
+        ('GET /redacao/detalhes/<id>', lambda a: f"/redacao/detalhes/{a['redacao']}" if a['redacao'] else None),
+        ('GET /api/chat/sessoes/<id>?limit=30', lambda a: f"/api/chat/sessoes/{a['usuario']}?limit=30"),
+        ('GET /api/chat/historico/<id>?limit=30', lambda a: f"/api/chat/historico/{a['usuario']}?compacto=1&limit=30"),
+    ]
+
+
+def sortear_amostras(app, quantidade, seed):
+    from sqlalchemy import text
+
+    with app.app.app_context():
+        sessao = app.db.session
+        total = sessao.execute(text("SELECT COUNT(*) FROM usuarios")).scalar()
+        if not total:
+            raise SystemExit("Banco sem usuários: rode benchmarks/dados_sinteticos.py antes.")
+        sessao.execute(text("SELECT setseed(:s)"), {'s': (seed % 1000) / 1000})
+        usuarios = [row[0] for row in sessao.execute(
+            text("SELECT id FROM usuarios ORDER BY random() LIMIT :n"), {'n': quantidade})]
+
+        amostras = []
+        cliente = app.app.test_client()
+        for uid in usuarios:
+            exame = sessao.execute(text("SELECT MAX(id) FROM exames WHERE usuario_id = :uid"), {'uid': uid}).scalar()
+            redacao = sessao.execute(text("SELECT MAX(id) FROM redacoes WHERE usuario_id = :uid"), {'uid': uid}).scalar()
+            # O cursor da segunda página vem da própria rota, para medir exatamente o que o front pede
+            primeira = cliente.get(f"/historico/{uid}?limit=20").get_json() or {}
+            amostras.append({'usuario': uid, 'exame': exame, 'redacao': redacao,
+                             'cursor_historico': primeira.get('proximo') if isinstance(primeira, dict) else None})
+        sessao.remove()
+    return amostras
+
+
+def volume(app):
+    # Estimativa do catálogo: instantânea mesmo com dezenas de milhões de linhas
+    from sqlalchemy import text
+
+    tabelas = ['usuarios', 'questoes', 'exames', 'exames_questoes', 'redacoes', 'chat_sessoes', 'chat_mensagens']
+    with app.app.app_context():
+        linhas = app.db.session.execute(text("""
+            SELECT relname, GREATEST(reltuples, 0)::bigint FROM pg_class
+            WHERE relkind = 'r' AND relname = ANY(:tabelas)
+        """), {'tabelas': tabelas}).fetchall()
+        app.db.session.remove()
+    return {nome: total for nome, total in linhas}
+
+
+def preparar_caches(app):
+    # Conselhos de recomendação pré-preenchidos: a rota mede só o SQL, sem chamar a OpenAI
+    from sqlalchemy import text
+
+    with app.app.app_context():
+        materias = [row[0] for row in app.db.session.execute(text("SELECT nome FROM materias"))]
+        app.db.session.remove()
+    for materia in materias:
+        for faixa in range(100 // app.RECOMENDACAO_FAIXA + 1):
+            app.cache_recomendacoes.set((materia, faixa), "Conselho de benchmark.", ttl=0)
+
+
+def limpar_caches(app):
+    app.recomendacoes_fixadas.limpar()
+    app.invalidar_indice_questoes()
+    with app._cache_questoes_lock:
+        app._cache_questoes.clear()
+        app._cache_questoes_estado['versao'] = None
+        app._cache_questoes_estado['bytes'] = 0
+
+
+def medir(app, amostras, repeticoes, aquecimento, com_cache):
+    cliente = app.app.test_client()
+    resultados = {}
+    for nome, caminho_de in casos():
+        tempos, erros = [], 0
+        for rodada in range(aquecimento + repeticoes):
+            for amostra in amostras:
+                caminho = caminho_de(amostra)
+                if caminho is None:
+                    continue
+                if not com_cache:
+                    limpar_caches(app)
+                inicio = time.perf_counter()
+                resposta = cliente.get(caminho)
+                resposta.get_data()
+                duracao = time.perf_counter() - inicio
+                if rodada < aquecimento:
+                    continue
+                if resposta.status_code != 200:
+                    erros += 1
+                tempos.append(duracao)
+        if not tempos:
+            continue
+        tempos.sort()
+        resultados[nome] = {
+            'chamadas': len(tempos),
+            'erros': erros,
+            'media_ms': round(sum(tempos) / len(tempos) * 1000, 2),
+            'p50_ms': round(percentil(tempos, 50) * 1000, 2),
+            'p95_ms': round(percentil(tempos, 95) * 1000, 2),
+            'p99_ms': round(percentil(tempos, 99) * 1000, 2),
+        }
+        print(f"  {nome:<45} p50 {resultados[nome]['p50_ms']:>8} ms  p95 {resultados[nome]['p95_ms']:>8} ms"
+              + (f"  ({erros} erros)" if erros else ""))
+    return resultados
+
+
+def ultima_execucao(caminho, rotulo):
+    if not os.path.exists(caminho):
+        return None
+    anterior = None
+    with open(caminho, encoding='utf-8') as f:
+        for linha in f:
+            linha = linha.strip()
+            if not linha:
+                continue
+            registro = json.loads(linha)
+            if registro.get('rotulo') == rotulo:
+                anterior = registro
+    return anterior
+
+
+def comparar(atual, anterior, tolerancia, minimo_ms):
+    """Rotas cujo p50 e p95 pioraram mais que a tolerância (e mais que minimo_ms, para ignorar ruído)."""
+    regressoes = []
+    for nome, m in atual.items():
+        antes = anterior['casos'].get(nome)
+        if not antes:
+            continue
+        piorou = all(
+            m[k] > antes[k] * (1 + tolerancia) and m[k] - antes[k] > minimo_ms
+            for k in ('p50_ms', 'p95_ms')
+        )
+        variacao = (m['p50_ms'] / antes['p50_ms'] - 1) * 100 if antes['p50_ms'] else 0.0
+        print(f"  {nome:<45} p50 {antes['p50_ms']:>8} -> {m['p50_ms']:>8} ms ({variacao:+.0f}%)"
+              + ("  ⚠️ REGRESSÃO" if piorou else ""))
+        if piorou:
+            regressoes.append(nome)
+    return regressoes
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PASTA, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das consultas das rotas de leitura")
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help="DSN do Postgres (padrão: DATABASE_URL)")
+    parser.add_argument('--usuarios', type=int, default=50, help="Usuários sorteados por rodada")
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--aquecimento', type=int, default=1, help="Rodadas descartadas antes de medir")
+    parser.add_argument('--com-cache', action='store_true', help="Não limpa os caches em memória entre chamadas")
+    parser.add_argument('--rotulo', default='padrao', help="Nome do cenário; só execuções de mesmo rótulo são comparadas")
+    parser.add_argument('--historico', default=HISTORICO_PADRAO, help="Arquivo JSONL com as execuções anteriores")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="Piora relativa aceita, ex: 0.2 = 20%%")
+    parser.add_argument('--minimo-ms', type=float, default=1.0, help="Piora absoluta mínima para contar como regressão")
+    parser.add_argument('--nao-salvar', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.dsn:
+        os.environ['DATABASE_URL'] = args.dsn
+    # Sem chave, o app não cria o cliente da OpenAI; a recomendação usa o cache preparado abaixo
+    os.environ.pop('OPENAI_API_KEY', None)
+    sys.path.insert(0, os.path.dirname(PASTA))
+    import app
+
+    random.seed(args.seed)
+    cenario = volume(app)
+    print("Volume: " + ", ".join(f"{nome} {total:,}" for nome, total in sorted(cenario.items())))
+    amostras = sortear_amostras(app, args.usuarios, args.seed)
+    preparar_caches(app)
+
+    print(f"Medindo {len(amostras)} usuários x {args.repeticoes} repetições"
+          f"{' (com cache)' if args.com_cache else ''}:")
+    resultados = medir(app, amostras, args.repeticoes, args.aquecimento, args.com_cache)
+
+    anterior = ultima_execucao(args.historico, args.rotulo)
+    regressoes = []
+    if anterior:
+        print(f"\nComparando com {anterior['quando']} (commit {anterior.get('commit') or '?'}):")
+        regressoes = comparar(resultados, anterior, args.tolerancia, args.minimo_ms)
+
+    if not args.nao_salvar:
+        registro = {
+            'quando': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit_atual(),
+            'rotulo': args.rotulo,
+            'volume': cenario,
+            'parametros': {k: v for k, v in vars(args).items() if k not in ('dsn', 'historico')},
+            'casos': resultados
+        }
+        with open(args.historico, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        print(f"\nResultado adicionado a {args.historico}")
+
+    if regressoes:
+        print(f"⚠️ {len(regressoes)} rotas com regressão: {', '.join(regressoes)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Gerador de carga que percorre o fluxo real de um aluno e mede a latência por endpoint.
+
+Cada usuário virtual se cadastra, faz login, abre o dashboard, faz um simulado completo, pede um
+tema e envia uma redação, conversa com o chat e confere histórico e recomendação. No fim sai uma
+tabela com p50/p95/p99 e vazão por endpoint (e, com --saida, o mesmo em JSON).
+
+    python benchmarks/openai_falso.py &
+    OPENAI_API_KEY=falsa OPENAI_BASE_URL=http://localhost:8081/v1 python app.py &
+    python benchmarks/carga.py --usuarios 50 --iteracoes 2 --saida resultado.json
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+TRECHOS_REDACAO = [
+    "No Brasil contemporâneo, a desigualdade no acesso à educação ainda representa um entrave ao desenvolvimento nacional.",
+    "Segundo a Constituição Federal de 1988, a educação é direito de todos e dever do Estado, mas essa garantia não se concretiza plenamente.",
+    "Em primeiro lugar, escolas em regiões periféricas frequentemente carecem de infraestrutura adequada e de professores capacitados.",
+    "Além disso, a herança histórica de exclusão contribui para a perpetuação do problema ao concentrar oportunidades nas mãos de poucos.",
+    "Outro fator relevante é a evasão escolar, que afasta jovens da formação básica e limita suas perspectivas profissionais.",
+    "Nesse contexto, políticas públicas de permanência estudantil mostram resultados positivos quando bem implementadas.",
+    "Portanto, cabe ao Ministério da Educação, em parceria com estados e municípios, ampliar o investimento em escolas públicas.",
+    "Dessa forma, por meio de programas de formação docente e reformas estruturais, o direito constitucional se tornará realidade.",
+]
+
+
+class Metricas:
+    def __init__(self):
+        self.amostras = {}
+        self.erros = {}
+        self.inicio = {}
+        self.fim = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nome, segundos, ok, inicio):
+        with self._lock:
+            self.amostras.setdefault(nome, []).append(segundos)
+            if not ok:
+                self.erros[nome] = self.erros.get(nome, 0) + 1
+            self.inicio[nome] = min(self.inicio.get(nome, inicio), inicio)
+            self.fim[nome] = max(self.fim.get(nome, 0.0), inicio + segundos)
+
+    def resumo(self):
+        linhas = {}
+        for nome, valores in sorted(self.amostras.items()):
+            ordenados = sorted(valores)
+            janela = max(self.fim[nome] - self.inicio[nome], 1e-9)
+            linhas[nome] = {
+                'chamadas': len(ordenados),
+                'erros': self.erros.get(nome, 0),
+                'media_ms': round(sum(ordenados) / len(ordenados) * 1000, 1),
+                'p50_ms': round(percentil(ordenados, 50) * 1000, 1),
+                'p95_ms': round(percentil(ordenados, 95) * 1000, 1),
+                'p99_ms': round(percentil(ordenados, 99) * 1000, 1),
+                'max_ms': round(ordenados[-1] * 1000, 1),
+                'req_s': round(len(ordenados) / janela, 2)
+            }
+        return linhas
+
+
+def percentil(ordenados, p):
+    # Nearest-rank: o menor valor que cobre p% das amostras
+    indice = max(-(-p * len(ordenados) // 100) - 1, 0)
+    return ordenados[min(indice, len(ordenados) - 1)]
+
+
+class Cliente:
+    """Uma conexão keep-alive por usuário virtual, como um navegador faria."""
+
+    def __init__(self, url, metricas, timeout):
+        partes = urlsplit(url)
+        self.host = partes.hostname
+        self.porta = partes.port or (443 if partes.scheme == 'https' else 80)
+        self.classe = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+        self.metricas = metricas
+        self.timeout = timeout
+        self.conexao = None
+
+    def _conectar(self):
+        if self.conexao is None:
+            self.conexao = self.classe(self.host, self.porta, timeout=self.timeout)
+        return self.conexao
+
+    def _fechar(self):
+        if self.conexao is not None:
+            self.conexao.close()
+            self.conexao = None
+
+    def chamar(self, nome, metodo, caminho, corpo=None, stream=False):
+        dados = json.dumps(corpo).encode('utf-8') if corpo is not None else None
+        cabecalhos = {'Content-Type': 'application/json'} if dados is not None else {}
+        inicio_relogio = time.time()
+        inicio = time.perf_counter()
+        status, resposta = 0, None
+        try:
+            conexao = self._conectar()
+            conexao.request(metodo, caminho, body=dados, headers=cabecalhos)
+            http_resposta = conexao.getresponse()
+            status = http_resposta.status
+            if stream and status == 200:
+                resposta = self._ler_stream(nome, http_resposta, inicio, inicio_relogio)
+            else:
+                bruto = http_resposta.read()
+                resposta = json.loads(bruto) if bruto else None
+            if http_resposta.will_close:
+                self._fechar()
+        except Exception as e:
+            self._fechar()
+            resposta = {'error': str(e)}
+        duracao = time.perf_counter() - inicio
+        self.metricas.registrar(nome, duracao, 200 <= status < 300, inicio_relogio)
+        return status, resposta
+
+    def _ler_stream(self, nome, http_resposta, inicio, inicio_relogio):
+        # Registra à parte o tempo até o primeiro pedaço, que é o que o aluno percebe no chat
+        primeiro = None
+        final = None
+        for linha in http_resposta:
+            linha = linha.decode('utf-8').strip()
+            if not linha.startswith('data:'):
+                continue
+            if primeiro is None:
+                primeiro = time.perf_counter() - inicio
+                self.metricas.registrar(f"{nome} (1º token)", primeiro, True, inicio_relogio)
+            evento = json.loads(linha[5:].strip())
+            if 'reply' in evento or 'error' in evento:
+                final = evento
+        self._fechar()
+        return final
+
+
+def redacao_aleatoria(rng):
+    paragrafos = []
+    for _ in range(4):
+        paragrafos.append(' '.join(rng.sample(TRECHOS_REDACAO, 3)))
+    # Um número no fim evita que o deduplicador devolva a correção anterior
+    return '\n'.join(paragrafos) + f"\nRedação {uuid.uuid4().hex[:8]}."
+
+
+def fluxo_usuario(indice, args, metricas, id_execucao):
+    rng = random.Random(args.seed + indice)
+    cliente = Cliente(args.url, metricas, args.timeout)
+    email = f"carga-{id_execucao}-{indice}@preparai.test"
+
+    status, resposta = cliente.chamar('POST /add_user', 'POST', '/add_user',
+                                      {'nome': f"Aluno Carga {indice}", 'email': email, 'senha': 'senha123'})
+    status, resposta = cliente.chamar('POST /login', 'POST', '/login', {'email': email, 'senha': 'senha123'})
+    if status != 200 or not resposta or 'user' not in resposta:
+        return
+    uid = resposta['user']['id']
+
+    for _ in range(args.iteracoes):
+        cliente.chamar('GET /dashboard/resumo/<id>', 'GET', f'/dashboard/resumo/{uid}')
+
+        status, resposta = cliente.chamar('POST /simulado/iniciar', 'POST', '/simulado/iniciar', {'usuario_id': uid})
+        if status == 201:
+            exame_id = resposta['exame_id']
+            status, questoes = cliente.chamar('GET /simulado/questoes', 'GET', '/simulado/questoes')
+            questoes = questoes if status == 200 and isinstance(questoes, list) else []
+            respostas = [{'questao_id': q['id'], 'resposta': rng.choice('ABCDE')} for q in questoes]
+            if args.lote:
+                cliente.chamar('POST /simulado/responder/lote', 'POST', '/simulado/responder/lote',
+                               {'exame_id': exame_id, 'respostas': respostas})
+            else:
+                for item in respostas:
+                    cliente.chamar('POST /simulado/responder', 'POST', '/simulado/responder', dict(item, exame_id=exame_id))
+            cliente.chamar('POST /simulado/finalizar', 'POST', '/simulado/finalizar', {'exame_id': exame_id})
+
+        if not args.sem_redacao:
+            status, tema = cliente.chamar('GET /redacao/tema', 'GET', '/redacao/tema')
+            tema_id = tema.get('id') if status == 200 and tema else None
+            cliente.chamar('POST /redacao/enviar', 'POST', '/redacao/enviar',
+                           {'usuario_id': uid, 'tema_id': tema_id, 'texto': redacao_aleatoria(rng)})
+
+        if not args.sem_chat:
+            for _ in range(args.mensagens_chat):
+                pergunta = rng.choice(["Como estudar funções do 2º grau?", "Explique a Revolução Industrial.",
+                                       "O que é mitose?", "Dicas para a redação do ENEM?"])
+                cliente.chamar('POST /api/chat/stream', 'POST', '/api/chat/stream',
+                               {'usuario_id': uid, 'message': pergunta}, stream=True)
+            cliente.chamar('GET /api/chat/sessoes/<id>', 'GET', f'/api/chat/sessoes/{uid}?limit=30')
+
+        cliente.chamar('GET /dashboard/materias/<id>', 'GET', f'/dashboard/materias/{uid}')
+        cliente.chamar('GET /dashboard/recomendacao/<id>', 'GET', f'/dashboard/recomendacao/{uid}')
+        cliente.chamar('GET /historico/<id>', 'GET', f'/historico/{uid}?limit=20')
+
+    cliente._fechar()
+
+
+def imprimir(linhas, duracao, total_usuarios):
+    cabecalho = f"{'endpoint':<40} {'n':>6} {'erros':>6} {'média':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>8}"
+    print(cabecalho)
+    print('-' * len(cabecalho))
+    for nome, m in linhas.items():
+        print(f"{nome:<40} {m['chamadas']:>6} {m['erros']:>6} {m['media_ms']:>9} {m['p50_ms']:>9} "
+              f"{m['p95_ms']:>9} {m['p99_ms']:>9} {m['req_s']:>8}")
+    print(f"\n{total_usuarios} usuários virtuais em {duracao:.1f} s (tempos em ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do fluxo completo do PreparAI")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--usuarios', type=int, default=20, help="Usuários virtuais simultâneos")
+    parser.add_argument('--iteracoes', type=int, default=1, help="Voltas no fluxo por usuário")
+    parser.add_argument('--mensagens-chat', type=int, default=3)
+    parser.add_argument('--lote', action='store_true', help="Envia as respostas do simulado em lote, como o front atual")
+    parser.add_argument('--sem-redacao', action='store_true')
+    parser.add_argument('--sem-chat', action='store_true')
+    parser.add_argument('--rampa', type=float, default=0.0, help="Segundos para subir todos os usuários")
+    parser.add_argument('--timeout', type=float, default=180)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--saida', help="Arquivo JSON com o resultado")
+    args = parser.parse_args()
+
+    metricas = Metricas()
+    id_execucao = uuid.uuid4().hex[:8]
+    intervalo = args.rampa / args.usuarios if args.usuarios else 0
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.usuarios) as executor:
+        futuros = []
+        for i in range(args.usuarios):
+            futuros.append(executor.submit(fluxo_usuario, i, args, metricas, id_execucao))
+            if intervalo:
+                time.sleep(intervalo)
+        falhas = [f.exception() for f in futuros if f.exception()]
+    duracao = time.perf_counter() - inicio
+
+    if falhas:
+        print(f"⚠️ {len(falhas)} usuários virtuais abortaram o fluxo. Primeiro erro: {falhas[0]!r}")
+
+    linhas = metricas.resumo()
+    imprimir(linhas, duracao, args.usuarios)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({
+                'execucao': id_execucao,
+                'quando': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'parametros': vars(args),
+                'duracao_s': round(duracao, 2),
+                'endpoints': linhas
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Resultado salvo em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
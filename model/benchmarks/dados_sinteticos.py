@@ -0,0 +1,335 @@
+"""Popula um banco de teste com volume realista usando COPY, para medir as rotas de leitura.
+
+Gera matérias, questões, usuários, simulados com respostas, redações corrigidas, temas e conversas
+do chat, e no fim recalcula os contadores (desempenho_materias e dashboard_resumo) do mesmo jeito
+que o app faria. Os dados são determinísticos para a mesma --seed.
+
+Rode contra um banco descartável, depois do POST /create_tables:
+
+    python benchmarks/dados_sinteticos.py --dsn postgresql://postgres@localhost/preparai_bench \\
+        --usuarios 100000 --simulados-por-usuario 20     # ~50M respostas
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from werkzeug.security import generate_password_hash
+
+MATERIAS = ['linguagens', 'ciencias-humanas', 'ciencias-natureza', 'matematica']
+QUESTOES_POR_SIMULADO = 25
+NOTA_MAXIMA_SIMULADO = 1000.0
+PALAVRAS = (
+    "a análise do contexto histórico permite compreender como a sociedade brasileira enfrenta desafios "
+    "ligados à educação saúde trabalho cultura tecnologia meio ambiente cidadania e desigualdade social "
+    "considerando dados pesquisas políticas públicas e a participação ativa da população"
+).split()
+
+
+def esc(valor):
+    # Formato texto do COPY: \N é nulo e barra, tab e quebras de linha precisam de escape
+    if valor is None:
+        return '\\N'
+    return str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def texto(rng, n):
+    return ' '.join(rng.choice(PALAVRAS) for _ in range(n)).capitalize() + '.'
+
+
+class FluxoCopy:
+    """Arquivo só-leitura alimentado por um gerador de linhas, para o COPY não precisar de tudo na memória."""
+
+    def __init__(self, linhas):
+        self._linhas = linhas
+        self._buffer = ''
+        self.total = 0
+
+    def read(self, tamanho=-1):
+        partes = [self._buffer]
+        acumulado = len(self._buffer)
+        while tamanho < 0 or acumulado < tamanho:
+            try:
+                campos = next(self._linhas)
+            except StopIteration:
+                break
+            linha = '\t'.join(esc(c) for c in campos) + '\n'
+            partes.append(linha)
+            acumulado += len(linha)
+            self.total += 1
+        dados = ''.join(partes)
+        if tamanho < 0:
+            self._buffer = ''
+            return dados
+        self._buffer = dados[tamanho:]
+        return dados[:tamanho]
+
+    readline = read
+
+
+def copiar(conn, tabela, colunas, linhas):
+    inicio = time.perf_counter()
+    fluxo = FluxoCopy(linhas)
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN", fluxo, size=1 << 20)
+    conn.commit()
+    duracao = time.perf_counter() - inicio
+    print(f"  {tabela}: {fluxo.total:,} linhas em {duracao:.1f} s ({fluxo.total / max(duracao, 1e-9):,.0f}/s)")
+    return fluxo.total
+
+
+def proximo_id(conn, tabela):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {tabela}")
+        return cur.fetchone()[0]
+
+
+def ajustar_sequencia(conn, tabela):
+    # Os ids foram gravados explicitamente; a sequência precisa pular para depois deles
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{tabela}', 'id'), (SELECT COALESCE(MAX(id), 1) FROM {tabela}))")
+    conn.commit()
+
+
+def momento(rng, agora, dias):
+    return agora - timedelta(seconds=rng.randrange(dias * 86400))
+
+
+def garantir_materias(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, nome FROM materias ORDER BY id")
+        existentes = cur.fetchall()
+        if not existentes:
+            for nome in MATERIAS:
+                cur.execute("INSERT INTO materias (nome) VALUES (%s)", (nome,))
+            cur.execute("SELECT id, nome FROM materias ORDER BY id")
+            existentes = cur.fetchall()
+    conn.commit()
+    return [row[0] for row in existentes]
+
+
+def gerar_questoes(args, materias, primeiro_id):
+    rng = random.Random(args.seed)
+    for i in range(args.questoes):
+        yield (primeiro_id + i, rng.choice(materias), texto(rng, 60),
+               texto(rng, 8), texto(rng, 8), texto(rng, 8), texto(rng, 8), texto(rng, 8), rng.choice('ABCDE'))
+
+
+def gerar_usuarios(args, primeiro_id, senha_hash):
+    for i in range(args.usuarios):
+        uid = primeiro_id + i
+        yield (uid, f"Aluno Sintético {uid}", f"sintetico-{args.seed}-{uid}@preparai.test", senha_hash)
+
+
+def respostas_do_exame(exame_id, questoes, gabarito, seed):
+    # Mesma semente para o exame e suas respostas: as duas passadas do COPY geram dados coerentes
+    rng = random.Random(seed * 1_000_003 + exame_id)
+    taxa = rng.uniform(0.3, 0.85)
+    escolhidas = rng.sample(questoes, QUESTOES_POR_SIMULADO)
+    respostas = []
+    for qid in escolhidas:
+        correta = rng.random() < taxa
+        resposta = gabarito[qid] if correta else rng.choice([l for l in 'ABCDE' if l != gabarito[qid]])
+        respostas.append((qid, resposta, correta))
+    return rng, respostas
+
+
+def gerar_exames(args, usuarios, primeiro_exame, questoes, gabarito, agora):
+    exame_id = primeiro_exame
+    for uid in usuarios:
+        for _ in range(args.simulados_por_usuario):
+            rng, respostas = respostas_do_exame(exame_id, questoes, gabarito, args.seed)
+            acertos = sum(1 for _, _, c in respostas if c)
+            nota = round(acertos * NOTA_MAXIMA_SIMULADO / QUESTOES_POR_SIMULADO, 2)
+            yield (exame_id, uid, 'SIMULADO', acertos, QUESTOES_POR_SIMULADO - acertos, nota, momento(rng, agora, args.dias))
+            exame_id += 1
+
+
+def gerar_respostas(args, usuarios, primeiro_exame, questoes, gabarito):
+    total_exames = len(usuarios) * args.simulados_por_usuario
+    for exame_id in range(primeiro_exame, primeiro_exame + total_exames):
+        _, respostas = respostas_do_exame(exame_id, questoes, gabarito, args.seed)
+        for qid, resposta, correta in respostas:
+            yield (exame_id, qid, resposta, 't' if correta else 'f')
+
+
+def gerar_temas(args, primeiro_id, agora):
+    rng = random.Random(args.seed + 1)
+    for i in range(args.temas):
+        yield (primeiro_id + i, f"Tema sintético {primeiro_id + i}: {texto(rng, 6)}", texto(rng, 80), 'f', agora)
+
+
+def notas_da_redacao(redacao_id, seed):
+    rng = random.Random(seed * 7_000_003 + redacao_id)
+    return rng, [rng.choice((40, 80, 120, 160, 200)) for _ in range(5)]
+
+
+def gerar_redacoes(args, usuarios, primeiro_id, temas, agora):
+    redacao_id = primeiro_id
+    for uid in usuarios:
+        for _ in range(args.redacoes_por_usuario):
+            rng, _ = notas_da_redacao(redacao_id, args.seed)
+            corpo = '\n'.join(texto(rng, 45) for _ in range(4))
+            hash_conteudo = hashlib.sha256(corpo.encode('utf-8')).hexdigest()
+            yield (redacao_id, uid, rng.choice(temas), corpo, momento(rng, agora, args.dias), hash_conteudo)
+            redacao_id += 1
+
+
+def gerar_competencias(total, primeiro_id, seed):
+    for redacao_id in range(primeiro_id, primeiro_id + total):
+        _, notas = notas_da_redacao(redacao_id, seed)
+        for i, nota in enumerate(notas, start=1):
+            yield (redacao_id, i, nota)
+
+
+def gerar_avaliacoes(total, primeiro_id, seed):
+    for redacao_id in range(primeiro_id, primeiro_id + total):
+        rng, notas = notas_da_redacao(redacao_id, seed)
+        comentario = texto(rng, 30)
+        detalhes = {
+            'situacao_tema': 'OK',
+            'notas': {f'c{i}': n for i, n in enumerate(notas, start=1)},
+            'comentario_geral': comentario,
+            'detalhes_competencias': {f'c{i}': texto(rng, 15) for i in range(1, 6)}
+        }
+        yield (redacao_id, sum(notas), comentario, json.dumps(detalhes, ensure_ascii=False))
+
+
+def gerar_sessoes(args, usuarios, primeiro_id, agora):
+    sessao_id = primeiro_id
+    for uid in usuarios:
+        for n in range(args.sessoes_por_usuario):
+            rng = random.Random(args.seed * 5_000_011 + sessao_id)
+            inicio = momento(rng, agora, args.dias)
+            # A última sessão de cada usuário fica aberta, como a conversa ativa do chat
+            fim = None if n == args.sessoes_por_usuario - 1 else inicio + timedelta(minutes=30)
+            yield (sessao_id, uid, inicio, fim, texto(rng, 4)[:30])
+            sessao_id += 1
+
+
+def gerar_mensagens(args, usuarios, primeiro_sessao, agora):
+    sessao_id = primeiro_sessao
+    for uid in usuarios:
+        for _ in range(args.sessoes_por_usuario):
+            rng = random.Random(args.seed * 5_000_011 + sessao_id)
+            inicio = momento(rng, agora, args.dias)
+            for m in range(args.mensagens_por_sessao):
+                remetente = 'user' if m % 2 == 0 else 'bot'
+                yield (sessao_id, uid, remetente, texto(rng, 12 if remetente == 'user' else 80), inicio + timedelta(seconds=20 * m))
+            sessao_id += 1
+
+
+def recalcular_contadores(conn, primeiro_usuario):
+    print("  recalculando desempenho_materias e dashboard_resumo...")
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO desempenho_materias (usuario_id, materia_id, total, acertos)
+            SELECT e.usuario_id, q.materia_id, COUNT(*), COUNT(*) FILTER (WHERE eq.correta)
+            FROM exames_questoes eq
+            JOIN exames e ON eq.exame_id = e.id
+            JOIN questoes q ON eq.questao_id = q.id
+            WHERE e.usuario_id >= %s
+            GROUP BY e.usuario_id, q.materia_id
+            ON CONFLICT (usuario_id, materia_id) DO UPDATE SET total = EXCLUDED.total, acertos = EXCLUDED.acertos
+        """, (primeiro_usuario,))
+        cur.execute("""
+            INSERT INTO dashboard_resumo (usuario_id, simulados, redacoes, soma_notas, atualizado_em)
+            SELECT u.id,
+                   (SELECT COUNT(*) FROM exames e WHERE e.usuario_id = u.id AND e.nota_total IS NOT NULL),
+                   (SELECT COUNT(*) FROM redacoes r WHERE r.usuario_id = u.id),
+                   (SELECT COALESCE(SUM(nota_total), 0) FROM exames e WHERE e.usuario_id = u.id AND e.nota_total IS NOT NULL),
+                   NOW()
+            FROM usuarios u
+            WHERE u.id >= %s
+            ON CONFLICT (usuario_id) DO UPDATE
+            SET simulados = EXCLUDED.simulados, redacoes = EXCLUDED.redacoes,
+                soma_notas = EXCLUDED.soma_notas, atualizado_em = EXCLUDED.atualizado_em
+        """, (primeiro_usuario,))
+        cur.execute("ANALYZE")
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera dados sintéticos para benchmarks de banco")
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help="DSN do Postgres (padrão: DATABASE_URL)")
+    parser.add_argument('--usuarios', type=int, default=1000)
+    parser.add_argument('--questoes', type=int, default=3000)
+    parser.add_argument('--simulados-por-usuario', type=int, default=10)
+    parser.add_argument('--redacoes-por-usuario', type=int, default=3)
+    parser.add_argument('--sessoes-por-usuario', type=int, default=3)
+    parser.add_argument('--mensagens-por-sessao', type=int, default=20)
+    parser.add_argument('--temas', type=int, default=200)
+    parser.add_argument('--dias', type=int, default=365, help="Janela de datas dos registros gerados")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error("informe --dsn ou DATABASE_URL")
+    if args.questoes < QUESTOES_POR_SIMULADO:
+        parser.error(f"são necessárias pelo menos {QUESTOES_POR_SIMULADO} questões")
+
+    dsn = args.dsn.replace('postgresql+psycopg2://', 'postgresql://', 1)
+    conn = psycopg2.connect(dsn)
+    agora = datetime.now()
+    inicio = time.perf_counter()
+    respostas_previstas = args.usuarios * args.simulados_por_usuario * QUESTOES_POR_SIMULADO
+    print(f"Gerando {args.usuarios:,} usuários e {respostas_previstas:,} respostas de simulado (seed {args.seed})")
+
+    materias = garantir_materias(conn)
+
+    primeira_questao = proximo_id(conn, 'questoes')
+    copiar(conn, 'questoes', ['id', 'materia_id', 'enunciado', 'alternativa_a', 'alternativa_b', 'alternativa_c',
+                              'alternativa_d', 'alternativa_e', 'resposta_correta'],
+           gerar_questoes(args, materias, primeira_questao))
+    ajustar_sequencia(conn, 'questoes')
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, resposta_correta FROM questoes")
+        gabarito = dict(cur.fetchall())
+    questoes = sorted(gabarito)
+
+    primeiro_usuario = proximo_id(conn, 'usuarios')
+    copiar(conn, 'usuarios', ['id', 'nome', 'email', 'senha_hash'],
+           gerar_usuarios(args, primeiro_usuario, generate_password_hash('senha123')))
+    ajustar_sequencia(conn, 'usuarios')
+    usuarios = range(primeiro_usuario, primeiro_usuario + args.usuarios)
+
+    primeiro_exame = proximo_id(conn, 'exames')
+    copiar(conn, 'exames', ['id', 'usuario_id', 'tipo', 'acertos', 'erros', 'nota_total', 'criado_em'],
+           gerar_exames(args, usuarios, primeiro_exame, questoes, gabarito, agora))
+    ajustar_sequencia(conn, 'exames')
+    copiar(conn, 'exames_questoes', ['exame_id', 'questao_id', 'resposta_usuario', 'correta'],
+           gerar_respostas(args, usuarios, primeiro_exame, questoes, gabarito))
+
+    primeiro_tema = proximo_id(conn, 'temas_redacao')
+    copiar(conn, 'temas_redacao', ['id', 'tema', 'texto_de_apoio', 'gerado_por_ia', 'usado_em'],
+           gerar_temas(args, primeiro_tema, agora))
+    ajustar_sequencia(conn, 'temas_redacao')
+    temas = list(range(primeiro_tema, primeiro_tema + args.temas))
+
+    primeira_redacao = proximo_id(conn, 'redacoes')
+    total_redacoes = copiar(conn, 'redacoes', ['id', 'usuario_id', 'tema_id', 'texto', 'enviado_em', 'hash_conteudo'],
+                            gerar_redacoes(args, usuarios, primeira_redacao, temas, agora))
+    ajustar_sequencia(conn, 'redacoes')
+    copiar(conn, 'redacoes_competencias', ['redacao_id', 'competencia', 'nota'],
+           gerar_competencias(total_redacoes, primeira_redacao, args.seed))
+    copiar(conn, 'redacoes_avaliacao_final', ['redacao_id', 'nota_total', 'observacoes', 'detalhamento_ia'],
+           gerar_avaliacoes(total_redacoes, primeira_redacao, args.seed))
+
+    primeira_sessao = proximo_id(conn, 'chat_sessoes')
+    copiar(conn, 'chat_sessoes', ['id', 'usuario_id', 'iniciado_em', 'finalizado_em', 'titulo'],
+           gerar_sessoes(args, usuarios, primeira_sessao, agora))
+    ajustar_sequencia(conn, 'chat_sessoes')
+    copiar(conn, 'chat_mensagens', ['sessao_id', 'usuario_id', 'remetente', 'mensagem', 'enviado_em'],
+           gerar_mensagens(args, usuarios, primeira_sessao, agora))
+
+    recalcular_contadores(conn, primeiro_usuario)
+    conn.close()
+    print(f"Concluído em {time.perf_counter() - inicio:.1f} s. Usuários {primeiro_usuario} a {primeiro_usuario + args.usuarios - 1}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Servidor local que imita o endpoint de chat completions da OpenAI, para testes de carga.
+
+Responde de forma determinística (mesmo prompt, mesma resposta) e no formato que cada rota do
+backend espera: JSON de tema, JSON de correção de redação, resumo do chat, recomendação e chat livre.
+
+    python benchmarks/openai_falso.py --porta 8081 --latencia-ms 300 --tokens-por-segundo 60
+    OPENAI_API_KEY=falsa OPENAI_BASE_URL=http://localhost:8081/v1 python app.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PALAVRAS = (
+    "o estudo constante da matéria ajuda a compreender os conceitos cobrados no enem e a resolver questões "
+    "com mais segurança revisando teoria exemplos e exercícios de provas anteriores com atenção ao enunciado"
+).split()
+
+config = {'latencia': 0.3, 'tokens_por_segundo': 60.0, 'tokens_resposta': 120, 'jitter': 0.0, 'taxa_erro': 0.0}
+_contador_temas = {'n': 0}
+_lock = threading.Lock()
+
+
+def texto_das_mensagens(mensagens):
+    partes = []
+    for msg in mensagens:
+        conteudo = msg.get('content')
+        if isinstance(conteudo, str):
+            partes.append(conteudo)
+        elif isinstance(conteudo, list):
+            partes.extend(p.get('text', '') for p in conteudo if isinstance(p, dict))
+    return "\n".join(partes)
+
+
+def semente(texto):
+    return int(hashlib.sha256(texto.encode('utf-8')).hexdigest()[:12], 16)
+
+
+def frase(rng, n):
+    return ' '.join(rng.choice(PALAVRAS) for _ in range(n)).capitalize() + '.'
+
+
+def gerar_resposta(mensagens):
+    """Devolve (tipo, conteúdo) conforme o prompt que o backend mandou."""
+    prompt = texto_das_mensagens(mensagens)
+    rng = random.Random(semente(prompt))
+
+    if 'corretor oficial do ENEM' in prompt:
+        redacao = prompt.split('Redação:\n', 1)[-1] if 'Redação:\n' in prompt else "Texto transcrito da imagem. " + frase(rng, 60)
+        notas = {f'c{i}': rng.choice((80, 120, 160, 200)) for i in range(1, 6)}
+        return 'redacao', json.dumps({
+            'situacao_tema': 'OK',
+            'texto_transcrito': redacao,
+            'notas': notas,
+            'comentario_geral': frase(rng, 30),
+            'detalhes_competencias': {c: frase(rng, 20) for c in notas}
+        }, ensure_ascii=False)
+
+    if 'Crie um tema de redação' in prompt:
+        with _lock:
+            _contador_temas['n'] += 1
+            numero = _contador_temas['n']
+        return 'tema', json.dumps({
+            'tema': f"Desafios para a educação no Brasil contemporâneo ({numero})",
+            'texto_apoio': ' '.join(f"Texto motivador {i}: {frase(rng, 40)}" for i in range(1, 4))
+        }, ensure_ascii=False)
+
+    if 'Atualize o resumo' in prompt:
+        return 'resumo', frase(rng, 60)
+
+    if 'mentor pedagógico' in prompt:
+        return 'recomendacao', frase(rng, 35)
+
+    return 'chat', frase(rng, config['tokens_resposta'])
+
+
+def contar_tokens(texto):
+    return len(texto) // 4 + 1
+
+
+class Manipulador(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _json(self, status, corpo):
+        dados = json.dumps(corpo, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _esperar(self, segundos):
+        if config['jitter']:
+            segundos *= 1 + random.uniform(-config['jitter'], config['jitter'])
+        if segundos > 0:
+            time.sleep(segundos)
+
+    def do_POST(self):
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        try:
+            corpo = json.loads(self.rfile.read(tamanho) or b'{}')
+        except ValueError:
+            return self._json(400, {'error': {'message': 'JSON inválido', 'type': 'invalid_request_error'}})
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._json(404, {'error': {'message': 'Rota não simulada', 'type': 'invalid_request_error'}})
+
+        if config['taxa_erro'] and random.random() < config['taxa_erro']:
+            self._esperar(config['latencia'])
+            return self._json(500, {'error': {'message': 'Falha simulada', 'type': 'server_error'}})
+
+        mensagens = corpo.get('messages') or []
+        modelo = corpo.get('model', 'gpt-4o-mini')
+        tipo, conteudo = gerar_resposta(mensagens)
+        palavras = conteudo.split(' ')
+        if corpo.get('max_tokens') and tipo not in ('redacao', 'tema'):
+            palavras = palavras[:max(int(corpo['max_tokens']) // 2, 1)]
+            conteudo = ' '.join(palavras)
+
+        uso = {
+            'prompt_tokens': contar_tokens(texto_das_mensagens(mensagens)),
+            'completion_tokens': contar_tokens(conteudo)
+        }
+        uso['total_tokens'] = uso['prompt_tokens'] + uso['completion_tokens']
+        ident = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        criado = int(time.time())
+        intervalo = 1 / config['tokens_por_segundo'] if config['tokens_por_segundo'] > 0 else 0
+
+        if not corpo.get('stream'):
+            self._esperar(config['latencia'] + len(palavras) * intervalo)
+            return self._json(200, {
+                'id': ident, 'object': 'chat.completion', 'created': criado, 'model': modelo,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': conteudo}, 'finish_reason': 'stop'}],
+                'usage': uso
+            })
+
+        # Stream: um pedaço por palavra, no ritmo configurado
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def enviar(dados):
+            self.wfile.write(f"data: {dados}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        def pedaco(delta, fim=None):
+            return json.dumps({
+                'id': ident, 'object': 'chat.completion.chunk', 'created': criado, 'model': modelo,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': fim}]
+            }, ensure_ascii=False)
+
+        try:
+            self._esperar(config['latencia'])
+            enviar(pedaco({'role': 'assistant', 'content': ''}))
+            for i, palavra in enumerate(palavras):
+                enviar(pedaco({'content': palavra if i == 0 else ' ' + palavra}))
+                self._esperar(intervalo)
+            enviar(pedaco({}, 'stop'))
+            if (corpo.get('stream_options') or {}).get('include_usage'):
+                enviar(json.dumps({'id': ident, 'object': 'chat.completion.chunk', 'created': criado,
+                                   'model': modelo, 'choices': [], 'usage': uso}))
+            enviar('[DONE]')
+        except (BrokenPipeError, ConnectionResetError):
+            # O backend cancelou o stream (cliente desconectou)
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de chat completions da OpenAI")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8081)
+    parser.add_argument('--latencia-ms', type=float, default=300, help="Tempo até o primeiro token")
+    parser.add_argument('--tokens-por-segundo', type=float, default=60, help="Ritmo de geração (0 = instantâneo)")
+    parser.add_argument('--tokens-resposta', type=int, default=120, help="Tamanho das respostas de chat, em palavras")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Variação relativa das esperas, ex: 0.2 = ±20%%")
+    parser.add_argument('--taxa-erro', type=float, default=0.0, help="Fração de chamadas que respondem 500")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    config.update(latencia=args.latencia_ms / 1000, tokens_por_segundo=args.tokens_por_segundo,
+                  tokens_resposta=args.tokens_resposta, jitter=args.jitter, taxa_erro=args.taxa_erro)
+
+    servidor = ThreadingHTTPServer((args.host, args.porta), Manipulador)
+    servidor.daemon_threads = True
+    print(f"OpenAI falsa ouvindo em http://{args.host}:{args.porta}/v1 "
+          f"(latência {args.latencia_ms:.0f} ms, {args.tokens_por_segundo:g} tokens/s)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Confere o plano (EXPLAIN) das consultas quentes e falha se alguma voltou a fazer Seq Scan em tabela grande.
+
+Roda contra um banco migrado (flask migrar) e populado por benchmarks/dados_sinteticos.py. Usa as
+mesmas constantes SQL do app sempre que elas existem, então mudar uma consulta ou remover um índice
+de migracoes.py aparece aqui. Tabelas com menos de --min-linhas linhas são ignoradas: nelas o Seq
+Scan costuma ser mesmo o melhor plano. Sai com código 1 se alguma consulta regrediu.
+
+    python benchmarks/planos.py --dsn postgresql://postgres@localhost/preparai_bench --analisar
+"""
+import argparse
+import os
+import sys
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+
+def consultas(app):
+    """(nome, sql, parâmetros a partir da amostra) de cada consulta quente."""
+    from sqlalchemy import text
+
+    historico = app.SQL_HISTORICO.format(filtro_sim='', filtro_red='')
+    historico_cursor = app.SQL_HISTORICO.format(filtro_sim=app.FILTRO_HISTORICO_SIMULADO,
+                                                filtro_red=app.FILTRO_HISTORICO_REDACAO)
+    return [
+        ('/historico (1ª página)', text(historico), lambda a: {'uid': a['usuario'], 'lim': app.HISTORICO_LIMITE_PADRAO + 1}),
+        ('/historico (página seguinte)', text(historico_cursor),
+         lambda a: {'uid': a['usuario'], 'lim': app.HISTORICO_LIMITE_PADRAO + 1,
+                    'c_data': a['data_exame'], 'c_ordem': 1, 'c_id': a['exame']}),
+        ('/api/graficos/evolucao', app.SQL_EVOLUCAO, lambda a: {'uid': a['usuario']}),
+        ('/dashboard/materias e recomendação', app.SQL_DESEMPENHO_MATERIAS, lambda a: {'uid': a['usuario']}),
+        # Sem ANALYZE o EXPLAIN não executa o INSERT dos recálculos
+        ('recálculo do dashboard', app.SQL_RECALCULO_DASHBOARD, lambda a: {'uid': a['usuario']}),
+        ('recálculo de desempenho por usuário', app.SQL_RECALCULO_DESEMPENHO, lambda a: {'uid': a['usuario']}),
+        ('/simulado/detalhes (respostas)', text("SELECT questao_id, resposta_usuario FROM exames_questoes WHERE exame_id = :eid"),
+         lambda a: {'eid': a['exame']}),
+        ('/simulado/questoes (por id)', text("""
+            SELECT q.id, q.enunciado, m.nome FROM questoes q JOIN materias m ON m.id = q.materia_id
+            WHERE q.id = ANY(:ids)
+        """), lambda a: {'ids': a['questoes']}),
+        ('/redacao/detalhes', text("""
+            SELECT r.texto, t.tema, raf.nota_total, raf.detalhamento_ia, r.enviado_em
+            FROM redacoes r
+            JOIN redacoes_avaliacao_final raf ON r.id = raf.redacao_id
+            LEFT JOIN temas_redacao t ON r.tema_id = t.id
+            WHERE r.id = :rid
+        """), lambda a: {'rid': a['redacao']}),
+        ('/redacao/detalhes (competências)', text("SELECT competencia, nota FROM redacoes_competencias WHERE redacao_id = :rid ORDER BY competencia"),
+         lambda a: {'rid': a['redacao']}),
+        ('sessão ativa do chat', text("SELECT id FROM chat_sessoes WHERE usuario_id = :uid AND finalizado_em IS NULL LIMIT 1"),
+         lambda a: {'uid': a['usuario']}),
+        ('/api/chat/sessoes', text(app.SQL_CHAT_SESSOES.format(filtro='')),
+         lambda a: {'uid': a['usuario'], 'lim': app.CHAT_SESSOES_LIMITE_PADRAO + 1}),
+        ('/api/chat/historico (últimas)', text(app.SQL_CHAT_HISTORICO.format(filtros='', ordem='DESC')),
+         lambda a: {'sid': a['sessao'], 'uid': a['usuario'], 'lim': 30}),
+        ('pool de temas', text("""
+            SELECT id FROM temas_redacao WHERE gerado_por_ia AND usado_em IS NULL ORDER BY id LIMIT 1
+        """), lambda a: {}),
+    ]
+
+
+def amostra(app):
+    from sqlalchemy import text
+
+    sessao = app.db.session
+    # Um usuário com simulado finalizado, redação e conversa, para todas as consultas terem dados
+    row = sessao.execute(text("""
+        SELECT e.usuario_id, e.id, e.criado_em,
+               (SELECT MAX(id) FROM redacoes r WHERE r.usuario_id = e.usuario_id) AS redacao,
+               (SELECT MAX(id) FROM chat_sessoes s WHERE s.usuario_id = e.usuario_id) AS sessao
+        FROM exames e
+        WHERE e.nota_total IS NOT NULL AND e.criado_em IS NOT NULL
+        ORDER BY e.id DESC
+        LIMIT 1
+    """)).fetchone()
+    if not row:
+        raise SystemExit("Banco sem simulados finalizados: rode benchmarks/dados_sinteticos.py antes.")
+    questoes = [r[0] for r in sessao.execute(text("SELECT questao_id FROM exames_questoes WHERE exame_id = :eid"), {'eid': row.id})]
+    return {'usuario': row.usuario_id, 'exame': row.id, 'data_exame': row.criado_em,
+            'redacao': row.redacao or 0, 'sessao': row.sessao or 0, 'questoes': questoes or [0]}
+
+
+def tamanhos(app):
+    from sqlalchemy import text
+
+    return dict(app.db.session.execute(text("""
+        SELECT c.relname, GREATEST(c.reltuples, 0)::bigint
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r' AND n.nspname = current_schema()
+    """)).fetchall())
+
+
+def nos(plano):
+    yield plano
+    for filho in plano.get('Plans', []):
+        yield from nos(filho)
+
+
+def verificar(app, min_linhas, mostrar):
+    from sqlalchemy import text
+
+    sessao = app.db.session
+    linhas = tamanhos(app)
+    a = amostra(app)
+    falhas = []
+    for nome, sql, parametros in consultas(app):
+        plano = sessao.execute(text(f"EXPLAIN (FORMAT JSON) {sql.text}"), parametros(a)).scalar()
+        plano = plano[0]['Plan'] if isinstance(plano, list) else plano
+        varreduras = [n['Relation Name'] for n in nos(plano)
+                      if n['Node Type'] == 'Seq Scan' and linhas.get(n['Relation Name'], 0) >= min_linhas]
+        indices = sorted({n['Index Name'] for n in nos(plano) if 'Index Name' in n})
+
+        if varreduras:
+            falhas.append(nome)
+            print(f"❌ {nome}: Seq Scan em {', '.join(sorted(set(varreduras)))}")
+            if mostrar:
+                texto = sessao.execute(text(f"EXPLAIN {sql.text}"), parametros(a)).fetchall()
+                print('\n'.join('     ' + r[0] for r in texto))
+        else:
+            print(f"✅ {nome}: {', '.join(indices) if indices else 'sem tabela grande'} (custo {plano['Total Cost']:.0f})")
+    sessao.rollback()
+    return falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica os planos das consultas quentes")
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'), help="DSN do Postgres (padrão: DATABASE_URL)")
+    parser.add_argument('--min-linhas', type=int, default=10000, help="Tabelas menores que isso podem ter Seq Scan")
+    parser.add_argument('--analisar', action='store_true', help="Roda ANALYZE antes, para o planejador ver o volume real")
+    parser.add_argument('--mostrar-planos', action='store_true', help="Imprime o plano completo das consultas que falharem")
+    args = parser.parse_args()
+
+    if args.dsn:
+        os.environ['DATABASE_URL'] = args.dsn
+    os.environ.pop('OPENAI_API_KEY', None)
+    os.environ.setdefault('LOG_REQUISICOES_JSON', '0')
+    sys.path.insert(0, os.path.dirname(PASTA))
+    import app
+    from sqlalchemy import text
+
+    with app.app.app_context():
+        if args.analisar:
+            app.db.session.execute(text("ANALYZE"))
+            app.db.session.commit()
+        falhas = verificar(app, args.min_linhas, args.mostrar_planos)
+
+    if falhas:
+        print(f"\n{len(falhas)} consultas com Seq Scan em tabela grande. Confira os índices em migracoes.py.")
+        sys.exit(1)
+    print("\nTodas as consultas quentes usam índice.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Compara bytes e CPU da camada de respostas (orjson + gzip/brotli) com o jsonify padrão, por endpoint.
+
+Monta payloads com o formato e o volume reais das rotas mais pesadas (simulado de 25 questões,
+histórico completo, histórico do chat...) e mede, para cada um: o JSON do provedor padrão do
+Flask, o do ProvedorJSON e o tamanho e custo de CPU do gzip e do brotli sobre ele.
+
+    python benchmarks/respostas.py --repeticoes 500 --saida respostas.json
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from respostas import ProvedorJSON, brotli, comprimir, orjson
+
+PALAVRAS = (
+    "considere a função quadrática definida no intervalo real e determine o valor máximo atingido "
+    "pela população de bactérias segundo o gráfico apresentado no texto de apoio sobre a revolução industrial"
+).split()
+
+
+def texto(rng, n):
+    return ' '.join(rng.choice(PALAVRAS) for _ in range(n)).capitalize() + '.'
+
+
+def data(rng, agora):
+    return agora - timedelta(seconds=rng.randrange(365 * 86400))
+
+
+def payloads(rng):
+    agora = datetime.now()
+    opcoes = lambda: {letra: texto(rng, 10) for letra in 'ABCDE'}
+    materias = ['linguagens', 'ciencias-humanas', 'ciencias-natureza', 'matematica']
+    return {
+        'GET /simulado/questoes': [
+            {'id': i, 'texto': texto(rng, 90), 'materia': rng.choice(materias),
+             'opcoes': [{'letra': l, 'texto': t} for l, t in opcoes().items()]}
+            for i in range(25)
+        ],
+        'GET /simulado/detalhes/<id>': {
+            'data': data(rng, agora),
+            'questoes': [{'enunciado': texto(rng, 90), 'materia': rng.choice(materias), 'marcada': 'A',
+                          'gabarito': rng.choice('ABCDE'), 'opcoes': opcoes()} for _ in range(25)]
+        },
+        'GET /historico/<id> (completo)': [
+            {'categoria': 'SIMULADO', 'id': i, 'data': data(rng, agora), 'nota': 640.0, 'titulo': 'Simulado ENEM',
+             'info_extra': {'acertos': 16, 'erros': 9}}
+            for i in range(200)
+        ],
+        'GET /historico/<id>?limit=20': {'itens': [
+            {'categoria': 'REDACAO', 'id': i, 'data': data(rng, agora), 'nota': 720.0,
+             'titulo': f"Redação: {texto(rng, 8)}", 'info_extra': {}}
+            for i in range(20)
+        ], 'proximo': '2026-01-01T10:00:00,10,REDACAO'},
+        'GET /api/chat/historico/<id>': [
+            {'id': i, 'role': 'user' if i % 2 == 0 else 'assistant', 'content': texto(rng, 15 if i % 2 == 0 else 120),
+             'data': data(rng, agora)}
+            for i in range(200)
+        ],
+        'GET /api/chat/sessoes/<id>?limit=30': {'itens': [
+            {'id': i, 'data': data(rng, agora), 'titulo': texto(rng, 4)[:30]} for i in range(30)
+        ], 'proximo': None},
+        'GET /dashboard/materias/<id>': [
+            {'materia': m, 'percentual': 61.5, 'mensagem': texto(rng, 10), 'cor': '#ef6c00'} for m in materias
+        ],
+    }
+
+
+def cpu_ms(funcao, repeticoes):
+    inicio = time.process_time()
+    for _ in range(repeticoes):
+        resultado = funcao()
+    return (time.process_time() - inicio) * 1000 / repeticoes, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes e CPU da camada de respostas por endpoint")
+    parser.add_argument('--repeticoes', type=int, default=200)
+    parser.add_argument('--nivel-gzip', type=int, default=6)
+    parser.add_argument('--qualidade-br', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--saida', help="Arquivo JSON com o resultado")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    padrao = DefaultJSONProvider(app)
+    rapido = ProvedorJSON(app)
+    print(f"orjson: {'sim' if orjson else 'não (stdlib)'} | brotli: {'sim' if brotli else 'não instalado'}\n")
+
+    resultado = {}
+    for nome, obj in payloads(random.Random(args.seed)).items():
+        # Referência: jsonify de antes, com as datas já formatadas como texto pelo handler
+        ms_padrao, corpo_padrao = cpu_ms(lambda: padrao.dumps(obj, default=str).encode('utf-8'), args.repeticoes)
+        ms_rapido, corpo = cpu_ms(lambda: rapido.dumps_bytes(obj), args.repeticoes)
+        ms_gzip, gz = cpu_ms(lambda: comprimir(corpo, 'gzip', args.nivel_gzip), args.repeticoes)
+        linha = {
+            'bytes_padrao': len(corpo_padrao),
+            'bytes_json': len(corpo),
+            'bytes_gzip': len(gz),
+            'cpu_padrao_ms': round(ms_padrao, 3),
+            'cpu_json_ms': round(ms_rapido, 3),
+            'cpu_gzip_ms': round(ms_gzip, 3),
+        }
+        assert json.loads(gzip.decompress(gz)) == json.loads(corpo)
+        if brotli:
+            ms_br, br = cpu_ms(lambda: comprimir(corpo, 'br', qualidade_br=args.qualidade_br), args.repeticoes)
+            linha.update(bytes_br=len(br), cpu_br_ms=round(ms_br, 3))
+        resultado[nome] = linha
+
+    cabecalho = (f"{'endpoint':<36} {'bytes antes':>11} {'json':>8} {'gzip':>8} {'br':>8} "
+                 f"{'cpu antes':>10} {'cpu json':>9} {'+gzip':>8} {'+br':>8}")
+    print(cabecalho)
+    print('-' * len(cabecalho))
+    for nome, m in resultado.items():
+        print(f"{nome:<36} {m['bytes_padrao']:>11} {m['bytes_json']:>8} {m['bytes_gzip']:>8} {m.get('bytes_br', '-'):>8} "
+              f"{m['cpu_padrao_ms']:>10} {m['cpu_json_ms']:>9} {m['cpu_gzip_ms']:>8} {m.get('cpu_br_ms', '-'):>8}")
+    total_antes = sum(m['bytes_padrao'] for m in resultado.values())
+    total_gzip = sum(m['bytes_gzip'] for m in resultado.values())
+    print(f"\nBytes na rede: {total_antes:,} -> {total_gzip:,} com gzip ({100 - total_gzip * 100 / total_antes:.0f}% a menos). "
+          f"CPU em ms por resposta, média de {args.repeticoes} repetições.")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'quando': time.strftime('%Y-%m-%dT%H:%M:%S'), 'parametros': vars(args),
+                       'orjson': orjson is not None, 'brotli': brotli is not None, 'endpoints': resultado},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Resultado salvo em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
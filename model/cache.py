@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    def __init__(self, max_itens=1000, ttl=None):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.removidos = 0
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                self.misses += 1
+                return padrao
+
+            valor, expira_em = item
+            if expira_em is not None and expira_em <= time.monotonic():
+                del self._dados[chave]
+                self.expirados += 1
+                self.misses += 1
+                return padrao
+
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def set(self, chave, valor, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expira_em = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._dados[chave] = (valor, expira_em)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+                self.removidos += 1
+
+    def remover(self, chave):
+        with self._lock:
+            return self._dados.pop(chave, None) is not None
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+    def estatisticas(self):
+        total = self.hits + self.misses
+        return {
+            'itens': len(self._dados),
+            'max_itens': self.max_itens,
+            'hits': self.hits,
+            'misses': self.misses,
+            'expirados': self.expirados,
+            'removidos': self.removidos,
+            'taxa_acerto': round(self.hits / total, 4) if total else 0.0
+        }
@@ -0,0 +1,367 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+import openai
+
+from metricas import registrar_log_json
+
+# Erros que valem nova tentativa: rede, timeout, limite de taxa e falhas do lado da OpenAI
+ERROS_TRANSITORIOS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+class CircuitoAberto(Exception):
+    pass
+
+
+class FilaCheia(Exception):
+    pass
+
+
+def extrair_json(conteudo):
+    # O modelo às vezes devolve o JSON dentro de um bloco ```json ... ```
+    return json.loads(conteudo.replace("```json", "").replace("```", "").strip())
+
+
+class Circuito:
+    def __init__(self, falhas_para_abrir=5, tempo_aberto=30):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.tempo_aberto = tempo_aberto
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self.aberturas = 0
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        # Depois do tempo aberto deixa passar chamadas de novo; a primeira falha reabre
+        with self._lock:
+            return time.monotonic() >= self.aberto_ate
+
+    def sucesso(self):
+        with self._lock:
+            self.falhas = 0
+
+    def falha(self):
+        with self._lock:
+            self.falhas += 1
+            if self.falhas >= self.falhas_para_abrir:
+                self.aberto_ate = time.monotonic() + self.tempo_aberto
+                self.falhas = self.falhas_para_abrir - 1
+                self.aberturas += 1
+
+    def estado(self):
+        with self._lock:
+            return 'aberto' if time.monotonic() < self.aberto_ate else 'fechado'
+
+
+class StreamLLM:
+    """Stream da OpenAI que devolve as vagas de concorrência ao terminar ou ser fechado."""
+
+    def __init__(self, gateway, rota, stream, inicio, liberar):
+        self._gateway = gateway
+        self._rota = rota
+        self._stream = stream
+        self._inicio = inicio
+        self._liberar = liberar
+        self._fechado = False
+        self._usage = None
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                if getattr(chunk, 'usage', None):
+                    self._usage = chunk.usage
+                yield chunk
+        except Exception:
+            self._fechado = True
+            try:
+                self._stream.close()
+            finally:
+                self._gateway._registrar(self._rota, self._inicio, None, erro=True)
+                self._liberar()
+            raise
+        self.close(concluido=True)
+
+    def close(self, concluido=False):
+        if self._fechado:
+            return
+        self._fechado = True
+        try:
+            if not concluido:
+                self._stream.close()
+        finally:
+            self._gateway._registrar(self._rota, self._inicio, self._usage)
+            self._liberar()
+
+
+class GatewayBase:
+    def __init__(self, client, rotas=None, max_concorrencia=32, tentativas=3, backoff_base=0.5, backoff_max=8.0,
+                 falhas_para_abrir=5, tempo_aberto=30, timeout_padrao=60, circuito=None, observador=None):
+        # O SDK não repete sozinho: as tentativas ficam por conta do gateway, que conhece o circuito
+        self.client = client.with_options(max_retries=0)
+        self.rotas = rotas or {}
+        self.max_concorrencia = max_concorrencia
+        self.tentativas = tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout_padrao = timeout_padrao
+        self.circuito = circuito or Circuito(falhas_para_abrir, tempo_aberto)
+        # Chamado com (rota, segundos, usage, erro) ao fim de cada chamada, ex: para exportar métricas
+        self.observador = observador
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _config(self, rota):
+        return self.rotas.get(rota, {})
+
+    def _preparar(self, rota, parametros):
+        cfg = self._config(rota)
+        parametros.setdefault('model', cfg.get('modelo', 'gpt-4o-mini'))
+        return cfg.get('timeout', self.timeout_padrao)
+
+    def _espera_backoff(self, tentativa):
+        teto = min(self.backoff_max, self.backoff_base * (2 ** tentativa))
+        return random.uniform(0, teto)
+
+    def _registrar(self, rota, inicio, usage, erro=False, repeticoes=0):
+        duracao = time.monotonic() - inicio
+        with self._lock:
+            m = self._metricas.setdefault(rota, {'chamadas': 0, 'erros': 0, 'repeticoes': 0, 'segundos': 0.0,
+                                                 'max_segundos': 0.0, 'tokens_prompt': 0, 'tokens_resposta': 0})
+            m['chamadas'] += 1
+            m['repeticoes'] += repeticoes
+            m['segundos'] += duracao
+            m['max_segundos'] = max(m['max_segundos'], duracao)
+            if erro:
+                m['erros'] += 1
+            if usage:
+                m['tokens_prompt'] += getattr(usage, 'prompt_tokens', 0) or 0
+                m['tokens_resposta'] += getattr(usage, 'completion_tokens', 0) or 0
+        if self.observador:
+            self.observador(rota, duracao, usage, erro)
+        if usage:
+            registrar_log_json({
+                'evento': 'llm',
+                'rota': rota,
+                'duracao_ms': round(duracao * 1000, 1),
+                'tokens_prompt': getattr(usage, 'prompt_tokens', 0),
+                'tokens_resposta': getattr(usage, 'completion_tokens', 0)
+            }, nivel=logging.DEBUG)
+
+    def estatisticas(self):
+        with self._lock:
+            rotas = {}
+            for nome, m in self._metricas.items():
+                rotas[nome] = dict(m, media_ms=round(m['segundos'] * 1000 / m['chamadas'], 1) if m['chamadas'] else 0.0)
+        return {
+            'circuito': self.circuito.estado(),
+            'aberturas_circuito': self.circuito.aberturas,
+            'rotas': rotas
+        }
+
+
+class GatewayLLM(GatewayBase):
+    def __init__(self, client, **opcoes):
+        super().__init__(client, **opcoes)
+        self._global = threading.BoundedSemaphore(self.max_concorrencia)
+        self._semaforos = {nome: threading.BoundedSemaphore(cfg.get('concorrencia', self.max_concorrencia))
+                           for nome, cfg in self.rotas.items()}
+
+    def _reservar(self, rota, espera):
+        # Primeiro a vaga da rota, depois a global, para uma rota lotada não segurar vagas das outras
+        sem_rota = self._semaforos.get(rota)
+        if sem_rota and not sem_rota.acquire(timeout=espera):
+            raise FilaCheia(f"Limite de chamadas simultâneas da rota '{rota}' atingido")
+        if not self._global.acquire(timeout=espera):
+            if sem_rota:
+                sem_rota.release()
+            raise FilaCheia("Limite global de chamadas simultâneas à OpenAI atingido")
+
+        liberado = {'ok': False}
+
+        def liberar():
+            if liberado['ok']:
+                return
+            liberado['ok'] = True
+            self._global.release()
+            if sem_rota:
+                sem_rota.release()
+        return liberar
+
+    def _criar(self, rota, parametros):
+        timeout = self._preparar(rota, parametros)
+
+        ultimo_erro = None
+        for tentativa in range(self.tentativas):
+            if not self.circuito.permitir():
+                raise CircuitoAberto("OpenAI indisponível no momento (circuito aberto)")
+            try:
+                resposta = self.client.chat.completions.create(timeout=timeout, **parametros)
+                self.circuito.sucesso()
+                return resposta, tentativa
+            except ERROS_TRANSITORIOS as e:
+                ultimo_erro = e
+                self.circuito.falha()
+                if tentativa + 1 < self.tentativas:
+                    time.sleep(self._espera_backoff(tentativa))
+        raise ultimo_erro
+
+    def completar(self, rota, **parametros):
+        """Faz a chamada de chat da rota e devolve o texto da resposta."""
+        cfg = self._config(rota)
+        liberar = self._reservar(rota, cfg.get('timeout', self.timeout_padrao))
+        inicio = time.monotonic()
+        try:
+            resposta, repeticoes = self._criar(rota, parametros)
+        except Exception:
+            self._registrar(rota, inicio, None, erro=True)
+            raise
+        finally:
+            liberar()
+        self._registrar(rota, inicio, resposta.usage, repeticoes=repeticoes)
+        return resposta.choices[0].message.content
+
+    def completar_json(self, rota, **parametros):
+        return extrair_json(self.completar(rota, **parametros))
+
+    def stream(self, rota, **parametros):
+        """Abre um stream de chat; só a abertura é repetida, nunca um stream já iniciado."""
+        cfg = self._config(rota)
+        liberar = self._reservar(rota, cfg.get('timeout', self.timeout_padrao))
+        inicio = time.monotonic()
+        parametros['stream'] = True
+        parametros.setdefault('stream_options', {'include_usage': True})
+        try:
+            stream, _ = self._criar(rota, parametros)
+        except Exception:
+            self._registrar(rota, inicio, None, erro=True)
+            liberar()
+            raise
+        return StreamLLM(self, rota, stream, inicio, liberar)
+
+
+class StreamLLMAsync:
+    """Versão assíncrona do StreamLLM, para o AsyncOpenAI."""
+
+    def __init__(self, gateway, rota, stream, inicio, liberar):
+        self._gateway = gateway
+        self._rota = rota
+        self._stream = stream
+        self._inicio = inicio
+        self._liberar = liberar
+        self._fechado = False
+        self._usage = None
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                if getattr(chunk, 'usage', None):
+                    self._usage = chunk.usage
+                yield chunk
+        except Exception:
+            self._fechado = True
+            try:
+                await self._stream.close()
+            finally:
+                self._gateway._registrar(self._rota, self._inicio, None, erro=True)
+                self._liberar()
+            raise
+        await self.close(concluido=True)
+
+    async def close(self, concluido=False):
+        if self._fechado:
+            return
+        self._fechado = True
+        try:
+            if not concluido:
+                await self._stream.close()
+        finally:
+            self._gateway._registrar(self._rota, self._inicio, self._usage)
+            self._liberar()
+
+
+class GatewayLLMAsync(GatewayBase):
+    """Mesmo contrato do GatewayLLM sobre o AsyncOpenAI: espera a resposta sem ocupar uma thread."""
+
+    def __init__(self, client, **opcoes):
+        super().__init__(client, **opcoes)
+        self._global = asyncio.Semaphore(self.max_concorrencia)
+        self._semaforos = {nome: asyncio.Semaphore(cfg.get('concorrencia', self.max_concorrencia))
+                           for nome, cfg in self.rotas.items()}
+
+    async def _reservar(self, rota, espera):
+        sem_rota = self._semaforos.get(rota)
+        try:
+            if sem_rota:
+                await asyncio.wait_for(sem_rota.acquire(), espera)
+        except asyncio.TimeoutError:
+            raise FilaCheia(f"Limite de chamadas simultâneas da rota '{rota}' atingido")
+        try:
+            await asyncio.wait_for(self._global.acquire(), espera)
+        except asyncio.TimeoutError:
+            if sem_rota:
+                sem_rota.release()
+            raise FilaCheia("Limite global de chamadas simultâneas à OpenAI atingido")
+
+        liberado = {'ok': False}
+
+        def liberar():
+            if liberado['ok']:
+                return
+            liberado['ok'] = True
+            self._global.release()
+            if sem_rota:
+                sem_rota.release()
+        return liberar
+
+    async def _criar(self, rota, parametros):
+        timeout = self._preparar(rota, parametros)
+
+        ultimo_erro = None
+        for tentativa in range(self.tentativas):
+            if not self.circuito.permitir():
+                raise CircuitoAberto("OpenAI indisponível no momento (circuito aberto)")
+            try:
+                resposta = await self.client.chat.completions.create(timeout=timeout, **parametros)
+                self.circuito.sucesso()
+                return resposta, tentativa
+            except ERROS_TRANSITORIOS as e:
+                ultimo_erro = e
+                self.circuito.falha()
+                if tentativa + 1 < self.tentativas:
+                    await asyncio.sleep(self._espera_backoff(tentativa))
+        raise ultimo_erro
+
+    async def completar(self, rota, **parametros):
+        cfg = self._config(rota)
+        liberar = await self._reservar(rota, cfg.get('timeout', self.timeout_padrao))
+        inicio = time.monotonic()
+        try:
+            resposta, repeticoes = await self._criar(rota, parametros)
+        except Exception:
+            self._registrar(rota, inicio, None, erro=True)
+            raise
+        finally:
+            liberar()
+        self._registrar(rota, inicio, resposta.usage, repeticoes=repeticoes)
+        return resposta.choices[0].message.content
+
+    async def completar_json(self, rota, **parametros):
+        return extrair_json(await self.completar(rota, **parametros))
+
+    async def stream(self, rota, **parametros):
+        cfg = self._config(rota)
+        liberar = await self._reservar(rota, cfg.get('timeout', self.timeout_padrao))
+        inicio = time.monotonic()
+        parametros['stream'] = True
+        parametros.setdefault('stream_options', {'include_usage': True})
+        try:
+            stream, _ = await self._criar(rota, parametros)
+        except Exception:
+            self._registrar(rota, inicio, None, erro=True)
+            liberar()
+            raise
+        return StreamLLMAsync(self, rota, stream, inicio, liberar)
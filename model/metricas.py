@@ -0,0 +1,190 @@
+import json
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# nome -> (tipo, ajuda, buckets)
+DEFINICOES = {
+    'preparai_http_requisicoes_total': ('counter', 'Requisições HTTP atendidas', None),
+    'preparai_http_requisicao_segundos': ('histogram', 'Latência das requisições HTTP (até o primeiro byte, nos streams)', BUCKETS_SEGUNDOS),
+    'preparai_http_sql_consultas': ('histogram', 'Consultas SQL executadas por requisição', BUCKETS_CONSULTAS),
+    'preparai_http_sql_segundos': ('histogram', 'Tempo gasto em SQL por requisição', BUCKETS_SEGUNDOS),
+    'preparai_llm_chamadas_total': ('counter', 'Chamadas à OpenAI por rota do gateway', None),
+    'preparai_llm_segundos': ('histogram', 'Latência das chamadas à OpenAI', BUCKETS_SEGUNDOS),
+    'preparai_llm_tokens_total': ('counter', 'Tokens consumidos na OpenAI', None),
+}
+
+log_requisicoes = logging.getLogger('preparai.requisicoes')
+
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * len(limites)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.soma += valor
+        self.total += 1
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+
+
+def _rotulos(rotulos):
+    if not rotulos:
+        return ''
+    partes = []
+    for chave, valor in rotulos:
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{chave}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class RegistroMetricas:
+    """Contadores e histogramas em memória do processo, exportados no formato texto do Prometheus."""
+
+    def __init__(self):
+        self._series = {nome: {} for nome in DEFINICOES}
+        self._lock = threading.Lock()
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self._lock:
+            series = self._series[nome]
+            series[chave] = series.get(chave, 0) + valor
+
+    def observar(self, nome, valor, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self._lock:
+            series = self._series[nome]
+            histograma = series.get(chave)
+            if histograma is None:
+                histograma = series[chave] = Histograma(DEFINICOES[nome][2])
+            histograma.observar(valor)
+
+    def observar_llm(self, rota, segundos, usage, erro=False):
+        """Observador do gateway da OpenAI: uma chamada terminada (ou falha) na rota informada."""
+        tokens_prompt = (getattr(usage, 'prompt_tokens', 0) or 0) if usage else 0
+        tokens_resposta = (getattr(usage, 'completion_tokens', 0) or 0) if usage else 0
+        self.incrementar('preparai_llm_chamadas_total', rota=rota, resultado='erro' if erro else 'ok')
+        self.observar('preparai_llm_segundos', segundos, rota=rota)
+        if tokens_prompt:
+            self.incrementar('preparai_llm_tokens_total', tokens_prompt, rota=rota, tipo='prompt')
+        if tokens_resposta:
+            self.incrementar('preparai_llm_tokens_total', tokens_resposta, rota=rota, tipo='resposta')
+
+        if has_request_context() and 'metricas' in g:
+            m = g.metricas
+            m['llm_chamadas'] += 1
+            m['llm_segundos'] += segundos
+            m['tokens_prompt'] += tokens_prompt
+            m['tokens_resposta'] += tokens_resposta
+
+    def observar_requisicao(self, metodo, rota, status, segundos, sql_consultas=None, sql_segundos=None):
+        self.incrementar('preparai_http_requisicoes_total', metodo=metodo, rota=rota, status=status)
+        self.observar('preparai_http_requisicao_segundos', segundos, metodo=metodo, rota=rota)
+        if sql_consultas is not None:
+            self.observar('preparai_http_sql_consultas', sql_consultas, metodo=metodo, rota=rota)
+            self.observar('preparai_http_sql_segundos', sql_segundos, metodo=metodo, rota=rota)
+
+    def prometheus(self):
+        linhas = []
+        with self._lock:
+            for nome, (tipo, ajuda, _) in DEFINICOES.items():
+                linhas.append(f"# HELP {nome} {ajuda}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                for chave, valor in sorted(self._series[nome].items()):
+                    if tipo == 'counter':
+                        linhas.append(f"{nome}{_rotulos(chave)} {_numero(valor)}")
+                        continue
+                    acumulado = 0
+                    for limite, contagem in zip(valor.limites, valor.contagens):
+                        acumulado += contagem
+                        linhas.append(f"{nome}_bucket{_rotulos(chave + (('le', _numero(limite)),))} {acumulado}")
+                    linhas.append(f"{nome}_bucket{_rotulos(chave + (('le', '+Inf'),))} {valor.total}")
+                    linhas.append(f"{nome}_sum{_rotulos(chave)} {_numero(valor.soma)}")
+                    linhas.append(f"{nome}_count{_rotulos(chave)} {valor.total}")
+        return '\n'.join(linhas) + '\n'
+
+
+def rota_da_requisicao():
+    # O padrão da rota (/historico/<int:usuario_id>), não o caminho, para não criar uma série por usuário
+    regra = request.url_rule
+    return regra.rule if regra is not None else '<desconhecida>'
+
+
+def registrar_log_json(dados, nivel=logging.INFO):
+    if log_requisicoes.isEnabledFor(nivel):
+        log_requisicoes.log(nivel, json.dumps(dados, ensure_ascii=False, default=str))
+
+
+def instrumentar(app, registro, log_json=True):
+    """Liga latência, SQL e OpenAI por requisição ao registro e, opcionalmente, um log JSON por requisição."""
+    if log_json and not log_requisicoes.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        log_requisicoes.addHandler(handler)
+        log_requisicoes.setLevel(logging.INFO)
+        log_requisicoes.propagate = False
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            conn.info.setdefault('inicio_sql', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+        inicios = conn.info.get('inicio_sql')
+        if not inicios:
+            return
+        inicio = inicios.pop()
+        # Streams continuam consultando o banco depois do after_request; essas ficam fora da conta
+        if has_request_context() and 'metricas' in g:
+            g.metricas['sql_consultas'] += 1
+            g.metricas['sql_segundos'] += time.perf_counter() - inicio
+
+    @app.before_request
+    def _iniciar_metricas():
+        g.metricas = {'inicio': time.perf_counter(), 'sql_consultas': 0, 'sql_segundos': 0.0,
+                      'llm_chamadas': 0, 'llm_segundos': 0.0, 'tokens_prompt': 0, 'tokens_resposta': 0}
+
+    @app.after_request
+    def _registrar_metricas(resposta):
+        m = g.pop('metricas', None)
+        if m is None:
+            return resposta
+        duracao = time.perf_counter() - m['inicio']
+        rota = rota_da_requisicao()
+        registro.observar_requisicao(request.method, rota, resposta.status_code, duracao,
+                                     m['sql_consultas'], m['sql_segundos'])
+        if log_json:
+            registrar_log_json({
+                'evento': 'requisicao',
+                'metodo': request.method,
+                'rota': rota,
+                'caminho': request.path,
+                'status': resposta.status_code,
+                'duracao_ms': round(duracao * 1000, 1),
+                'sql_consultas': m['sql_consultas'],
+                'sql_ms': round(m['sql_segundos'] * 1000, 1),
+                'llm_chamadas': m['llm_chamadas'],
+                'llm_ms': round(m['llm_segundos'] * 1000, 1),
+                'tokens_prompt': m['tokens_prompt'],
+                'tokens_resposta': m['tokens_resposta'],
+                'stream': resposta.mimetype == 'text/event-stream'
+            })
+        return resposta
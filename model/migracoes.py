@@ -0,0 +1,334 @@
+"""Esquema do banco em migrações numeradas, aplicadas em ordem e registradas em schema_migracoes.
+
+Tudo é idempotente (IF NOT EXISTS), então bancos criados antes das migrações, pelo script SQL
+original e pelo /create_tables, passam por elas sem perder dados. Para mudar o esquema, acrescente
+uma nova versão no fim de MIGRACOES; nunca edite uma versão já aplicada.
+"""
+from sqlalchemy import text
+
+# Chave do pg_advisory_xact_lock: dois workers subindo juntos não aplicam a mesma migração
+CHAVE_LOCK = 7_316_204
+
+MIGRACOES = [
+    (1, 'tabelas_base', [
+        """
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(150) NOT NULL,
+            email VARCHAR(200) NOT NULL UNIQUE,
+            senha_hash VARCHAR(200) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS materias (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(100) NOT NULL UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS questoes (
+            id SERIAL PRIMARY KEY,
+            materia_id INTEGER NOT NULL REFERENCES materias (id),
+            enunciado TEXT NOT NULL,
+            alternativa_a TEXT,
+            alternativa_b TEXT,
+            alternativa_c TEXT,
+            alternativa_d TEXT,
+            alternativa_e TEXT,
+            resposta_correta CHAR(1) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS exames (
+            id SERIAL PRIMARY KEY,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+            tipo VARCHAR(20) NOT NULL DEFAULT 'SIMULADO',
+            acertos INTEGER,
+            erros INTEGER,
+            nota_total NUMERIC(6, 1),
+            criado_em TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS exames_questoes (
+            exame_id INTEGER NOT NULL REFERENCES exames (id) ON DELETE CASCADE,
+            questao_id INTEGER NOT NULL REFERENCES questoes (id),
+            resposta_usuario CHAR(1),
+            correta BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY (exame_id, questao_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS temas_redacao (
+            id SERIAL PRIMARY KEY,
+            tema TEXT NOT NULL,
+            texto_de_apoio TEXT,
+            gerado_por_ia BOOLEAN NOT NULL DEFAULT FALSE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS redacoes (
+            id SERIAL PRIMARY KEY,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+            tema_id INTEGER REFERENCES temas_redacao (id),
+            texto TEXT,
+            enviado_em TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS redacoes_competencias (
+            redacao_id INTEGER NOT NULL REFERENCES redacoes (id) ON DELETE CASCADE,
+            competencia SMALLINT NOT NULL,
+            nota INTEGER NOT NULL,
+            PRIMARY KEY (redacao_id, competencia)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS redacoes_avaliacao_final (
+            redacao_id INTEGER NOT NULL UNIQUE REFERENCES redacoes (id) ON DELETE CASCADE,
+            nota_total NUMERIC(6, 1),
+            observacoes TEXT,
+            detalhamento_ia JSONB
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_sessoes (
+            id SERIAL PRIMARY KEY,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+            iniciado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+            finalizado_em TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_mensagens (
+            id SERIAL PRIMARY KEY,
+            sessao_id INTEGER NOT NULL REFERENCES chat_sessoes (id) ON DELETE CASCADE,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+            remetente VARCHAR(10) NOT NULL CHECK (remetente IN ('user', 'bot')),
+            mensagem TEXT NOT NULL,
+            enviado_em TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS desempenho_materias (
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+            materia_id INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            acertos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (usuario_id, materia_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS dashboard_resumo (
+            usuario_id INTEGER PRIMARY KEY REFERENCES usuarios (id),
+            simulados INTEGER NOT NULL DEFAULT 0,
+            redacoes INTEGER NOT NULL DEFAULT 0,
+            soma_notas NUMERIC(14, 1) NOT NULL DEFAULT 0,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS redacoes_jobs (
+            id VARCHAR(32) PRIMARY KEY,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+            status VARCHAR(20) NOT NULL DEFAULT 'pendente',
+            resultado TEXT,
+            erro TEXT,
+            criado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+            atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS redacoes_em_correcao (
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+            hash_conteudo VARCHAR(64) NOT NULL,
+            iniciado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (usuario_id, hash_conteudo)
+        )
+        """,
+    ]),
+    (2, 'colunas_resumo_titulo_pool_deduplicacao', [
+        """
+        ALTER TABLE chat_sessoes
+            ADD COLUMN IF NOT EXISTS resumo TEXT,
+            ADD COLUMN IF NOT EXISTS resumo_ate_id INTEGER,
+            ADD COLUMN IF NOT EXISTS titulo VARCHAR(30)
+        """,
+        # Sessões antigas ganham o título a partir da primeira mensagem
+        """
+        UPDATE chat_sessoes s
+        SET titulo = CASE WHEN LENGTH(p.mensagem) > 30 THEN LEFT(p.mensagem, 27) || '...' ELSE p.mensagem END
+        FROM (
+            SELECT DISTINCT ON (sessao_id) sessao_id, mensagem
+            FROM chat_mensagens
+            ORDER BY sessao_id, id
+        ) p
+        WHERE p.sessao_id = s.id AND s.titulo IS NULL
+        """,
+        # Temas já existentes contam como usados; só os gerados pelo repositor entram livres no pool
+        "ALTER TABLE temas_redacao ADD COLUMN IF NOT EXISTS usado_em TIMESTAMP DEFAULT NOW()",
+        "ALTER TABLE temas_redacao ALTER COLUMN usado_em DROP DEFAULT",
+        """
+        ALTER TABLE redacoes
+            ADD COLUMN IF NOT EXISTS hash_conteudo VARCHAR(64),
+            ADD COLUMN IF NOT EXISTS chave_idempotencia VARCHAR(100)
+        """,
+        # Exames abertos antes dos contadores incrementais ficaram com acertos/erros NULL
+        """
+        UPDATE exames e
+        SET acertos = c.acertos, erros = c.erros
+        FROM (
+            SELECT e2.id,
+                   COUNT(eq.questao_id) FILTER (WHERE eq.correta) AS acertos,
+                   COUNT(eq.questao_id) FILTER (WHERE NOT eq.correta) AS erros
+            FROM exames e2
+            LEFT JOIN exames_questoes eq ON eq.exame_id = e2.id
+            WHERE e2.acertos IS NULL OR e2.erros IS NULL
+            GROUP BY e2.id
+        ) c
+        WHERE e.id = c.id
+        """,
+    ]),
+    (3, 'indices_consultas_quentes', [
+        # /historico, gráfico de evolução e recálculo do dashboard: só exames finalizados, por data
+        """
+        CREATE INDEX IF NOT EXISTS ix_exames_historico
+            ON exames (usuario_id, criado_em DESC, id DESC) WHERE nota_total IS NOT NULL
+        """,
+        # Demais consultas de exames por usuário, incluindo os ainda em andamento
+        "CREATE INDEX IF NOT EXISTS ix_exames_usuario_criado ON exames (usuario_id, criado_em)",
+        "CREATE INDEX IF NOT EXISTS ix_redacoes_historico ON redacoes (usuario_id, enviado_em DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_redacoes_usuario_hash ON redacoes (usuario_id, hash_conteudo)",
+        "CREATE INDEX IF NOT EXISTS ix_redacoes_usuario_chave ON redacoes (usuario_id, chave_idempotencia)",
+        # O UNIQUE(redacao_id) já indexa a avaliação final; o índice extra só entra em banco antigo que não o tem
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_index i
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                WHERE i.indrelid = 'redacoes_avaliacao_final'::regclass
+                  AND i.indisunique AND i.indnatts = 1 AND a.attname = 'redacao_id'
+            ) THEN
+                CREATE INDEX IF NOT EXISTS ix_redacoes_avaliacao_final_redacao ON redacoes_avaliacao_final (redacao_id);
+            END IF;
+        END $$
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_chat_sessoes_usuario_inicio ON chat_sessoes (usuario_id, iniciado_em DESC, id DESC)",
+        # Sessão ativa, procurada a cada mensagem do chat
+        "CREATE INDEX IF NOT EXISTS ix_chat_sessoes_ativa ON chat_sessoes (usuario_id) WHERE finalizado_em IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_chat_mensagens_sessao_id ON chat_mensagens (sessao_id, id)",
+        # Pool de temas: só as linhas livres, que são poucas
+        "CREATE INDEX IF NOT EXISTS ix_temas_redacao_pool ON temas_redacao (id) WHERE gerado_por_ia AND usado_em IS NULL",
+    ]),
+    (4, 'versao_banco_questoes', [
+        # Versão do banco de questões numa linha só; o índice e o cache de questões de cada worker comparam com ela
+        """
+        CREATE TABLE IF NOT EXISTS questoes_versao (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            versao BIGINT NOT NULL DEFAULT 1,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        "INSERT INTO questoes_versao (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING",
+        # Qualquer escrita em questoes, inclusive edição de enunciado ou gabarito, avança a versão
+        """
+        CREATE OR REPLACE FUNCTION fn_versao_questoes() RETURNS trigger AS $$
+        BEGIN
+            UPDATE questoes_versao SET versao = versao + 1, atualizado_em = NOW();
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS tg_questoes_versao ON questoes",
+        """
+        CREATE TRIGGER tg_questoes_versao
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON questoes
+            FOR EACH STATEMENT EXECUTE PROCEDURE fn_versao_questoes()
+        """,
+    ]),
+    (5, 'regra_nota_exames', [
+        # Nota do simulado de 0 a 10 pelos contadores do exame; finalizar_exame grava com um UPDATE só
+        """
+        CREATE OR REPLACE FUNCTION fn_nota_exame(acertos INTEGER, erros INTEGER) RETURNS NUMERIC AS $$
+            SELECT COALESCE(ROUND(10.0 * acertos / NULLIF(acertos + erros, 0), 1), 0)
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+    ]),
+    (6, 'job_da_reserva_correcao', [
+        # Envio duplicado recebe o job da correção em andamento em vez de esperar na requisição
+        "ALTER TABLE redacoes_em_correcao ADD COLUMN IF NOT EXISTS job_id VARCHAR(32)",
+    ]),
+    (7, 'objetos_legados_desempenho', [
+        # Contador de matéria que não existe mais não aparece em lugar nenhum; sai antes da FK
+        "DELETE FROM desempenho_materias d WHERE NOT EXISTS (SELECT 1 FROM materias m WHERE m.id = d.materia_id)",
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_desempenho_materias_materia') THEN
+                ALTER TABLE desempenho_materias
+                    ADD CONSTRAINT fk_desempenho_materias_materia FOREIGN KEY (materia_id) REFERENCES materias (id);
+            END IF;
+        END $$
+        """,
+        # A view e a função existiam só nos bancos criados pelo script SQL original; agora saem daqui,
+        # a view sobre os contadores de desempenho_materias e a função com a regra de fn_nota_exame
+        "DROP VIEW IF EXISTS dashboard_feedback_materias",
+        """
+        CREATE VIEW dashboard_feedback_materias AS
+        SELECT d.usuario_id, d.materia_id, m.nome AS materia_nome,
+               d.total AS total_questoes, d.acertos, p.percentual AS percentual_acertos,
+               CASE WHEN p.percentual >= 70 THEN 'Ótimo domínio! Continue revisando para manter o ritmo.'
+                    WHEN p.percentual < 50 THEN 'Ponto de atenção. Reforce a teoria e pratique mais questões.'
+                    ELSE 'Bom caminho! Revise os tópicos em que ainda erra.' END AS mensagem,
+               CASE WHEN p.percentual >= 70 THEN '#2e7d32'
+                    WHEN p.percentual < 50 THEN '#c62828'
+                    ELSE '#ef6c00' END AS cor_hex
+        FROM desempenho_materias d
+        JOIN materias m ON m.id = d.materia_id
+        CROSS JOIN LATERAL (SELECT ROUND(d.acertos * 100.0 / d.total, 2) AS percentual) p
+        WHERE d.total > 0
+        """,
+        "DROP FUNCTION IF EXISTS fn_finalizar_exame(INTEGER)",
+        """
+        CREATE FUNCTION fn_finalizar_exame(p_exame_id INTEGER) RETURNS NUMERIC AS $$
+            UPDATE exames SET nota_total = fn_nota_exame(acertos, erros)
+            WHERE id = p_exame_id
+            RETURNING nota_total
+        $$ LANGUAGE sql
+        """,
+    ]),
+]
+
+
+def versoes_aplicadas(conexao):
+    conexao.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migracoes (
+            versao INTEGER PRIMARY KEY,
+            nome VARCHAR(100) NOT NULL,
+            aplicada_em TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """))
+    return {row[0] for row in conexao.execute(text("SELECT versao FROM schema_migracoes"))}
+
+
+def aplicar_migracoes(engine):
+    """Aplica as migrações pendentes, cada uma na sua transação. Devolve [(versao, nome)] aplicadas."""
+    aplicadas = []
+    for versao, nome, comandos in MIGRACOES:
+        with engine.begin() as conexao:
+            conexao.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': CHAVE_LOCK})
+            if versao in versoes_aplicadas(conexao):
+                continue
+            for comando in comandos:
+                conexao.execute(text(comando))
+            conexao.execute(text("INSERT INTO schema_migracoes (versao, nome) VALUES (:v, :n)"), {'v': versao, 'n': nome})
+            aplicadas.append((versao, nome))
+            print(f"Migração {versao:04d} ({nome}) aplicada.")
+    return aplicadas
+
+
+def situacao_migracoes(engine):
+    with engine.begin() as conexao:
+        feitas = versoes_aplicadas(conexao)
+    return [(versao, nome, versao in feitas) for versao, nome, _ in MIGRACOES]
@@ -0,0 +1,109 @@
+import dataclasses
+import decimal
+import gzip
+import uuid
+from datetime import date, datetime
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIMETYPES_COMPRIMIVEIS = {'application/json', 'text/plain', 'text/html', 'text/css', 'application/javascript'}
+
+
+def _padrao(obj):
+    # Datas saem em ISO 8601 (o front formata); é o mesmo formato que o orjson gera nativamente
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    raise TypeError(f"Objeto do tipo {type(obj).__name__} não é serializável em JSON")
+
+
+class ProvedorJSON(DefaultJSONProvider):
+    """JSON do app: orjson quando instalado, json da stdlib como reserva, com datetime/Decimal nativos."""
+
+    usar_orjson = orjson is not None
+
+    def dumps_bytes(self, obj):
+        if self.usar_orjson:
+            return orjson.dumps(obj, default=_padrao, option=orjson.OPT_NON_STR_KEYS)
+        return self.dumps(obj).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if self.usar_orjson and not kwargs:
+            return orjson.dumps(obj, default=_padrao, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        kwargs.setdefault('default', _padrao)
+        kwargs.setdefault('ensure_ascii', False)
+        kwargs.setdefault('sort_keys', False)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.usar_orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def escolher_codificacao(aceitas):
+    """'br' ou 'gzip' conforme o Accept-Encoding do cliente (e o que está instalado), ou None."""
+    if brotli is not None and aceitas['br'] > 0:
+        return 'br'
+    if aceitas['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def comprimir(dados, codificacao, nivel_gzip=6, qualidade_br=4):
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=qualidade_br)
+    return gzip.compress(dados, compresslevel=nivel_gzip, mtime=0)
+
+
+def configurar_respostas(app, json_rapido=True, compressao_min_bytes=1024, nivel_gzip=6, qualidade_br=4):
+    """Troca o JSON do Flask pelo ProvedorJSON e comprime as respostas grandes que o cliente aceitar."""
+    provedor = ProvedorJSON(app)
+    provedor.usar_orjson = json_rapido and orjson is not None
+    app.json = provedor
+
+    @app.after_request
+    def _comprimir_resposta(resposta):
+        # Streams (SSE do chat e da correção) precisam sair pedaço a pedaço: nunca são comprimidos aqui
+        if (compressao_min_bytes < 0 or resposta.direct_passthrough or resposta.is_streamed
+                or resposta.status_code < 200 or resposta.status_code in (204, 304)
+                or 'Content-Encoding' in resposta.headers
+                or resposta.mimetype not in MIMETYPES_COMPRIMIVEIS):
+            return resposta
+
+        resposta.vary.add('Accept-Encoding')
+        codificacao = escolher_codificacao(request.accept_encodings)
+        if codificacao is None:
+            return resposta
+
+        dados = resposta.get_data()
+        if len(dados) < compressao_min_bytes:
+            return resposta
+
+        resposta.set_data(comprimir(dados, codificacao, nivel_gzip, qualidade_br))
+        resposta.headers['Content-Encoding'] = codificacao
+        # O corpo mudou de bytes: o ETag passa a ser fraco (o If-None-Match compara no modo fraco)
+        etag, fraco = resposta.get_etag()
+        if etag and not fraco:
+            resposta.set_etag(etag, weak=True)
+        return resposta
@@ -0,0 +1,128 @@
+import math
+import re
+import unicodedata
+
+PALAVRA = re.compile(r"[a-z0-9]+")
+
+# Critérios de nota zero do ENEM que dá para checar sem IA
+MOTIVOS = {
+    'EM_BRANCO': "Redação em branco.",
+    'INSUFICIENTE': "Texto insuficiente: a redação tem até {linhas_min} linhas.",
+    'COPIA': "Texto composto por cópia dos textos motivadores.",
+    'ILEGIVEL': "Texto sem sentido ou com caracteres aleatórios.",
+}
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode('ascii')
+    return texto.lower()
+
+
+def palavras(texto):
+    return PALAVRA.findall(normalizar(texto))
+
+
+def contar_linhas(texto, caracteres_por_linha=70):
+    # Converte o texto digitado em linhas equivalentes da folha de redação
+    total = 0
+    for linha in (texto or '').splitlines():
+        linha = linha.strip()
+        if linha:
+            total += math.ceil(len(linha) / caracteres_por_linha)
+    return total
+
+
+def palavras_copiadas(texto, referencias, tamanho_trecho=5):
+    """(total, copiadas): palavras da redação e quantas delas estão em trechos copiados das referências."""
+    tokens = palavras(texto)
+    ref = palavras(' '.join(r for r in referencias if r))
+    if len(tokens) < tamanho_trecho or len(ref) < tamanho_trecho:
+        # Referência curta demais para ter um trecho inteiro: nada conta como cópia
+        return len(tokens), 0
+
+    trechos_ref = {tuple(ref[i:i + tamanho_trecho]) for i in range(len(ref) - tamanho_trecho + 1)}
+    copiadas = [False] * len(tokens)
+    for i in range(len(tokens) - tamanho_trecho + 1):
+        if tuple(tokens[i:i + tamanho_trecho]) in trechos_ref:
+            for j in range(i, i + tamanho_trecho):
+                copiadas[j] = True
+    return len(tokens), copiadas.count(True)
+
+
+def parece_ilegivel(texto):
+    visiveis = [c for c in texto if not c.isspace()]
+    if not visiveis:
+        return True
+
+    letras = sum(1 for c in visiveis if c.isalpha())
+    if letras / len(visiveis) < 0.6:
+        return True
+
+    tokens = palavras(texto)
+    if not tokens:
+        return True
+
+    # Palavras sem vogal ou repetição excessiva indicam teclado aleatório
+    sem_vogal = sum(1 for p in tokens if not re.search(r"[aeiouy]", p) and not p.isdigit())
+    if sem_vogal / len(tokens) > 0.3:
+        return True
+    return len(tokens) >= 20 and len(set(tokens)) / len(tokens) < 0.2
+
+
+def triar_redacao(texto, referencias=(), linhas_min=7, caracteres_por_linha=70, palavras_por_linha=10, fracao_copia_min=0.5):
+    """Devolve (codigo, mensagem) se a redação deve ser zerada sem passar pela IA, senão None."""
+    if not texto or not texto.strip():
+        return 'EM_BRANCO', MOTIVOS['EM_BRANCO']
+
+    if contar_linhas(texto, caracteres_por_linha) <= linhas_min:
+        return 'INSUFICIENTE', MOTIVOS['INSUFICIENTE'].format(linhas_min=linhas_min)
+
+    # Só é cópia quando boa parte do texto veio das referências e o que sobra não passa do mínimo de linhas;
+    # redação curta mas original segue para a correção normal
+    total, copiadas = palavras_copiadas(texto, referencias)
+    if copiadas and copiadas >= total * fracao_copia_min and total - copiadas <= linhas_min * palavras_por_linha:
+        return 'COPIA', MOTIVOS['COPIA']
+
+    if parece_ilegivel(texto):
+        return 'ILEGIVEL', MOTIVOS['ILEGIVEL']
+
+    return None
+
+
+if __name__ == '__main__':
+    # Casos de referência da triagem: python triagem.py
+    apoio = ("A mobilidade urbana nas grandes cidades brasileiras enfrenta congestionamentos diários, transporte "
+             "público precário e longas distâncias entre moradia e trabalho, o que afeta a qualidade de vida da população.")
+    frases = [
+        "O trânsito das metrópoles revela escolhas antigas que privilegiaram o carro particular.",
+        "Ônibus lotados e trens atrasados empurram o trabalhador para jornadas ainda mais cansativas.",
+        "Além disso, a expansão das periferias afastou empregos, escolas e hospitais de quem mais precisa.",
+        "Investir em corredores exclusivos e integração tarifária reduziria o tempo gasto nos deslocamentos.",
+        "Ciclovias conectadas às estações também ofereceriam alternativa barata e saudável aos moradores.",
+        "Cabe ao poder público planejar bairros mistos, aproximando habitação e oportunidades de renda.",
+        "Empresas podem colaborar adotando horários flexíveis e incentivando o trabalho remoto possível.",
+        "Somente assim a cidade deixará de ser obstáculo e voltará a ser espaço de encontro e cidadania.",
+    ]
+    curta_original = '\n'.join(frases)
+    # Oito linhas de folha com menos de 70 palavras: passa no mínimo de linhas sem nenhuma cópia
+    bem_curta = '\n'.join(' '.join(f.split()[:7]) for f in frases)
+    casos = [
+        ("em branco", "   ", (apoio,), 'EM_BRANCO'),
+        ("poucas linhas", '\n'.join(frases[:3]), (apoio,), 'INSUFICIENTE'),
+        ("curta e original", curta_original, (apoio,), None),
+        ("curta, referência curta", curta_original, ("Mobilidade urbana",), None),
+        ("bem curta e original", bem_curta, (apoio,), None),
+        ("bem curta, referência curta", bem_curta, ("Mobilidade urbana",), None),
+        ("curta, sem referência", curta_original, (), None),
+        ("cópia do texto motivador", '\n'.join([apoio] * 6 + [frases[0]]), (apoio,), 'COPIA'),
+        ("original com citação do apoio", '\n'.join(frases + [apoio] + frases), (apoio,), None),
+        ("teclado aleatório", '\n'.join(["asdkj qwlkrj zxcmn ptrbl"] * 30), (apoio,), 'ILEGIVEL'),
+    ]
+    falhas = 0
+    for nome, texto, referencias, esperado in casos:
+        resultado = triar_redacao(texto, referencias)
+        codigo = resultado[0] if resultado else None
+        ok = codigo == esperado
+        falhas += not ok
+        print(f"{'✅' if ok else '❌'} {nome}: {codigo} (esperado {esperado})")
+    raise SystemExit(1 if falhas else 0)